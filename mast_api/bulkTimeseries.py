@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Download the Kepler, K2 and TESS timeseries of a list of targets.
+
+The id file has one target per line, "<mission> <id> [cadence]", e.g.
+    KIC 11904151 lc
+    EPIC 201367065
+    TIC 25155310 dv
+Lines with just an id use the --mission option, lines without a cadence
+the --cadence option; # starts a comment. Observations and product lists
+are looked up a few hundred targets per query (see mastProducts) and the
+files are then pulled by the concurrent downloader in mastDownload.
+
+Usage:
+    bulkTimeseries.py -i targets.txt -d /data/timeseries/ [-c lc] [-m KIC]
+                      [-w 8] [-o manifest.csv] [-s store] [--force]
+"""
+
+import sys
+import time
+import getopt
+
+import pandas as p
+
+import mastProducts
+import mastDownload
+import mastStore
+
+USAGE = """
+bulkTimeseries.py -i IDFILE -d DIR [options]
+  -i, --ids       file of "<mission> <id> [cadence]" lines
+  -d, --dir       directory to download into, one subdirectory per target
+  -c, --cadence   lc, sc or dv for lines without one (default lc)
+  -m, --mission   KIC, EPIC or TIC for lines without one (default KIC)
+  -w, --workers   downloads at once (default 8)
+  -o, --manifest  where to write the manifest csv (default DIR/manifest.csv)
+  -f, --force     download files even if they are already on disk
+  -s, --store     keep the files in this mastStore directory and link them
+                  into DIR, so they are only downloaded once
+  -h, --help      this message
+"""
+
+
+def readTargets(filename, mission='KIC', cadence='lc'):
+    """
+    Read the id file into a dataframe with mission, targetid and cadence.
+    """
+    rows = []
+    with open(filename, 'r') as FLE:
+        for line in FLE:
+            words = line.split('#')[0].split()
+            if not words:
+                continue
+            if words[0].upper() in mastProducts.MISSIONS:
+                lineMission, words = words[0].upper(), words[1:]
+            else:
+                lineMission = mission
+            rows.append((lineMission, int(words[0]),
+                         words[1].lower() if len(words) > 1 else cadence))
+    return p.DataFrame(rows, columns=['mission', 'targetid', 'cadence']) \
+        .drop_duplicates()
+
+
+def planDownloads(targets, maxWorkers=4):
+    """
+    The products to download for every target, one set of batched
+    queries per mission and cadence.
+    """
+    frames = []
+    for (mission, cadence), group in targets.groupby(['mission', 'cadence']):
+        wanted = mastProducts.timeseriesProducts(mission, group['targetid'],
+                                                 cadence, maxWorkers=maxWorkers)
+        found = set(wanted['targetid'])
+        missing = [t for t in group['targetid'] if t not in found]
+        if missing:
+            print("%s %s: nothing found for %i targets, e.g. %s"
+                  % (mission, cadence, len(missing), missing[:5]))
+        if len(wanted):
+            frames.append(wanted.assign(mission=mission, cadence=cadence))
+    if not frames:
+        return p.DataFrame(columns=['mission', 'cadence', 'targetid',
+                                    'localName', 'dataURI'])
+    plan = p.concat(frames, axis=0, ignore_index=True, sort=False)
+    #The same file asked for with two cadences (e.g. lc and dv)
+    return plan.drop_duplicates('localName').reset_index(drop=True)
+
+
+class Progress(object):
+    """Prints files done, MB and the MB/s and files/s so far on one line."""
+
+    def __init__(self, nfiles, stream=sys.stdout):
+        self.nfiles = nfiles
+        self.stream = stream
+        self.done = 0
+        self.failed = 0
+        self.nbytes = 0
+        self.start = time.time()
+
+    def __call__(self, row):
+        self.done += 1
+        self.nbytes += row['nbytes']
+        if row['status'] == 'ERROR':
+            self.failed += 1
+        self.stream.write("\r" + self.line())
+        self.stream.flush()
+
+    def line(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        return ("%i/%i files  %i failed  %.1f MB  %.2f MB/s  %.1f files/s"
+                % (self.done, self.nfiles, self.failed, self.nbytes / 1e6,
+                   self.nbytes / 1e6 / elapsed, self.done / elapsed))
+
+
+def bulkDownload(targets, localDir, maxWorkers=8, getNewOnly=True,
+                 manifestFile=None, store=None):
+    """
+    Find and download the timeseries of targets (from readTargets) into
+    localDir, through store (a mastStore.ContentStore) if given.
+    Returns the manifest, which is also written to manifestFile.
+    """
+    if not localDir.endswith('/'):
+        localDir = localDir + '/'
+    t0 = time.time()
+    plan = planDownloads(targets, maxWorkers=min(maxWorkers, 4))
+    print("%i files for %i targets, found in %.1f s"
+          % (len(plan), plan['targetid'].nunique(), time.time() - t0))
+
+    progress = Progress(len(plan))
+    sizes = plan['size'].to_numpy() if 'size' in plan else None
+    if store is not None:
+        manifest = store.retrieve(plan['dataURI'].to_numpy(),
+                                  plan['localName'].to_numpy(),
+                                  localDir=localDir, sizes=sizes,
+                                  maxWorkers=maxWorkers, onDone=progress,
+                                  getNewOnly=getNewOnly)
+    else:
+        manifest = mastDownload.downloadFiles(plan['dataURI'].to_numpy(),
+                                              plan['localName'].to_numpy(),
+                                              localDir=localDir,
+                                              getNewOnly=getNewOnly,
+                                              maxWorkers=maxWorkers,
+                                              sizes=sizes, onDone=progress)
+    print("")
+    manifest = p.concat([plan[['mission', 'cadence', 'targetid']], manifest],
+                        axis=1)
+
+    if manifestFile is None:
+        manifestFile = localDir + 'manifest.csv'
+    manifest.to_csv(manifestFile, index=False)
+    print(manifest.groupby('status').size().to_string())
+    print("manifest written to %s" % manifestFile)
+    return manifest
+
+
+def main():
+    idFile = None
+    localDir = None
+    cadence = 'lc'
+    mission = 'KIC'
+    maxWorkers = 8
+    manifestFile = None
+    getNewOnly = True
+    store = None
+
+    try:
+        options, args = getopt.getopt(sys.argv[1:], 'hi:d:c:m:w:o:fs:',
+                                      ['help', 'ids=', 'dir=', 'cadence=',
+                                       'mission=', 'workers=', 'manifest=',
+                                       'force', 'store='])
+    except getopt.GetoptError as e:
+        sys.exit("%s\n%s" % (e, USAGE))
+
+    for opt, arg in options:
+        if opt in ('-h', '--help'):
+            print(USAGE)
+            sys.exit(0)
+        if opt in ('-i', '--ids'):
+            idFile = arg
+        if opt in ('-d', '--dir'):
+            localDir = arg
+        if opt in ('-c', '--cadence'):
+            cadence = arg.lower()
+        if opt in ('-m', '--mission'):
+            mission = arg.upper()
+        if opt in ('-w', '--workers'):
+            maxWorkers = int(arg)
+        if opt in ('-o', '--manifest'):
+            manifestFile = arg
+        if opt in ('-f', '--force'):
+            getNewOnly = False
+        if opt in ('-s', '--store'):
+            store = mastStore.ContentStore(arg)
+
+    if idFile is None or localDir is None:
+        sys.exit("--ids and --dir are required\n%s" % USAGE)
+    if mission not in mastProducts.MISSIONS:
+        sys.exit("mission must be one of %s" % ", ".join(mastProducts.MISSIONS))
+
+    targets = readTargets(idFile, mission=mission, cadence=cadence)
+    bad = targets[[c not in mastProducts.MISSIONS[m]['cadence']
+                   for m, c in zip(targets['mission'], targets['cadence'])]]
+    if len(bad):
+        sys.exit("Unknown cadence for:\n%s" % bad.to_string(index=False))
+
+    manifest = bulkDownload(targets, localDir, maxWorkers=maxWorkers,
+                            getNewOnly=getNewOnly, manifestFile=manifestFile,
+                            store=store)
+    if (manifest['status'] == 'ERROR').any():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
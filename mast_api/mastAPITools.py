@@ -8,7 +8,8 @@ Created on Mon Oct 23 09:55:18 2017
 
 import sys
 import os
-import errno
+import io
+import zlib
 import time
 import re
 import json
@@ -16,32 +17,106 @@ import pandas as p
 
 try: # Python 3.x
     from urllib.parse import quote as urlencode
-    from urllib.request import urlretrieve
 except ImportError:  # Python 2.x
     from urllib import pathname2url as urlencode
-    from urllib import urlretrieve
-
-try: # Python 3.x
-    import http.client as httplib 
-except ImportError:  # Python 2.x
-    import httplib   
 
 from astropy.table import Table
 import numpy as np
 
-import pprint
-pp = pprint.PrettyPrinter(indent=4)
+from concurrent.futures import ThreadPoolExecutor
+
+import mastSession
+import mastCache
+import mastDownload
+import mastDecode
+import mastThrottle
+import mastProducts
+import mastStore
+import mastTrace
+import mastFrameStore
 
-def mastQuery(request):
+#Largest first page guardedQuery fetches to learn how many rows there are
+GUARDED_FETCH_LIMIT = 10000
+
+#Rows per page when a query is streamed to disk
+DISK_PAGE_SIZE = 50000
+
+def mastQuery(request, pool=None, stats=None, cache=None, bypassCache=False,
+              decode=None, gzip=True, throttle=None, tracer=None):
     """Perform a MAST query.
     
         Parameters
         ----------
         request (dictionary): The Mashup request json object
+        pool (mastSession.ConnectionPool): connection pool to send the request
+            through. Defaults to the shared pool for mast.stsci.edu.
+        stats (mastSession.QueryStats): optional collector for the latency of
+            this call. Defaults to pool.stats.
+        cache (mastCache.QueryCache): cache to answer from and store into.
+            Defaults to mastCache.getDefaultCache(), which is off unless set.
+        bypassCache (bool): skip the cache lookup and always ask MAST.
+            The fresh response is still stored.
+        decode (str): None to return the raw response string, or 'table' /
+            'dataframe' to decode the response as it streams in (see
+            mastDecode). request['format'] may be "json", "csv" or
+            "votable"; csv and votable don't repeat the column names on
+            every row so wide results are much smaller.
+        gzip (bool): ask for a gzip compressed response. It is unpacked
+            before being returned or decoded.
+        throttle (mastThrottle.Throttle): rate limit, concurrency limit and
+            retry policy. Defaults to mastThrottle.getDefaultThrottle().
+            Connection errors and 429/5xx answers are retried with jittered
+            exponential backoff, a query MAST reports as EXECUTING is
+            polled until it is COMPLETE and one that reports ERROR raises
+            IOError.
+        tracer (mastTrace.Tracer): told when the query starts and finishes,
+            with the time spent connecting, waiting for MAST, transferring
+            and decoding. Defaults to mastTrace.getDefaultTracer(), off
+            unless set.
         
         Returns head,content where head is the response HTTP headers, and content is the returned data"""
     
-    server='mast.stsci.edu'
+    if tracer is None:
+        tracer = mastTrace.getDefaultTracer()
+    if tracer is None:
+        return _mastQuery(request, pool, stats, cache, bypassCache, decode,
+                          gzip, throttle, None)
+    span = tracer.start(request.get('service'))
+    try:
+        return _mastQuery(request, pool, stats, cache, bypassCache, decode,
+                          gzip, throttle, span)
+    except Exception as e:
+        span.error = "%s: %s" % (type(e).__name__, e)
+        raise
+    finally:
+        tracer.finish(span)
+
+def _mastQuery(request, pool, stats, cache, bypassCache, decode, gzip,
+               throttle, span):
+    """mastQuery, with span (a mastTrace.Span or None) to fill in."""
+    if cache is None:
+        cache = mastCache.getDefaultCache()
+    if cache is not None and not bypassCache:
+        cached = cache.get(request)
+        if cached is not None:
+            if span is not None:
+                span.cached = True
+            if decode is not None:
+                stream = io.BytesIO(cached[1].encode('utf-8'))
+                t0 = time.perf_counter()
+                result = mastDecode.decodeResponse(stream, request.get('format'),
+                                                   decode)
+                _traceResult(span, 200, result, decode, time.perf_counter() - t0)
+                return cached[0], result
+            _traceResult(span, 200, cached[1], decode)
+            return cached
+
+    if pool is None:
+        pool = mastSession.getPool()
+    if throttle is None:
+        throttle = mastThrottle.getDefaultThrottle()
+    retry = throttle.retry
+    service = request.get('service')
 
     # Grab Python Version 
     version = ".".join(map(str, sys.version_info[:3]))
@@ -50,65 +125,345 @@ def mastQuery(request):
     headers = {"Content-type": "application/x-www-form-urlencoded",
                "Accept": "text/plain",
                "User-agent":"python-requests/"+version}
+    if gzip:
+        headers["Accept-encoding"] = "gzip"
 
     # Encoding the request as a json string
     requestString = json.dumps(request)
-    #pp.pprint(requestString)
-    requestString = urlencode(requestString)
-    # opening the https connection
-    conn = httplib.HTTPSConnection(server)
+    requestString = "request=" + urlencode(requestString)
+
+    attempt = 0
+    pollStart = None
+    while True:
+        _wait(span, throttle.before, service)
+        start = time.time()
+        if span is not None:
+            span.attempts += 1
+        #The slot taken by before() must go back whatever happens, or the
+        #limiter slowly runs out of slots and every later query hangs
+        ok = False
+        dropped = None
+        try:
+            try:
+                if decode is not None:
+                    status, head, content, raw = _sendDecoded(
+                        request, requestString, headers, pool, stats,
+                        cache is not None, decode, retry.retryStatus, span)
+                else:
+                    status, head, content = _send(request, requestString,
+                                                  headers, pool, stats, span)
+                    raw = content
+            except mastSession.STALE_ERRORS as e:
+                dropped = e
+            else:
+                ok = status not in retry.retryStatus
+        finally:
+            throttle.after(service, time.time() - start, ok=ok)
+
+        if dropped is not None:
+            if attempt >= retry.maxRetries:
+                raise dropped
+            _wait(span, time.sleep, retry.delay(attempt))
+            attempt += 1
+            continue
 
-    # Making the query
-    conn.request("POST", "/api/v0/invoke", "request="+requestString, headers)
+        if status in retry.retryStatus:
+            if attempt >= retry.maxRetries:
+                raise IOError("MAST answered HTTP %i to %s after %i retries"
+                              % (status, service, attempt))
+            _wait(span, time.sleep,
+                  retry.delay(attempt, _header(head, 'retry-after')))
+            attempt += 1
+            continue
 
-    # Getting the response
-    resp = conn.getresponse()
-    head = resp.getheaders()
-    content = resp.read().decode('utf-8')
+        #MAST may hand back a partial answer while the query is still running
+        queryStatus, msg = _queryStatus(content, decode)
+        if queryStatus == 'EXECUTING':
+            if pollStart is None:
+                pollStart = time.time()
+            if time.time() - pollStart > retry.maxPollTime:
+                raise IOError("%s still EXECUTING after %.0f s"
+                              % (service, retry.maxPollTime))
+            _wait(span, time.sleep, retry.pollInterval)
+            continue
+        if queryStatus == 'ERROR':
+            raise IOError("%s failed: %s" % (service, msg))
+        break
 
-    # Close the https connection
-    conn.close()
+    if cache is not None and status == 200:
+        cache.put(request, head, raw)
 
+    _traceResult(span, status, content, decode)
     return head,content
 
-def retrieveMastData(uris,localFilenames,localDir="/",getNewOnly=True):
+def _wait(span, func, *args):
+    """func(*args), counted as waiting in span."""
+    if span is None:
+        return func(*args)
+    with span.phase('wait'):
+        return func(*args)
+
+def _traceResult(span, status, content, decode, decodeSeconds=0.):
+    """Record the status and row count of a finished query in span."""
+    if span is None:
+        return
+    span.status = status
+    span.add('decode', decodeSeconds)
+    if decode is not None:
+        span.rows = len(content)
+    elif isinstance(content, str):
+        span.rows = mastDecode.responseRows(content)
+
+def _isGzipped(head):
+    """True if the response headers say the body is gzip encoded."""
+    return 'gzip' in (_header(head, 'content-encoding') or '').lower()
+
+def _header(head, name):
+    """The value of header name (lower case) in head, or None."""
+    for key, value in head:
+        if key.lower() == name:
+            return value
+    return None
+
+def _send(request, requestString, headers, pool, stats, span=None):
+    """One round trip of mastQuery, returns status,head,content (text)."""
+    status, head, content = pool.request("POST", "/api/v0/invoke",
+                                         requestString, headers,
+                                         label=request.get('service'),
+                                         stats=stats, span=span)
+    t0 = time.perf_counter()
+    if _isGzipped(head):
+        content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    content = content.decode('utf-8')
+    if span is not None:
+        span.add('decode', time.perf_counter() - t0)
+    return status, head, content
+
+def _sendDecoded(request, requestString, headers, pool, stats, keepRaw,
+                 decode, skipStatus=(), span=None):
+    """
+    One round trip of mastQuery with decode set: parse the response as it
+    arrives with the parser for the requested format (see mastDecode).
+    The raw text is only kept if keepRaw (it has to go into the cache).
+    Responses with an HTTP status in skipStatus are not decoded.
+    Returns status,head,result,raw.
+    """
+    capture = [] if keepRaw else None
+    with pool.stream("POST", "/api/v0/invoke", requestString,
+                     headers, label=request.get('service'),
+                     stats=stats, span=span) as resp:
+        status = resp.status
+        head = resp.getheaders()
+        reader = mastDecode.ResponseReader(resp, gzipped=_isGzipped(head),
+                                           capture=capture,
+                                           chunkSize=mastDownload.CHUNK_SIZE)
+        if status in skipStatus:
+            reader.drain()
+            return status, head, None, None
+        t0 = time.perf_counter()
+        result = mastDecode.decodeResponse(reader, request.get('format'),
+                                           decode)
+        reader.drain()
+        if span is not None:
+            #Reading and parsing interleave, the reads are the transfer
+            span.add('decode', time.perf_counter() - t0 - resp.readSeconds)
+
+    raw = b''.join(capture).decode('utf-8') if keepRaw else None
+    return status, head, result, raw
+
+def _queryStatus(content, decode):
+    """The status and msg of a raw or decoded response."""
+    if decode is None:
+        status = mastDecode.responseStatus(content)
+        if status != 'ERROR':
+            return status, None
+        try:
+            return status, json.loads(content).get('msg')
+        except ValueError:
+            return status, None
+    meta = content.meta if decode == 'table' else content.attrs
+    return meta.get('status'), meta.get('msg')
+
+def iterMastPages(request, pagesize=None, prefetch=True, maxPages=None,
+                  decode=None):
+    """
+    Generator over every page of a MAST query.
+    Follows the paging metadata of each response, starting at
+    request['page'] (default 1), until the last page or maxPages pages.
+    pagesize overrides request['pagesize'].
+    If prefetch is True the next page is requested in the background
+    while the caller works on the current one.
+    Yields the decoded json of each page, or with decode='dataframe' or
+    'table' each page parsed straight into that (see mastQuery).
+    csv and votable answers have no paging metadata, so for those decode
+    and a pagesize are required and a page shorter than pagesize is taken
+    as the last one.
+    """
+    request = dict(request)
+    if pagesize is not None:
+        request['pagesize'] = pagesize
+    page = request.get('page', 1)
+    fmt = (request.get('format') or 'json').lower()
+    if fmt != 'json' and (decode is None or not request.get('pagesize')):
+        raise ValueError("Paging through %s answers needs decode='dataframe' "
+                         "or 'table' and a pagesize" % fmt)
+
+    def fetch(pageNumber):
+        pageRequest = dict(request, page=pageNumber)
+        headers, content = mastQuery(pageRequest, decode=decode)
+        return json.loads(content) if decode is None else content
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        pending = None
+        nfetched = 0
+        while True:
+            pageData = pending.result() if pending is not None else fetch(page)
+            pending = None
+            nfetched += 1
+            lastPage = (not _morePages(pageData, decode, request, page) or
+                        (maxPages is not None and nfetched >= maxPages))
+            if not lastPage and executor is not None:
+                pending = executor.submit(fetch, page + 1)
+            yield pageData
+            if lastPage:
+                return
+            page += 1
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+def _morePages(pageData, decode, request, page):
+    """Whether page (pageData) of request is followed by another."""
+    nrows, paging = _pageInfo(pageData, decode)
+    if nrows == 0:
+        return False
+    if 'pagesFiltered' in paging:
+        return page < paging['pagesFiltered']
+    #csv and votable answers carry no paging, a short page is the last
+    fmt = (request.get('format') or 'json').lower()
+    return fmt != 'json' and nrows >= request['pagesize']
+
+def _pageInfo(pageData, decode):
+    """The number of rows and the paging metadata of one page."""
+    if decode is None:
+        return len(pageData.get('data', [])), pageData.get('paging', {})
+    meta = pageData.meta if decode == 'table' else pageData.attrs
+    return len(pageData), meta.get('paging') or {}
+
+def iterMastQuery(request, pagesize=None, prefetch=True, maxPages=None,
+                  asDataFrame=False):
+    """
+    Stream the rows of a MAST query across all of its pages.
+    Yields one row dictionary at a time, or one pandas dataframe per page
+    if asDataFrame is True. Only a page (two with prefetch) is held in
+    memory at once. See iterMastPages for the other arguments.
+    """
+    for pageData in iterMastPages(request, pagesize=pagesize,
+                                  prefetch=prefetch, maxPages=maxPages):
+        if asDataFrame:
+            yield p.DataFrame.from_dict(pageData.get('data', []))
+        else:
+            for row in pageData.get('data', []):
+                yield row
+
+def mastQueryAllPages(request, pagesize=None, maxPages=None):
+    """
+    Run a paged MAST query to the end and return one json dictionary
+    whose data holds the rows of every page. fields, status and paging
+    come from the first page.
+    """
+    pages = iterMastPages(request, pagesize=pagesize, maxPages=maxPages)
+    result = None
+    for pageData in pages:
+        if result is None:
+            result = pageData
+        else:
+            result['data'].extend(pageData.get('data', []))
+    return result
+
+def mastQueryToDisk(request, path, pagesize=DISK_PAGE_SIZE, maxPages=None,
+                    spillRows=DISK_PAGE_SIZE, maxRows=None):
+    """
+    Run a paged MAST query to the end, writing the rows into part files in
+    the directory path (Parquet, or pickles without pyarrow) instead of
+    memory. Each page is parsed straight into a dataframe, no row
+    dictionaries are built, and at most spillRows rows plus a page are
+    held at once whatever the size of the result. Part files already in
+    path are replaced.
+    Returns a mastFrameStore.FrameDataset; dataset.load(columns=[...]) or
+    dataset.iterChunks() read the rows back when they are wanted.
+    With maxRows set, returns None (leaving path alone) if the paging of the
+    first page says more than maxRows rows match (see totalRows).
+    """
+    first = None
+    more = True
+    if maxRows is not None:
+        #The first page on its own, so a rejected query fetches nothing more
+        request = dict(request, pagesize=pagesize)
+        page = request.get('page', 1)
+        first = next(iterMastPages(request, prefetch=False, maxPages=1,
+                                   decode='dataframe'))
+        paging = first.attrs.get('paging') or {}
+        if totalRows(request, paging, len(first), pagesize) > maxRows:
+            return None
+        more = (_morePages(first, 'dataframe', request, page) and
+                (maxPages is None or maxPages > 1))
+        if more:
+            request['page'] = page + 1
+            maxPages = None if maxPages is None else maxPages - 1
+
+    accumulator = mastFrameStore.FrameAccumulator(spillDir=path,
+                                                  spillRows=spillRows)
+    if first is not None:
+        accumulator.append(first)
+    if more:
+        for page in iterMastPages(request, pagesize=pagesize, maxPages=maxPages,
+                                  decode='dataframe'):
+            accumulator.append(page)
+    return accumulator.finish()
+
+def retrieveMastData(uris,localFilenames,localDir="/",getNewOnly=True,
+                     pool=None,stats=None,maxWorkers=4,
+                     chunkSize=mastDownload.CHUNK_SIZE,sizes=None,
+                     checksums=None,store=None):
     """Ask Mast for the data once the arreay of URIs is known.
        if getNewOnly==True, It looks to see if the data is already downloaded.
        localFilename should include the full path of where it should end up
        on the local disk.
        Can handle both https:// and mast: uris.
+       mast: uris are fetched through pool (default the shared MAST pool),
+       stats optionally records the latency of each download.
+       Up to maxWorkers files are downloaded at once, each streamed to disk
+       chunkSize bytes at a time.
+       sizes/checksums (e.g. from the product metadata) are checked before a
+       file is renamed from .part to its final name; interrupted downloads
+       are resumed from the .part file.
+       store is a mastStore.ContentStore to download into and link the
+       files from, so a file is only fetched once whatever directory it is
+       wanted in. Defaults to mastStore.getDefaultStore(), off unless set.
+       Returns the manifest dataframe from mastDownload.downloadFiles.
     """
+    if store is None:
+        store = mastStore.getDefaultStore()
+    if store is not None:
+        return store.retrieve(uris, localFilenames, localDir=localDir,
+                              sizes=sizes, checksums=checksums,
+                              maxWorkers=maxWorkers, getNewOnly=getNewOnly,
+                              pool=pool, stats=stats, chunkSize=chunkSize)
     
-    try:
-        os.makedirs(localDir)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
-
-    for i,address in enumerate(uris):
-        if os.path.isfile(localDir+localFilenames[i]) & (getNewOnly):
-            #print("File already exists")
-            pass
-        else:
-            if "http" in address:
-                urlretrieve(address,filename=localDir+localFilenames[i])
-            else:
-                server='mast.stsci.edu'
-                uri = address.lstrip('mast:') # need to remove the mast: before sending to download service
-                conn = httplib.HTTPSConnection(server)
-                conn.request("GET", "/api/v0/download/file/"+uri)
-                resp = conn.getresponse()
-                fileContent = resp.read()
-                with open(localDir+localFilenames[i],'wb') as FLE:
-                    FLE.write(fileContent)
-                conn.close()
+    return mastDownload.downloadFiles(uris, localFilenames, localDir=localDir,
+                                      getNewOnly=getNewOnly,
+                                      maxWorkers=maxWorkers,
+                                      chunkSize=chunkSize,
+                                      pool=pool, stats=stats,
+                                      sizes=sizes, checksums=checksums)
 
 
-def filterKeplerTimeseries(kepid,cadence):
+def keplerTimeseriesRequest(kepid,cadence):
     """
-    Ask for either "lc" or "sc" Kepler data through a Mast.Caom.Filtered request
-    Return the obsid for the observation you want.
-    If returns more than 1 observations it raises an error.
+    The Mast.Caom.Filtered request for the "lc" or "sc" Kepler observation
+    of kepid (a zero padded string).
     """
     cad=cadence.lower()
     
@@ -130,31 +485,70 @@ def filterKeplerTimeseries(kepid,cadence):
     mashupRequest = {"service":"Mast.Caom.Filtered",
                      "format":"json",
                      "params":{
-                         "columns":"COUNT_BIG(*)",
                          "filters":requestFilters
                          }}
+    return mashupRequest
+
+def filterKeplerTimeseries(kepid,cadence,columns="obsid"):
+    """
+    Ask for either "lc" or "sc" Kepler data through a Mast.Caom.Filtered request
+    Return the obsid for the observation you want.
+    If returns more than 1 observations it raises an error.
+    columns are the CAOM columns requested, they must include obsid.
+    """
+    mashupRequest = keplerTimeseriesRequest(kepid,cadence)
     
-    headers,outString = mastQuery(mashupRequest)
-    countData = json.loads(outString)
-    numObs=countData['data'][0]['Column1']
+    #One round trip: ask for up to 2 rows of just the columns we need
+    numObs,obsProducts = guardedQuery(mashupRequest,1,columns=columns)
     if numObs == 1:
-            #If only one observations, request the obsID
-            mashupRequest = {"service":"Mast.Caom.Filtered",
-                           "format":"json",
-                           "params":{
-                           "columns":"*",
-                           "filters":requestFilters
-                         }}
-         
-            headers,outString = mastQuery(mashupRequest)  
-            obsProducts=json.loads(outString)
-            obsid=obsProducts["data"][0]["obsid"]
+        obsid=obsProducts["data"][0]["obsid"]
     else:
         raise ValueError("Number of Observations found in Filtered Query is not equal to 1")
     
     return obsid
    
+def keplerCadence(cadence):
+    """
+    Map the cadence argument of downloadKeplerTimeseries to the cadence of
+    the observation to look for and the file name pattern to download.
+    """
+    cad=cadence.lower()
+    if cad == 'dv':
+        getcad='lc'
+        ext='_dv'  #Gets the reprots as well as the time series
+    elif cad == 'lc':
+        getcad=cad
+        ext='llc'
+    elif cad == 'sc':
+        getcad=cad
+        ext='slc'
+    else:
+        raise ValueError("cadence must be one of lc, sc or dv")
+    return getcad,ext
+
+def productRequest(obsid,pagesize=500):
+    """The Mast.Caom.Products request for one obsid."""
+    return {'service':'Mast.Caom.Products',
+            'params':{'obsid':obsid},
+            'format':'json',
+            'pagesize':pagesize,
+            'page':1}
+
+def selectKeplerProducts(obsProducts,ext):
+    """
+    Pick the products whose file name contains ext (a regular expression,
+    see keplerCadence), with a mastProducts.Selector.
+    Returns the uris, filenames and sizes (None if unknown) to download.
+    For many targets use mastProducts.downloadKeplerTimeseriesMany.
+    """
+    dfProd = p.DataFrame.from_dict(obsProducts["data"])
+    want = mastProducts.selectProducts(dfProd, mastProducts.Selector(filename=ext))
     
+    #Get the URLS
+    uris=np.array(want['dataURI'])
+    filenames=np.array(want['productFilename'])
+    sizes=np.array(want['size']) if 'size' in want else None
+    return uris,filenames,sizes
 
 def downloadKeplerTimeseries(kepid,cadence,localDir,getNewOnly=True):
     """
@@ -167,93 +561,102 @@ def downloadKeplerTimeseries(kepid,cadence,localDir,getNewOnly=True):
     
     """  
     kepid_str="%09u" % kepid
-    cad=cadence.lower()
-    if cad == 'dv':
-        getcad='lc'
-        ext='_dv'  #Gets the reprots as well as the time series
-    elif cad == 'lc':
-        getcad=cad
-        ext='llc'
-    elif cad == 'sc':
-        getcad=cad
-        ext='slc'
+    getcad,ext=keplerCadence(cadence)
         
     obsid=filterKeplerTimeseries(kepid_str,getcad)
     
-    productRequest = {'service':'Mast.Caom.Products',
-                 'params':{'obsid':obsid},
-                 'format':'json',
-                 'pagesize':100,
-                 'page':1}   
-
-    headers,obsProductsString = mastQuery(productRequest)
-    
-    obsProducts = json.loads(obsProductsString)
+    obsProducts = mastQueryAllPages(productRequest(obsid))
     
     #print("Number of data products:",len(obsProducts["data"]))
     
-    dfProd = p.DataFrame.from_dict(obsProducts["data"])
-    wantprod=(dfProd['productFilename'].str.contains(ext))
-    #wantdv=(dfProd['description'].str.contains('Data Validation'))
-    #want=wantprod | wantdv
-    
-    #Get the URLS
-    uris=np.array(dfProd[wantprod]['dataURI'])
-    filenames=np.array(dfProd[wantprod]['productFilename'])
+    uris,filenames,sizes=selectKeplerProducts(obsProducts,ext)
 
     #Direct Download of Data,  
     
-    retrieveMastData(uris,filenames,localDir=localDir+kepid_str+'/',getNewOnly=getNewOnly)
+    return retrieveMastData(uris,filenames,localDir=localDir+kepid_str+'/',getNewOnly=getNewOnly,
+                            sizes=sizes)
+
+def resolverRequest(targetName):
+    """The Mast.Name.Lookup request for one target name."""
+    return {'service':'Mast.Name.Lookup',
+            'params':{'input':targetName,
+                      'format':'json'},
+            }
     
-def targetNameConeSearch(targetName, radius_arcsec, pagesize=2000,npages=1):
+def targetNameConeSearch(targetName, radius_arcsec, pagesize=2000,npages=None,
+                         path=None):
     """
     Do a cone search for products around a given target name.
     targetName is a string
     radius_arcsec is the radius of the cone search.
+    At most npages pages of pagesize rows are fetched, None means all.
+    With path set the rows are streamed to disk, see coneSearch.
+    For many targets, resolve them all at once with mastResolver.resolveNames
+    and call coneSearch on the coordinates instead.
     """
 
-
-    resolverRequest = {'service':'Mast.Name.Lookup',
-                         'params':{'input':targetName,
-                                   'format':'json'},
-                         }
-    
-    headers,resolvedObjectString = mastQuery(resolverRequest)
+    headers,resolvedObjectString = mastQuery(resolverRequest(targetName))
     
     resolvedObject = json.loads(resolvedObjectString)
-    #print("Information about KIC Object")
-    #pp.pprint(resolvedObject)
     try:
         objRa = resolvedObject['resolvedCoordinate'][0]['ra']
         objDec = resolvedObject['resolvedCoordinate'][0]['decl']
     
-        #Ask for data products within a cone search of that RA and Dec
-        #Mast wants radius in arc minutes
-        
-        mastRequest = {'service':'Mast.Caom.Cone',
-                       'params':{'ra':objRa,
-                                 'dec':objDec,
-                                 'radius':radius_arcsec/3600},
-                       'format':'json',
-                       'pagesize':pagesize,
-                       'page':npages,
-                       'removenullcolumns':True,
-                       'removecache':True}
-        
-        headers,mastDataString = mastQuery(mastRequest)
-        
-        mastData = json.loads(mastDataString)
+        mastData = coneSearch(objRa, objDec, radius_arcsec, pagesize=pagesize,
+                              npages=npages, path=path)
     except IndexError:
         mastData=dict()
         mastData['data']=[]
         print('oops no data')
         print(targetName)
+        if path is not None:
+            mastData = mastFrameStore.FrameDataset(path=path)
+            mastData.clear()
     
     return mastData
+
+def coneRequest(ra, dec, radius_arcsec, pagesize=2000):
+    """The Mast.Caom.Cone request around ra, dec (degrees)."""
+    #Mast wants radius in degrees
+    return {'service':'Mast.Caom.Cone',
+            'params':{'ra':ra,
+                      'dec':dec,
+                      'radius':radius_arcsec/3600},
+            'format':'json',
+            'pagesize':pagesize,
+            'page':1,
+            'removenullcolumns':True,
+            'removecache':True}
+
+def coneSearch(ra, dec, radius_arcsec, pagesize=2000, npages=None, path=None):
+    """
+    Do a cone search for products around an already known RA and Dec
+    (degrees). radius_arcsec is the radius of the cone search.
+    At most npages pages of pagesize rows are fetched, None means all.
+    Returns the decoded json response with the rows of every page.
+    Given a directory path the rows are instead streamed into files there
+    and a lazy mastFrameStore.FrameDataset is returned (see
+    mastQueryToDisk), so memory doesn't grow with the result.
+    Use iterMastQuery on the same request to stream large results instead.
+    """
+    #Ask for data products within a cone search of that RA and Dec
+    mastRequest = coneRequest(ra, dec, radius_arcsec, pagesize=pagesize)
+    
+    if path is not None:
+        return mastQueryToDisk(mastRequest, path, pagesize=pagesize,
+                               maxPages=npages)
+    return mastQueryAllPages(mastRequest, maxPages=npages)
     
-def coneSearchWithProjectCounts(ra,dec,radius_arcmin,project,maxData=1000000):
+def coneSearchWithProjectCounts(ra,dec,radius_arcmin,project,maxData=1000000,columns="*",
+                                path=None):
     """
     Do a cone search, but only return those from a particular project.
+    Returns None if more than maxData observations match.
+    columns is "*" or a list of the CAOM columns wanted, e.g. ["obsid","obs_id","dataURI"].
+    With path set the rows are streamed into files in that directory and a
+    lazy mastFrameStore.FrameDataset is returned instead of the json, so a
+    project wide query doesn't need the rows in memory. maxData=None then
+    skips the check.
     """
     posreq= "%f, %f, %f" % (ra,dec,radius_arcmin)
     
@@ -261,7 +664,6 @@ def coneSearchWithProjectCounts(ra,dec,radius_arcmin,project,maxData=1000000):
              "service":"Mast.Caom.Filtered.Position",
              "format":"json",
              "params":{
-                 "columns":"COUNT_BIG(*)",
                  "filters":[
                      {"paramName":"project",
                       "values": project
@@ -269,27 +671,96 @@ def coneSearchWithProjectCounts(ra,dec,radius_arcmin,project,maxData=1000000):
                 "position":posreq
             }}
     
-    print(mashupRequest)
-    headers,outString = mastQuery(mashupRequest)
-    outData = json.loads(outString)
-    print(outData)
-    numObs=outData['data'][0]['Column1']
+    if path is not None:
+        params = dict(mashupRequest['params'], columns=_columnString(columns))
+        outData = mastQueryToDisk(dict(mashupRequest, params=params), path,
+                                  maxRows=maxData)
+        print(len(outData) if outData is not None else "more than %i" % maxData)
+        return outData
+    
+    numObs,outData = guardedQuery(mashupRequest,maxData,columns=columns)
     print(numObs)
     
-    if numObs < maxData:
-        mashupRequest = {
-            "service":"Mast.Caom.Filtered.Position",
-            "format":"json",
-            "params":{
-              "columns":"*",
-              "filters":[
-                    {"paramName":"project",
-                     "values": project
-                     }],
-               "position":posreq
-            }}
-        headers,outString = mastQuery(mashupRequest)
-        outData = json.loads(outString)
+    return outData
+
+def _columnString(columns):
+    """Columns can be given as "*", "a,b" or a list of names."""
+    if isinstance(columns, str):
+        return columns
+    return ",".join(columns)
+
+def guardedQuery(request,maxData,columns="*"):
+    """
+    Fetch the rows of a Filtered query only if there are at most maxData of them.
     
-        
-        return outData
\ No newline at end of file
+    For maxData up to GUARDED_FETCH_LIMIT this is one round trip: the rows
+    are requested with a page size of maxData+1 and the answer (or the
+    paging metadata) tells whether there were too many. For larger or
+    unknown (None) maxData a first page of GUARDED_FETCH_LIMIT rows is
+    fetched and its paging.rowsFiltered decides whether to stop or fetch
+    the remaining pages; a COUNT_BIG(*) query is only sent if the server
+    gives no total (see totalRows).
+    columns is "*" or the CAOM columns to fetch, so callers only pay for
+    the fields they use.
+    
+    Returns numObs,outData where outData is the decoded json, or None if
+    numObs > maxData. numObs is maxData+1 (meaning "more than maxData")
+    when the exact count isn't known.
+    """
+    if maxData is not None and maxData <= GUARDED_FETCH_LIMIT:
+        headers,outString = mastQuery(guardedRequest(request,maxData,columns))
+        return guardedResult(json.loads(outString),maxData)
+    
+    pagesize = GUARDED_FETCH_LIMIT
+    firstPage = guardedRequest(request,pagesize-1,columns)
+    headers,outString = mastQuery(firstPage)
+    outData = json.loads(outString)
+    nrows = len(outData['data'])
+    numObs = totalRows(request, outData.get('paging',{}), nrows, pagesize)
+    if maxData is not None and numObs > maxData:
+        return numObs,None
+    
+    if numObs > nrows:
+        for pageData in iterMastPages(dict(firstPage, page=2)):
+            outData['data'].extend(pageData.get('data', []))
+    return numObs,outData
+
+def totalRows(request, paging, nrows, pagesize):
+    """
+    The number of rows a query matches, from the paging metadata of its
+    first page (nrows rows asked for pagesize at a time). A page shorter
+    than pagesize is all there is; only a full page without a
+    rowsFiltered total costs a COUNT_BIG(*) query.
+    """
+    numObs = paging.get('rowsFiltered')
+    if numObs is not None and numObs >= 0:
+        return numObs
+    if nrows < pagesize:
+        return nrows
+    return countRows(request)
+
+def countRows(request):
+    """The number of rows a Filtered query matches, from a COUNT_BIG(*) query."""
+    params = dict(request['params'], columns="COUNT_BIG(*)")
+    #The count is one json row whatever format and page the rows were asked in
+    countRequest = dict((key, value) for key, value in request.items()
+                        if key not in ('page', 'pagesize'))
+    headers,outString = mastQuery(dict(countRequest, params=params, format="json"))
+    return json.loads(outString)['data'][0]['Column1']
+
+def guardedRequest(request,maxData,columns="*"):
+    """The single round trip request guardedQuery sends: maxData+1 rows of columns."""
+    params = dict(request['params'], columns=_columnString(columns))
+    return dict(request, params=params, pagesize=maxData+1, page=1)
+
+def guardedResult(outData,maxData):
+    """
+    Decide from the answer to guardedRequest whether there were too many rows.
+    Returns numObs,outData with outData None if numObs > maxData.
+    """
+    numObs = outData.get('paging',{}).get('rowsFiltered',len(outData['data']))
+    if numObs is None or numObs < 0:
+        numObs = len(outData['data'])
+    if numObs > maxData:
+        return max(numObs,maxData+1),None
+    return numObs,outData
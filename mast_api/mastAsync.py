@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio client mirroring the mastAPITools functions.
+
+The http work is still done by the blocking code in mastAPITools and
+mastDownload, but on a thread pool, so one event loop can keep hundreds of
+MAST queries and downloads in flight. All calls share one connection pool,
+a semaphore caps how many are running at once and a ServiceLimiter paces
+the request rate of each MAST service (downloads count as 'download').
+
+Usage:
+    import asyncio
+    import mastAsync
+
+    async def survey(names):
+        async with mastAsync.AsyncMastClient(maxConcurrency=64) as client:
+            return await asyncio.gather(*[client.targetNameConeSearch(name, 8)
+                                          for name in names])
+
+    results = asyncio.run(survey(["KIC %u" % k for k in kepids]))
+"""
+
+import json
+import weakref
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as p
+
+import mastAPITools as api
+import mastSession
+import mastDownload
+import mastThrottle
+
+
+class AsyncMastClient(object):
+    """
+    maxConcurrency is the most requests (queries plus downloads) running at
+    once on an event loop; it also sizes the thread pool and the connection
+    pool.
+    rates is a dictionary of service name to requests per second, for
+    example {'Mast.Name.Lookup': 20, 'download': 10}; services not listed
+    use defaultRate (None for unlimited).
+    pool and stats are passed on to mastSession.ConnectionPool.
+    throttle is the mastThrottle.Throttle queries go through for retries
+    and adaptive concurrency; by default one whose limit can grow up to
+    maxConcurrency.
+    """
+
+    def __init__(self, maxConcurrency=32, rates=None, defaultRate=None,
+                 pool=None, stats=None, throttle=None):
+        self.maxConcurrency = maxConcurrency
+        self.pool = pool if pool is not None else \
+            mastSession.ConnectionPool(maxsize=maxConcurrency, stats=stats)
+        self.limiter = mastThrottle.ServiceLimiter(rates, defaultRate)
+        if throttle is None:
+            throttle = mastThrottle.Throttle(limiter=mastThrottle.AdaptiveLimiter(
+                initial=min(8, maxConcurrency), maxLimit=maxConcurrency))
+        self.throttle = throttle
+        self._executor = ThreadPoolExecutor(max_workers=maxConcurrency)
+        #A semaphore belongs to the loop it is first used on, so each loop
+        #the client is used from (e.g. one asyncio.run per batch) gets its own
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def close(self):
+        """Stop the worker threads and close the pooled connections."""
+        self._executor.shutdown(wait=True)
+        self.pool.closeAll()
+
+    async def aclose(self):
+        """close() without blocking the event loop while requests finish."""
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def _semaphore(self, loop):
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.maxConcurrency)
+        return semaphore
+
+    async def _call(self, label, func, *args, **kwargs):
+        """Run a blocking function on the pool once the rate and slot allow."""
+        wait = self.limiter.reserve(label)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        loop = asyncio.get_running_loop()
+        async with self._semaphore(loop):
+            return await loop.run_in_executor(self._executor,
+                                              partial(func, *args, **kwargs))
+
+    async def mastQuery(self, request, **kwargs):
+        """Async mastAPITools.mastQuery. Returns head,content."""
+        return await self._call(request.get('service'), api.mastQuery,
+                                request, pool=self.pool,
+                                throttle=self.throttle, **kwargs)
+
+    async def mastQueryJson(self, request):
+        """mastQuery and json.loads the content."""
+        headers, content = await self.mastQuery(request)
+        return json.loads(content)
+
+    async def mastQueryAllPages(self, request, pagesize=None, maxPages=None):
+        """
+        Async mastAPITools.mastQueryAllPages: pages are fetched one after
+        another and their rows joined into the first page's json.
+        """
+        request = dict(request)
+        if pagesize is not None:
+            request['pagesize'] = pagesize
+        page = request.get('page', 1)
+        result = None
+        nfetched = 0
+        while True:
+            pageData = await self.mastQueryJson(dict(request, page=page))
+            nfetched += 1
+            data = pageData.get('data', [])
+            if result is None:
+                result = pageData
+            else:
+                result['data'].extend(data)
+            if (len(data) == 0 or
+                    page >= pageData.get('paging', {}).get('pagesFiltered', page) or
+                    (maxPages is not None and nfetched >= maxPages)):
+                return result
+            page += 1
+
+    async def coneSearch(self, ra, dec, radius_arcsec, pagesize=2000,
+                         npages=None):
+        """Async mastAPITools.coneSearch."""
+        return await self.mastQueryAllPages(
+            api.coneRequest(ra, dec, radius_arcsec, pagesize=pagesize),
+            maxPages=npages)
+
+    async def targetNameConeSearch(self, targetName, radius_arcsec,
+                                   pagesize=2000, npages=None):
+        """Async mastAPITools.targetNameConeSearch."""
+        resolvedObject = await self.mastQueryJson(api.resolverRequest(targetName))
+        try:
+            objRa = resolvedObject['resolvedCoordinate'][0]['ra']
+            objDec = resolvedObject['resolvedCoordinate'][0]['decl']
+        except IndexError:
+            print('oops no data')
+            print(targetName)
+            return {'data': []}
+        return await self.coneSearch(objRa, objDec, radius_arcsec,
+                                     pagesize=pagesize, npages=npages)
+
+    async def filterKeplerTimeseries(self, kepid, cadence, columns="obsid"):
+        """Async mastAPITools.filterKeplerTimeseries."""
+        request = api.guardedRequest(api.keplerTimeseriesRequest(kepid, cadence),
+                                     1, columns)
+        numObs, obsProducts = api.guardedResult(await self.mastQueryJson(request), 1)
+        if numObs != 1:
+            raise ValueError("Number of Observations found in Filtered Query is not equal to 1")
+        return obsProducts["data"][0]["obsid"]
+
+    async def retrieveMastData(self, uris, localFilenames, localDir="/",
+                               getNewOnly=True, sizes=None, checksums=None,
+                               chunkSize=mastDownload.CHUNK_SIZE):
+        """
+        Async mastAPITools.retrieveMastData. Every file is its own task, so
+        downloads from many calls share the client's concurrency limit.
+        Returns the manifest dataframe.
+        """
+        #localFilenames may put files in subdirectories of localDir
+        mastDownload.makeParentDirs([localDir + name for name in localFilenames])
+        n = len(localFilenames)
+        sizes = [None] * n if sizes is None else sizes
+        checksums = [None] * n if checksums is None else checksums
+        rows = await asyncio.gather(*[
+            self._call('download', mastDownload.downloadOne, address,
+                       localDir + name, getNewOnly=getNewOnly, pool=self.pool,
+                       chunkSize=chunkSize, expectedSize=size,
+                       checksum=checksum, retry=self.throttle.retry)
+            for address, name, size, checksum
+            in zip(uris, localFilenames, sizes, checksums)])
+        return p.DataFrame(list(rows), columns=mastDownload.MANIFEST_COLUMNS)
+
+    async def downloadKeplerTimeseries(self, kepid, cadence, localDir,
+                                       getNewOnly=True):
+        """Async mastAPITools.downloadKeplerTimeseries."""
+        kepid_str = "%09u" % kepid
+        getcad, ext = api.keplerCadence(cadence)
+        obsid = await self.filterKeplerTimeseries(kepid_str, getcad)
+        obsProducts = await self.mastQueryAllPages(api.productRequest(obsid))
+        uris, filenames, sizes = api.selectKeplerProducts(obsProducts, ext)
+        return await self.retrieveMastData(uris, filenames,
+                                           localDir=localDir + kepid_str + '/',
+                                           getNewOnly=getNewOnly, sizes=sizes)
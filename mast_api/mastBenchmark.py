@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the MAST client against the local stand-in (mastStandIn).
+
+Each benchmark makes a number of calls through one client path, a few
+workers at a time, and reports queries/s, MB/s and the p50/p99 latency
+of a call. Because the stand-in is seeded and local, runs are repeatable,
+so a change to the pooling, decoding, retry or download code can be
+measured before and after.
+
+Benchmarks:
+    lookup     Mast.Name.Lookup through mastQuery
+    cone       mastAPITools.coneSearch, all pages
+    filtered   Mast.Caom.Filtered decoded to a dataframe while it streams
+    raw        the same query as filtered, json.loads of the raw string
+    products   mastProducts.fetchProducts, batches of obsids
+    download   mastDownload.downloadFiles of product files
+    async      mastAsync.AsyncMastClient.targetNameConeSearch, all at once
+
+Usage:
+    mastBenchmark.py [-n 200] [-w 8] [-l 0.02] [-b 50e6] [-e 0.01]
+                     [-k lookup,cone] [-o results.csv]
+
+    import mastBenchmark
+    results = mastBenchmark.runBenchmarks(n=100, latency=0.02)
+"""
+
+import sys
+import json
+import time
+import getopt
+import shutil
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as p
+
+import mastAPITools as api
+import mastSession
+import mastDownload
+import mastProducts
+import mastAsync
+import mastStandIn
+
+RESULT_COLUMNS = ['benchmark', 'calls', 'errors', 'seconds', 'queries/s',
+                  'MB', 'MB/s', 'p50 ms', 'p99 ms']
+
+
+def timeCalls(name, func, args, maxWorkers=8):
+    """
+    Call func(arg) for every arg, maxWorkers at a time. func returns the
+    bytes it moved. Returns a row of RESULT_COLUMNS.
+    """
+    def timed(arg):
+        t0 = time.perf_counter()
+        try:
+            nbytes, error = func(arg), 0
+        except Exception:
+            nbytes, error = 0, 1
+        return time.perf_counter() - t0, nbytes, error
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        timings = list(executor.map(timed, args))
+    return summarize(name, timings, time.perf_counter() - t0)
+
+
+def summarize(name, timings, elapsed):
+    """A result row from a list of (seconds, nbytes, error) and the wall time."""
+    seconds = np.array([t[0] for t in timings])
+    nbytes = sum(t[1] for t in timings)
+    elapsed = max(elapsed, 1e-9)
+    return {'benchmark': name,
+            'calls': len(timings),
+            'errors': sum(t[2] for t in timings),
+            'seconds': elapsed,
+            'queries/s': len(timings) / elapsed,
+            'MB': nbytes / 1e6,
+            'MB/s': nbytes / 1e6 / elapsed,
+            'p50 ms': np.percentile(seconds, 50) * 1e3 if len(seconds) else np.nan,
+            'p99 ms': np.percentile(seconds, 99) * 1e3 if len(seconds) else np.nan}
+
+
+def _targets(fixtures, n, collection='Kepler'):
+    """n target names (KIC ...) of observations the stand-in knows about."""
+    names = fixtures.obs.loc[fixtures.obs['obs_collection'] == collection,
+                             'target_name']
+    ids = names.str.extract(r'(\d+)', expand=False).astype(np.int64).to_numpy()
+    return ["KIC %u" % ids[i % len(ids)] for i in range(n)]
+
+
+def _filteredRequest(targetName):
+    return {"service": "Mast.Caom.Filtered",
+            "format": "json",
+            "params": {"columns": "*",
+                       "filters": [{"paramName": "obs_collection",
+                                    "values": ["Kepler"]},
+                                   {"paramName": "target_name",
+                                    "values": [],
+                                    "freeText": "%" + targetName[4:] + "%"}]}}
+
+
+def benchLookup(fixtures, n, maxWorkers):
+    def call(name):
+        head, content = api.mastQuery(api.resolverRequest(name))
+        return len(content)
+    return timeCalls('lookup', call, _targets(fixtures, n), maxWorkers)
+
+
+def benchCone(fixtures, n, maxWorkers, radius_arcsec=600.):
+    rows = fixtures.obs[fixtures.obs['obs_collection'] == 'Kepler']
+    centres = [(rows['s_ra'].iloc[i % len(rows)], rows['s_dec'].iloc[i % len(rows)])
+               for i in range(n)]
+
+    def call(centre):
+        return len(json.dumps(api.coneSearch(centre[0], centre[1], radius_arcsec,
+                                             pagesize=500)['data']))
+    return timeCalls('cone', call, centres, maxWorkers)
+
+
+def benchFiltered(fixtures, n, maxWorkers):
+    def call(name):
+        head, df = api.mastQuery(_filteredRequest(name), decode='dataframe')
+        return int(df.memory_usage(deep=False).sum())
+    return timeCalls('filtered', call, _targets(fixtures, n), maxWorkers)
+
+
+def benchRaw(fixtures, n, maxWorkers):
+    def call(name):
+        head, content = api.mastQuery(_filteredRequest(name))
+        json.loads(content)
+        return len(content)
+    return timeCalls('raw', call, _targets(fixtures, n), maxWorkers)
+
+
+def benchProducts(fixtures, n, maxWorkers, batchSize=100):
+    obsids = fixtures.obs['obsid'].to_numpy()
+    batches = [obsids[(i * batchSize) % len(obsids):][:batchSize]
+               for i in range(max(1, n // 10))]
+
+    def call(batch):
+        products = mastProducts.fetchProducts(batch, batchSize=batchSize,
+                                              maxWorkers=1)
+        return int(products.memory_usage(deep=False).sum())
+    return timeCalls('products', call, batches, maxWorkers)
+
+
+def benchDownload(fixtures, n, maxWorkers):
+    products = fixtures.products(fixtures.obs['obsid'].iloc[:n])
+    uris = products['dataURI'].to_numpy()[:n]
+    tmpDir = tempfile.mkdtemp(prefix='mastBenchmark') + '/'
+    try:
+        t0 = time.perf_counter()
+        manifest = mastDownload.downloadFiles(
+            uris, ["%06i.dat" % i for i in range(len(uris))], localDir=tmpDir,
+            getNewOnly=False, maxWorkers=maxWorkers)
+        elapsed = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+    timings = [(row.seconds, row.nbytes, int(row.status == 'ERROR'))
+               for row in manifest.itertuples()]
+    return summarize('download', timings, elapsed)
+
+
+def benchAsync(fixtures, n, maxWorkers, server=None, radius_arcsec=60.):
+    names = _targets(fixtures, n)
+
+    async def run():
+        pool = server.pool(maxsize=maxWorkers * 4)
+        async with mastAsync.AsyncMastClient(maxConcurrency=maxWorkers * 4,
+                                             pool=pool) as client:
+            async def timed(name):
+                t0 = time.perf_counter()
+                try:
+                    result = await client.targetNameConeSearch(name, radius_arcsec)
+                    return time.perf_counter() - t0, len(json.dumps(result['data'])), 0
+                except Exception:
+                    return time.perf_counter() - t0, 0, 1
+            return await asyncio.gather(*[timed(name) for name in names])
+
+    t0 = time.perf_counter()
+    timings = asyncio.run(run())
+    return summarize('async', timings, time.perf_counter() - t0)
+
+
+BENCHMARKS = {'lookup': benchLookup,
+              'cone': benchCone,
+              'filtered': benchFiltered,
+              'raw': benchRaw,
+              'products': benchProducts,
+              'download': benchDownload,
+              'async': benchAsync}
+
+
+def runBenchmarks(names=None, n=200, maxWorkers=8, fixtures=None, **standIn):
+    """
+    Start a stand-in (standIn are StandInServer options such as latency,
+    bandwidth, errorRate), point the shared pool at it, run the benchmarks
+    in names (default all) and return a dataframe of RESULT_COLUMNS.
+    """
+    if names is None:
+        names = list(BENCHMARKS)
+    if fixtures is None:
+        fixtures = mastStandIn.SyntheticFixtures(nobs=max(20000, 10 * n))
+    server = mastStandIn.StandInServer(fixtures=fixtures, **standIn).start()
+    old = server.install(maxsize=maxWorkers * 2)
+    try:
+        rows = []
+        for name in names:
+            kwargs = {'server': server} if name == 'async' else {}
+            rows.append(BENCHMARKS[name](fixtures, n, maxWorkers, **kwargs))
+            print(formatRow(rows[-1]))
+    finally:
+        mastSession.setPool(old).closeAll()
+        server.stop()
+    return p.DataFrame(rows, columns=RESULT_COLUMNS)
+
+
+def formatRow(row):
+    return ("%-9s %5i calls %3i errors %8.1f q/s %8.2f MB/s  p50 %7.1f ms  p99 %7.1f ms"
+            % (row['benchmark'], row['calls'], row['errors'], row['queries/s'],
+               row['MB/s'], row['p50 ms'], row['p99 ms']))
+
+
+USAGE = """
+mastBenchmark.py [options]
+  -n, --calls      calls per benchmark (default 200)
+  -w, --workers    calls at once (default 8)
+  -l, --latency    seconds the stand-in adds to every answer (default 0)
+  -b, --bandwidth  stand-in bytes/s per connection (default unlimited)
+  -e, --errors     fraction of answers that are 503s (default 0)
+  -x, --executing  fraction of queries first answered EXECUTING (default 0)
+  -k, --benchmarks comma separated subset of %s
+  -o, --output     write the results to this csv
+""" % ",".join(BENCHMARKS)
+
+
+def main():
+    n = 200
+    maxWorkers = 8
+    names = None
+    output = None
+    standIn = {}
+    try:
+        options, args = getopt.getopt(sys.argv[1:], 'hn:w:l:b:e:x:k:o:',
+                                      ['help', 'calls=', 'workers=', 'latency=',
+                                       'bandwidth=', 'errors=', 'executing=',
+                                       'benchmarks=', 'output='])
+    except getopt.GetoptError as e:
+        sys.exit("%s\n%s" % (e, USAGE))
+    for opt, arg in options:
+        if opt in ('-h', '--help'):
+            print(USAGE)
+            sys.exit(0)
+        if opt in ('-n', '--calls'):
+            n = int(arg)
+        if opt in ('-w', '--workers'):
+            maxWorkers = int(arg)
+        if opt in ('-l', '--latency'):
+            standIn['latency'] = float(arg)
+        if opt in ('-b', '--bandwidth'):
+            standIn['bandwidth'] = float(arg)
+        if opt in ('-e', '--errors'):
+            standIn['errorRate'] = float(arg)
+        if opt in ('-x', '--executing'):
+            standIn['executingRate'] = float(arg)
+        if opt in ('-k', '--benchmarks'):
+            names = [name.strip() for name in arg.split(',')]
+        if opt in ('-o', '--output'):
+            output = arg
+
+    unknown = [name for name in names or [] if name not in BENCHMARKS]
+    if unknown:
+        sys.exit("Unknown benchmarks %s\n%s" % (", ".join(unknown), USAGE))
+
+    results = runBenchmarks(names, n=n, maxWorkers=maxWorkers, **standIn)
+    if output is not None:
+        results.to_csv(output, index=False)
+        print("results written to %s" % output)
+
+
+if __name__ == "__main__":
+    main()
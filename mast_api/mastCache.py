@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of MAST invoke responses.
+
+Entries are content addressed: the key is the sha256 of the request json
+with its keys sorted, so the same query always lands on the same file no
+matter how the request dictionary was built. Each service can have its own
+time to live, and the cache is kept under a size budget by throwing away
+the least recently used entries.
+
+Usage:
+    import mastCache
+    mastCache.setDefaultCache(mastCache.QueryCache('~/.mastcache',
+                                                   ttl={'Mast.Name.Lookup': None}))
+    #every mastQuery now looks in the cache first
+    head, content = api.mastQuery(request)
+    head, content = api.mastQuery(request, bypassCache=True)
+"""
+
+import os
+import json
+import time
+import errno
+import hashlib
+import threading
+
+import mastDecode
+
+DEFAULT_TTL = 24 * 3600.
+
+#Name resolution doesn't change, the holdings do.
+SERVICE_TTL = {'Mast.Name.Lookup': None,
+               'Mast.Caom.Cone': 24 * 3600.,
+               'Mast.Caom.Filtered': 24 * 3600.,
+               'Mast.Caom.Filtered.Position': 24 * 3600.,
+               'Mast.Caom.Products': 7 * 24 * 3600.}
+
+
+def requestKey(request):
+    """Return the cache key (sha256 hex digest) of the canonical request json."""
+    canonical = json.dumps(request, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def isCacheable(content):
+    """
+    False if the response says the query is still EXECUTING or hit an ERROR.
+    """
+    return mastDecode.responseStatus(content) not in ('EXECUTING', 'ERROR')
+
+
+class QueryCache(object):
+    """
+    A size bounded, least recently used cache of mastQuery responses.
+
+    cacheDir is where the entries are written, one json file per request.
+    maxBytes is the size budget. When it is exceeded the least recently
+    used entries are deleted until the cache is back under 90% of it.
+    ttl is a dictionary of service name to seconds an entry stays valid.
+    None means forever and 0 means that service is never cached.
+    Services not listed use defaultTtl.
+    """
+
+    def __init__(self, cacheDir='~/.mastcache', maxBytes=1024 ** 3,
+                 ttl=None, defaultTtl=DEFAULT_TTL):
+        self.cacheDir = os.path.expanduser(cacheDir)
+        self.maxBytes = maxBytes
+        self.ttl = dict(SERVICE_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+        self.defaultTtl = defaultTtl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = None
+
+        try:
+            os.makedirs(self.cacheDir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, key):
+        return os.path.join(self.cacheDir, key[:2], key + '.json')
+
+    def _ttlFor(self, request):
+        return self.ttl.get(request.get('service'), self.defaultTtl)
+
+    def _loadIndex(self):
+        """
+        Build the in-memory index {key: [nbytes, lastUsed]} from the files
+        on disk. Called once, under the lock.
+        """
+        if self._index is not None:
+            return
+        self._index = {}
+        for sub in os.listdir(self.cacheDir):
+            subDir = os.path.join(self.cacheDir, sub)
+            if not os.path.isdir(subDir):
+                continue
+            for name in os.listdir(subDir):
+                if name.endswith('.json'):
+                    st = os.stat(os.path.join(subDir, name))
+                    self._index[name[:-5]] = [st.st_size, st.st_mtime]
+
+    def get(self, request):
+        """
+        Return the cached (head, content) for request, or None if there is
+        no valid entry.
+        """
+        ttl = self._ttlFor(request)
+        if ttl == 0:
+            return None
+        key = requestKey(request)
+        path = self._path(key)
+        try:
+            with open(path, 'r') as FLE:
+                entry = json.load(FLE)
+        except (IOError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        now = time.time()
+        if ttl is not None and now - entry['created'] > ttl:
+            self._remove(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        #Touch the file so the eviction order survives a restart
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if self._index is not None and key in self._index:
+                self._index[key][1] = now
+        head = [tuple(h) for h in entry['head']]
+        return head, entry['content']
+
+    def put(self, request, head, content):
+        """Store a response. Unfinished responses are ignored."""
+        if self._ttlFor(request) == 0 or not isCacheable(content):
+            return
+        key = requestKey(request)
+        path = self._path(key)
+        #content is stored unpacked, so the headers mustn't say it's gzipped
+        head = [(name, value) for name, value in head
+                if name.lower() not in ('content-encoding', 'content-length')]
+        entry = {'created': time.time(),
+                 'request': request,
+                 'head': head,
+                 'content': content}
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        tmpPath = '%s.%i.%i.tmp' % (path, os.getpid(), threading.current_thread().ident)
+        with open(tmpPath, 'w') as FLE:
+            json.dump(entry, FLE)
+        os.replace(tmpPath, path)
+
+        with self._lock:
+            self._loadIndex()
+            self._index[key] = [os.path.getsize(path), time.time()]
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until under 90% of maxBytes."""
+        total = sum(size for size, lastUsed in self._index.values())
+        if total <= self.maxBytes:
+            return
+        for key, (size, lastUsed) in sorted(self._index.items(),
+                                            key=lambda kv: kv[1][1]):
+            if total <= 0.9 * self.maxBytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            del self._index[key]
+            total -= size
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        with self._lock:
+            if self._index is not None:
+                self._index.pop(key, None)
+
+    def invalidate(self, request):
+        """Remove the entry for one request."""
+        self._remove(requestKey(request))
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._loadIndex()
+            keys = list(self._index)
+        for key in keys:
+            self._remove(key)
+
+    def size(self):
+        """Total bytes currently held."""
+        with self._lock:
+            self._loadIndex()
+            return sum(size for size, lastUsed in self._index.values())
+
+
+_defaultCache = None
+
+
+def setDefaultCache(cache):
+    """Use cache for every mastQuery that isn't given one. None disables it."""
+    global _defaultCache
+    _defaultCache = cache
+
+
+def getDefaultCache():
+    return _defaultCache
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk crossmatch of many targets against the MAST CAOM holdings.
+
+Instead of one Mast.Caom.Cone per target, nearby targets are grouped on a
+sky grid and each group is covered by one larger cone. The observations
+that come back are assigned to the targets locally with a vectorized
+angular separation match. In a dense field like the Kepler FOV this turns
+thousands of queries into a few dozen.
+
+Note the local match uses the centre of each observation (s_ra, s_dec),
+while Mast.Caom.Cone matches on the footprint. Observations with a large
+footprint, such as full frame images, only match targets within
+radius_arcsec of their centre.
+
+Usage:
+    import mastResolver, mastCrossmatch
+    coords = mastResolver.resolveNames(names)
+    matches = mastCrossmatch.crossmatchTargets(coords.ra, coords.dec, 8,
+                                               names=coords.name)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as p
+
+import mastAPITools as api
+
+#Largest number of targets x observations compared in one block.
+MATCH_BLOCK = 4000000
+
+
+def angularSeparation(ra1, dec1, ra2, dec2):
+    """
+    Angular separation in degrees between arrays of positions (degrees),
+    using the haversine formula. Inputs broadcast against each other.
+    """
+    ra1, dec1, ra2, dec2 = map(np.radians, (ra1, dec1, ra2, dec2))
+    sdlat = np.sin((dec2 - dec1) / 2.)
+    sdlon = np.sin((ra2 - ra1) / 2.)
+    a = sdlat**2 + np.cos(dec1) * np.cos(dec2) * sdlon**2
+    return np.degrees(2. * np.arcsin(np.sqrt(np.clip(a, 0., 1.))))
+
+
+def clusterTargets(ra, dec, cellSize_deg=0.5):
+    """
+    Group positions into cells of a sky grid.
+    Dec is cut into bands cellSize_deg tall and each band into RA bins that
+    are cellSize_deg wide on the sky (at the band edge nearest the pole).
+    Returns (labels, centres) where labels[i] is the cluster of target i and
+    centres is a dataframe with the ra, dec and radius (degrees) of the
+    smallest cone about the members' mean position that holds them all.
+    """
+    ra = np.asarray(ra, dtype=float) % 360.
+    dec = np.asarray(dec, dtype=float)
+    band = np.floor((dec + 90.) / cellSize_deg)
+    bandEdge = np.maximum(np.abs(-90. + band * cellSize_deg),
+                          np.abs(-90. + (band + 1) * cellSize_deg))
+    cosEdge = np.maximum(np.cos(np.radians(np.minimum(bandEdge, 90.))), 1e-6)
+    nBins = np.maximum(np.floor(360. * cosEdge / cellSize_deg), 1)
+    raBin = np.floor(ra / 360. * nBins)
+
+    cells, labels = np.unique(np.column_stack([band, raBin]), axis=0,
+                              return_inverse=True)
+    labels = labels.ravel()
+
+    #Centre on the mean unit vector of the members, then measure the radius
+    x = np.cos(np.radians(dec)) * np.cos(np.radians(ra))
+    y = np.cos(np.radians(dec)) * np.sin(np.radians(ra))
+    z = np.sin(np.radians(dec))
+    n = len(cells)
+    cx = np.bincount(labels, weights=x, minlength=n)
+    cy = np.bincount(labels, weights=y, minlength=n)
+    cz = np.bincount(labels, weights=z, minlength=n)
+    cra = np.degrees(np.arctan2(cy, cx)) % 360.
+    cdec = np.degrees(np.arctan2(cz, np.hypot(cx, cy)))
+    sep = angularSeparation(ra, dec, cra[labels], cdec[labels])
+    radius = np.zeros(n)
+    np.maximum.at(radius, labels, sep)
+
+    return labels, p.DataFrame({'ra': cra, 'dec': cdec, 'radius': radius})
+
+
+def matchObservations(ra, dec, obsRa, obsDec, radius_deg):
+    """
+    Vectorized match of targets (ra, dec) against observation centres.
+    Returns (targetIndex, obsIndex, separation_deg) for every pair closer
+    than radius_deg. Work is done in blocks of at most MATCH_BLOCK pairs.
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    obsRa = np.asarray(obsRa, dtype=float)
+    obsDec = np.asarray(obsDec, dtype=float)
+    step = max(1, MATCH_BLOCK // max(len(obsRa), 1))
+    tIdx, oIdx, seps = [], [], []
+    for start in range(0, len(ra), step):
+        sep = angularSeparation(ra[start:start + step, None],
+                                dec[start:start + step, None],
+                                obsRa[None, :], obsDec[None, :])
+        t, o = np.nonzero(sep <= radius_deg)
+        tIdx.append(t + start)
+        oIdx.append(o)
+        seps.append(sep[t, o])
+    if not tIdx:
+        return np.array([], int), np.array([], int), np.array([])
+    return np.concatenate(tIdx), np.concatenate(oIdx), np.concatenate(seps)
+
+
+def _clusterQuery(cra, cdec, radius_deg, pagesize):
+    """One cone search covering a whole cluster, as a dataframe."""
+    mastData = api.coneSearch(cra, cdec, radius_deg * 3600., pagesize=pagesize)
+    return p.DataFrame.from_dict(mastData['data'])
+
+
+def crossmatchTargets(ra, dec, radius_arcsec, names=None, cellSize_deg=0.5,
+                      maxWorkers=4, pagesize=50000):
+    """
+    Find the CAOM observations within radius_arcsec of many targets.
+
+    ra, dec are arrays of target positions in degrees; targets with NaN
+    coordinates (e.g. unresolved names) are ignored. names is an optional
+    array of target names carried into the output. Targets are grouped
+    into cells of cellSize_deg and each cell is fetched with one cone
+    search, maxWorkers cells at a time.
+
+    Returns a dataframe with one row per (target, observation) pair: the
+    observation columns plus target (index into the input arrays),
+    target_name (if names was given) and separation_arcsec. An observation
+    near several targets appears once per target.
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    good = np.nonzero(np.isfinite(ra) & np.isfinite(dec))[0]
+    radius_deg = radius_arcsec / 3600.
+    if len(good) == 0:
+        return p.DataFrame()
+
+    labels, centres = clusterTargets(ra[good], dec[good], cellSize_deg)
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        futures = [executor.submit(_clusterQuery, c.ra, c.dec,
+                                   c.radius + radius_deg, pagesize)
+                   for c in centres.itertuples()]
+        frames = [future.result() for future in futures]
+
+    matched = []
+    for k, obs in enumerate(frames):
+        if len(obs) == 0 or 's_ra' not in obs:
+            continue
+        obs = obs[np.isfinite(obs['s_ra'].astype(float)) &
+                  np.isfinite(obs['s_dec'].astype(float))].reset_index(drop=True)
+        members = good[labels == k]
+        t, o, sep = matchObservations(ra[members], dec[members],
+                                      obs['s_ra'], obs['s_dec'], radius_deg)
+        if len(t) == 0:
+            continue
+        rows = obs.iloc[o].reset_index(drop=True)
+        rows['target'] = members[t]
+        rows['separation_arcsec'] = sep * 3600.
+        matched.append(rows)
+
+    if not matched:
+        return p.DataFrame(columns=['target', 'separation_arcsec'])
+    result = p.concat(matched, axis=0, ignore_index=True)
+    if names is not None:
+        result['target_name'] = np.asarray(names)[result['target'].values]
+    return result
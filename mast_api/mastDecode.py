@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar decoding of MAST json responses.
+
+json.loads followed by pandas.DataFrame.from_dict builds a dictionary per
+row and then copies everything into a frame, which for big cone searches
+costs more than the network and doubles peak memory. ColumnarDecoder reads
+the response a chunk at a time as it comes off the socket, appends the
+values of the data rows straight into one list per column, and at the end
+turns each column into a numpy array typed from the fields schema.
+
+Usage:
+    head, table = api.mastQuery(request, decode='table')
+    head, df = api.mastQuery(request, decode='dataframe')
+    #the same works for requests made with "format":"csv" or "votable"
+
+    decoded = mastDecode.decodeContent(content)
+    df = mastDecode.toDataFrame(decoded)
+"""
+
+import re
+import json
+import zlib
+import time
+import codecs
+from operator import itemgetter
+
+import numpy as np
+import pandas as p
+from astropy.table import Table
+from astropy.io import votable
+
+FLOAT_TYPES = ('float', 'double', 'real')
+INT_TYPES = ('int', 'long', 'short', 'integer')
+BOOL_TYPES = ('boolean', 'bool')
+
+#Rows are gathered into batches this big before being split into columns
+ROW_BATCH = 5000
+#Most characters of row data handed to json.loads at once
+BLOCK_CHARS = 1024 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+_STATUS = re.compile(r'"status"\s*:\s*"([A-Z]*)"')
+
+_PAGING_ROWS = re.compile(r'"paging"\s*:\s*\{[^}]*"rows"\s*:\s*(\d+)')
+
+
+def responseStatus(content):
+    """
+    The status field of a json response ('COMPLETE', 'EXECUTING', 'ERROR'
+    or '' for services like Mast.Name.Lookup), or None if there isn't one.
+    Only the two ends of the response are searched, the status sits
+    outside of the data.
+    """
+    match = _STATUS.search(content[:4096]) or _STATUS.search(content[-4096:])
+    return match.group(1) if match else None
+
+
+def responseRows(content):
+    """
+    The number of rows in a json response according to its paging
+    metadata, or None if it has none. Like responseStatus only the ends
+    of the response are searched.
+    """
+    match = _PAGING_ROWS.search(content[-4096:]) or _PAGING_ROWS.search(content[:4096])
+    return int(match.group(1)) if match else None
+
+
+class DecodedResponse(object):
+    """
+    A decoded MAST response.
+    columns maps each column name to a numpy array, fields is the schema
+    list from the response and status, msg and paging are copied from it.
+    """
+
+    def __init__(self, columns, fields, status=None, msg=None, paging=None,
+                 extra=None):
+        self.columns = columns
+        self.fields = fields
+        self.status = status
+        self.msg = msg
+        self.paging = paging or {}
+        self.extra = extra or {}
+
+    def __len__(self):
+        for values in self.columns.values():
+            return len(values)
+        return 0
+
+
+def _typedColumn(values, ftype):
+    """Turn a list of json values into a numpy array of the schema type."""
+    ftype = (ftype or '').lower()
+    if ftype in FLOAT_TYPES:
+        return np.array(values, dtype=float)
+    if ftype in INT_TYPES:
+        try:
+            column = np.array(values, dtype=np.int64)
+        except (TypeError, ValueError, OverflowError):
+            #Nulls in an integer column
+            return np.array(values, dtype=float)
+        #The cast truncates, keep floats if any value isn't whole
+        if any(type(v) is float for v in values):
+            floats = np.array(values, dtype=float)
+            if not np.array_equal(floats, column):
+                return floats
+        return column
+    if ftype in BOOL_TYPES:
+        if any(v is None for v in values):
+            return np.array(values, dtype=object)
+        return np.array(values, dtype=bool)
+    return np.array(values, dtype=object)
+
+
+class ColumnarDecoder(object):
+    """
+    Incremental decoder for a MAST json response.
+    Call feed() with each piece of the body (bytes or str) as it arrives
+    and finish() at the end to get a DecodedResponse.
+    Only the unparsed tail of the body and one batch of rows are held
+    besides the growing columns.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._state = 'start'
+        self._key = None
+        self._top = {}
+        self._columns = {}
+        self._nrows = 0
+        self._batch = []
+        self._misses = 0
+
+    def _skipSpace(self):
+        buf, pos = self._buf, self._pos
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+        self._pos = pos
+        return pos < len(buf)
+
+    def _value(self, final):
+        """Decode one json value at the current position, or None if incomplete."""
+        try:
+            value, end = self._decoder.raw_decode(self._buf, self._pos)
+        except ValueError:
+            if final:
+                raise
+            return None, False
+        if end == len(self._buf) and not final and \
+                not isinstance(value, (dict, list, str)):
+            #A number or literal at the end may still be growing
+            return None, False
+        self._pos = end
+        return value, True
+
+    def _rowBlock(self):
+        """
+        Fast path: hand every complete row in the buffer to json.loads in
+        one call. Rows are flat objects, so a block of rows ends at a '}'
+        followed by ',' or ']'. If the guess is wrong (the block runs past
+        the end of data, or the '}' was inside a string) the parse error
+        position is used to try a shorter block. After a few misses in one
+        feed the caller is left to decode one row at a time.
+        """
+        buf, pos = self._buf, self._pos
+        limit = min(len(buf), pos + BLOCK_CHARS)
+        while self._misses < 8:
+            end = self._blockEnd(pos, limit)
+            if end is None:
+                return False
+            try:
+                rows = json.loads('[' + buf[pos:end + 1] + ']')
+            except ValueError as e:
+                self._misses += 1
+                #e.pos is in the bracketed string, one ahead of buf
+                limit = min(end, pos + max(getattr(e, 'pos', 1) - 1, 0))
+                continue
+            self._batch.extend(rows)
+            self._pos = end + 1
+            if len(self._batch) >= ROW_BATCH:
+                self._flushRows()
+            return True
+        return False
+
+    def _blockEnd(self, pos, limit):
+        """Last '}' before limit that is followed by ',' or ']', or None."""
+        buf = self._buf
+        end = buf.rfind('}', pos, limit)
+        while end > pos:
+            nxt = end + 1
+            while nxt < len(buf) and buf[nxt] in _WHITESPACE:
+                nxt += 1
+            if nxt < len(buf) and buf[nxt] in ',]':
+                return end
+            end = buf.rfind('}', pos, end)
+        return None
+
+    def _flushRows(self):
+        rows = self._batch
+        if not rows:
+            return
+        names = list(self._columns)
+        for name in dict.fromkeys(key for row in (rows[0], rows[-1]) for key in row):
+            if name not in self._columns:
+                self._columns[name] = [None] * self._nrows
+                names.append(name)
+        if not names:
+            #Rows with no columns at all
+            self._nrows += len(rows)
+            self._batch = []
+            return
+        try:
+            #Every row has every column: transpose in C
+            getter = itemgetter(*names)
+            values = zip(*map(getter, rows)) if len(names) > 1 else \
+                [list(map(getter, rows))]
+            if any(len(row) != len(names) for row in rows):
+                raise KeyError
+        except KeyError:
+            for row in rows:
+                for name in row:
+                    if name not in self._columns:
+                        self._columns[name] = [None] * self._nrows
+                        names.append(name)
+            values = [[row.get(name) for row in rows] for name in names]
+        for name, column in zip(names, values):
+            self._columns[name].extend(column)
+        self._nrows += len(rows)
+        self._batch = []
+
+    def _parse(self, final=False):
+        while self._skipSpace():
+            state = self._state
+            char = self._buf[self._pos]
+            if state == 'start':
+                if char != '{':
+                    raise ValueError("MAST response is not a json object")
+                self._pos += 1
+                self._state = 'key'
+            elif state == 'key':
+                if char == '}':
+                    self._pos += 1
+                    self._state = 'done'
+                    continue
+                if char == ',':
+                    self._pos += 1
+                    continue
+                key, ok = self._value(final)
+                if not ok:
+                    return
+                self._key = key
+                self._state = 'colon'
+            elif state == 'colon':
+                if char != ':':
+                    raise ValueError("Malformed MAST response near %r"
+                                     % self._buf[self._pos:self._pos + 40])
+                self._pos += 1
+                self._state = 'value'
+            elif state == 'value':
+                if self._key == 'data' and char == '[':
+                    self._pos += 1
+                    self._state = 'row'
+                    continue
+                value, ok = self._value(final)
+                if not ok:
+                    return
+                self._top[self._key] = value
+                self._state = 'key'
+            elif state == 'row':
+                if char == ']':
+                    self._pos += 1
+                    self._state = 'key'
+                    continue
+                if char == ',':
+                    self._pos += 1
+                    continue
+                if self._rowBlock():
+                    continue
+                row, ok = self._value(final)
+                if not ok:
+                    return
+                self._batch.append(row)
+                if len(self._batch) >= ROW_BATCH:
+                    self._flushRows()
+            else:
+                #Trailing whitespace only after the closing brace
+                raise ValueError("Unexpected data after the MAST response")
+
+    def feed(self, chunk):
+        """Add the next piece of the response body."""
+        if isinstance(chunk, bytes):
+            chunk = self._utf8.decode(chunk)
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        self._misses = 0
+        self._parse()
+
+    def finish(self):
+        """Parse whatever is left and return the DecodedResponse."""
+        self.feed(self._utf8.decode(b'', final=True))
+        self._parse(final=True)
+        if self._state != 'done':
+            raise ValueError("MAST response ended early")
+        self._flushRows()
+
+        fields = self._top.get('fields') or []
+        types = dict((f['name'], f.get('type')) for f in fields)
+        #Schema order first, then anything the schema didn't mention
+        names = [f['name'] for f in fields if f['name'] in self._columns]
+        names += [name for name in self._columns if name not in types]
+        columns = dict((name, _typedColumn(self._columns[name], types.get(name)))
+                       for name in names)
+        self._columns = {}
+        extra = dict((k, v) for k, v in self._top.items()
+                     if k not in ('fields', 'status', 'msg', 'paging'))
+        return DecodedResponse(columns, fields, self._top.get('status'),
+                               self._top.get('msg'), self._top.get('paging'),
+                               extra)
+
+
+class ResponseReader(object):
+    """
+    File-like wrapper around an http response for the parsers.
+    Undoes gzip transfer encoding, counts the bytes received in resp.nbytes
+    (for QueryStats) and the time spent reading them in resp.readSeconds
+    (for mastTrace) and, if capture is a list, keeps a copy of every
+    decoded chunk so the response can be cached afterwards.
+    """
+
+    def __init__(self, resp, gzipped=False, capture=None,
+                 chunkSize=1024 * 1024):
+        self.resp = resp
+        self.capture = capture
+        self.chunkSize = chunkSize
+        self._unzip = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        self._pending = b''
+        self._eof = False
+
+    def _fill(self, size):
+        while len(self._pending) < size and not self._eof:
+            t0 = time.perf_counter()
+            raw = self.resp.read(self.chunkSize)
+            if hasattr(self.resp, 'readSeconds'):
+                self.resp.readSeconds += time.perf_counter() - t0
+            if not raw:
+                self._eof = True
+                if self._unzip is not None:
+                    self._pending += self._unzip.flush()
+                break
+            if hasattr(self.resp, 'nbytes'):
+                self.resp.nbytes += len(raw)
+            if self._unzip is not None:
+                raw = self._unzip.decompress(raw)
+            if self.capture is not None:
+                self.capture.append(raw)
+            self._pending += raw
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            self._fill(float('inf'))
+            size = len(self._pending)
+        else:
+            self._fill(size)
+        out, self._pending = self._pending[:size], self._pending[size:]
+        return out
+
+    def readable(self):
+        return True
+
+    def drain(self):
+        """Read to the end so the connection can go back to the pool."""
+        while self.read(self.chunkSize):
+            pass
+
+
+def decodeResponse(stream, fmt='json', decode='dataframe'):
+    """
+    Parse a whole response from a file-like object into a 'table' or
+    'dataframe'. fmt is the format the request asked MAST for: 'json'
+    (ColumnarDecoder), 'csv' (pandas) or 'votable' (astropy).
+    Strings become categoricals in dataframes.
+    """
+    fmt = (fmt or 'json').lower()
+    if decode not in ('table', 'dataframe'):
+        raise ValueError("decode must be 'table' or 'dataframe', not %r" % decode)
+    if fmt == 'json':
+        return convert(decodeStream(stream), decode)
+    if fmt == 'csv':
+        #Only the lines starting with '#' at the top are comments, a '#'
+        #in a value (a title, a target name) is data
+        df = p.read_csv(_skipCommentLines(stream))
+        if decode == 'table':
+            return Table.from_pandas(df)
+        for name in df.select_dtypes(include=['object', 'string']).columns:
+            df[name] = df[name].astype('category')
+        return df
+    if fmt == 'votable':
+        table = votable.parse(stream).get_first_table().to_table()
+        if decode == 'table':
+            return table
+        return table.to_pandas()
+    raise ValueError("Can't decode MAST format %r" % fmt)
+
+
+class _PrefixedStream(object):
+    """The bytes of head, then the rest of stream."""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            out, self.head = self.head + self.stream.read(), b''
+            return out
+        out, self.head = self.head[:size], self.head[size:]
+        return out
+
+
+def _skipCommentLines(stream, chunkSize=64 * 1024):
+    """stream without the lines starting with '#' at its top."""
+    head = b''
+    while True:
+        chunk = stream.read(chunkSize)
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        head += chunk
+        while head.startswith(b'#') and b'\n' in head:
+            head = head[head.index(b'\n') + 1:]
+        if not chunk:
+            return _PrefixedStream(b'' if head.startswith(b'#') else head, stream)
+        if head and not head.startswith(b'#'):
+            return _PrefixedStream(head, stream)
+
+
+def decodeContent(content):
+    """Decode a whole response held in memory (str or bytes)."""
+    decoder = ColumnarDecoder()
+    decoder.feed(content)
+    return decoder.finish()
+
+
+def decodeStream(stream, chunkSize=1024 * 1024):
+    """Decode a response from a file-like object, chunkSize bytes at a time."""
+    decoder = ColumnarDecoder()
+    for chunk in iter(lambda: stream.read(chunkSize), b''):
+        decoder.feed(chunk)
+    return decoder.finish()
+
+
+def toDataFrame(decoded, categorical=True):
+    """
+    Build a pandas dataframe from a DecodedResponse.
+    String columns become categoricals when categorical is True, which
+    keeps repeated values like obs_collection or instrument_name small.
+    """
+    data = {}
+    for name, values in decoded.columns.items():
+        if categorical and values.dtype == object:
+            data[name] = p.Categorical(values)
+        else:
+            data[name] = values
+    df = p.DataFrame(data, columns=list(decoded.columns))
+    df.attrs['status'] = decoded.status
+    df.attrs['msg'] = decoded.msg
+    df.attrs['paging'] = decoded.paging
+    return df
+
+
+def toTable(decoded):
+    """
+    Build an astropy Table from a DecodedResponse.
+    Nulls in string columns become empty strings.
+    """
+    table = Table()
+    for name, values in decoded.columns.items():
+        if values.dtype == object:
+            values = np.array(['' if v is None else str(v) for v in values])
+        table[name] = values
+    table.meta['status'] = decoded.status
+    table.meta['msg'] = decoded.msg
+    table.meta['paging'] = decoded.paging
+    return table
+
+
+def convert(decoded, decode):
+    """Return decoded as a 'table' or 'dataframe'."""
+    if decode == 'table':
+        return toTable(decoded)
+    if decode == 'dataframe':
+        return toDataFrame(decoded)
+    raise ValueError("decode must be 'table' or 'dataframe', not %r" % decode)
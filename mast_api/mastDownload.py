@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrent download engine for MAST data products.
+
+downloadFiles fetches many files at once through a thread pool, streams
+each response to disk in fixed-size chunks (so multi-GB files never sit in
+memory) and returns a manifest dataframe describing what happened to every
+file. Files are written as name.part, resumed with HTTP Range requests if a
+run is interrupted, verified against the expected size/checksum and only
+then renamed to their final name.
+"""
+
+import os
+import errno
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try: # Python 3.x
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2.x
+    from urlparse import urlsplit
+
+import pandas as p
+
+import mastSession
+import mastThrottle
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+CHUNK_SIZE = 1024 * 1024
+
+MANIFEST_COLUMNS = ['uri', 'localPath', 'status', 'nbytes', 'resumedFrom',
+                    'seconds', 'error']
+
+
+class HTTPStatusError(IOError):
+    """A download answered with an HTTP status other than 200/206."""
+
+    def __init__(self, message, status):
+        IOError.__init__(self, message)
+        self.status = status
+
+
+def poolForAddress(address, pool=None):
+    """
+    Return the pool and request path for a download address.
+    mast: uris go to the MAST download service (through pool, default the
+    shared MAST pool), http(s) urls go to the shared pool of their own host
+    and paths starting with / stay on pool (relative redirects).
+    """
+    if address.startswith("http"):
+        parts = urlsplit(address)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        return mastSession.getPool(parts.hostname,
+                                   https=(parts.scheme == 'https'),
+                                   port=parts.port), path
+    if pool is None:
+        pool = mastSession.getPool()
+    if address.startswith('/'):
+        return pool, address
+    uri = address[len('mast:'):] if address.startswith('mast:') else address
+    return pool, "/api/v0/download/file/" + uri
+
+
+def makeDir(localDir):
+    """Create localDir (and parents) if it isn't there already."""
+    try:
+        os.makedirs(localDir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def makeParentDirs(localPaths):
+    """Create the directories the files localPaths go in."""
+    for directory in set(os.path.dirname(path) for path in localPaths):
+        makeDir(directory or '.')
+
+
+def _headerDict(resp):
+    return dict((k.lower(), v) for k, v in resp.getheaders())
+
+
+def _knownSize(size):
+    """Return size as an int, or None if it is missing from the metadata."""
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        return None
+    return size if size > 0 else None
+
+
+def isComplete(localPath, expectedSize=None):
+    """
+    True if localPath exists and, when the expected size is known,
+    has exactly that many bytes.
+    """
+    if not os.path.isfile(localPath):
+        return False
+    expectedSize = _knownSize(expectedSize)
+    return expectedSize is None or os.path.getsize(localPath) == expectedSize
+
+
+def fileChecksum(localPath, algorithm='md5', chunkSize=CHUNK_SIZE):
+    """Return the hex digest of a file on disk."""
+    hasher = hashlib.new(algorithm)
+    with open(localPath, 'rb') as FLE:
+        for chunk in iter(lambda: FLE.read(chunkSize), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _totalSize(resp):
+    """
+    Size of the whole file according to the response headers, or None.
+    For a 206 the total is in Content-Range, for a 200 in Content-Length.
+    """
+    head = _headerDict(resp)
+    if resp.status == 206 and '/' in head.get('content-range', ''):
+        return _knownSize(head['content-range'].rsplit('/', 1)[1])
+    if resp.status == 200:
+        return _knownSize(head.get('content-length'))
+    return None
+
+
+def streamToFile(address, localPath, pool=None, stats=None,
+                 chunkSize=CHUNK_SIZE, expectedSize=None, checksum=None,
+                 algorithm='md5'):
+    """
+    Download one address to localPath, reading chunkSize bytes at a time.
+
+    Bytes are written to localPath+'.part'. If a .part file is already
+    there from an interrupted run, only the missing bytes are requested with
+    an HTTP Range header. Once the file is whole it is checked against
+    expectedSize and checksum (a hex digest using algorithm), when given,
+    and then renamed onto localPath, so localPath only ever holds a complete
+    file.
+    Redirects are followed.
+
+    Returns (nbytes, resumedFrom): the bytes fetched on this call and the
+    size of the .part file it resumed from.
+    Raises IOError on an HTTP error, a short read (the .part file is kept
+    for the next attempt) or a checksum mismatch (the .part file is
+    removed).
+    """
+    partPath = localPath + '.part'
+    expectedSize = _knownSize(expectedSize)
+    if not isinstance(checksum, str):
+        checksum = None
+    offset = os.path.getsize(partPath) if os.path.isfile(partPath) else 0
+    if expectedSize is not None and offset > expectedSize:
+        os.remove(partPath)
+        offset = 0
+    resumedFrom = offset
+
+    nbytes = 0
+    if expectedSize is None or offset < expectedSize:
+        headers = {'Range': 'bytes=%i-' % offset} if offset else {}
+        filePool, path = poolForAddress(address, pool)
+        for hop in range(MAX_REDIRECTS + 1):
+            with filePool.stream("GET", path, headers=headers,
+                                 label='download', stats=stats) as resp:
+                if resp.status in REDIRECT_CODES:
+                    location = _headerDict(resp)['location']
+                    resp.read()
+                    filePool, path = poolForAddress(location, filePool)
+                    continue
+                if resp.status == 416 and offset:
+                    #Nothing left to fetch, the .part file is already whole
+                    resp.read()
+                    break
+                if resp.status not in (200, 206):
+                    resp.read()
+                    raise HTTPStatusError(
+                        "Download of %s failed with HTTP status %i"
+                        % (address, resp.status), resp.status)
+                if resp.status == 200:
+                    #Server ignored the range, start again from the top
+                    offset = 0
+                    resumedFrom = 0
+                totalSize = _totalSize(resp)
+                if expectedSize is None:
+                    expectedSize = totalSize
+                with open(partPath, 'ab' if offset else 'wb') as FLE:
+                    while True:
+                        chunk = resp.read(chunkSize)
+                        if not chunk:
+                            break
+                        FLE.write(chunk)
+                        resp.nbytes += len(chunk)
+                nbytes = resp.nbytes
+                break
+        else:
+            raise IOError("Too many redirects downloading %s" % address)
+
+    size = os.path.getsize(partPath) if os.path.isfile(partPath) else 0
+    if expectedSize is not None and size != expectedSize:
+        raise IOError("Download of %s is incomplete: %i of %i bytes"
+                      % (address, size, expectedSize))
+    if checksum:
+        digest = fileChecksum(partPath, algorithm, chunkSize)
+        if digest.lower() != checksum.lower():
+            os.remove(partPath)
+            raise IOError("Checksum mismatch for %s: got %s, expected %s"
+                          % (address, digest, checksum))
+    os.replace(partPath, localPath)
+    return nbytes, resumedFrom
+
+
+def downloadOne(address, localPath, getNewOnly=True, pool=None, stats=None,
+                chunkSize=CHUNK_SIZE, expectedSize=None, checksum=None,
+                algorithm='md5', retry=None):
+    """
+    Download one file the way downloadFiles does and return its manifest
+    row as a dictionary. Never raises, errors go into the row.
+    A failed transfer is retried (resuming from the .part file) with the
+    backoff of retry, a mastThrottle.RetryPolicy; by default the one of
+    the default throttle.
+    """
+    if retry is None:
+        retry = mastThrottle.getDefaultThrottle().retry
+    row = {'uri': address, 'localPath': localPath, 'status': 'COMPLETE',
+           'nbytes': 0, 'resumedFrom': 0, 'seconds': 0., 'error': None}
+    if getNewOnly and isComplete(localPath, expectedSize):
+        row['status'] = 'SKIPPED'
+        return row
+    partPath = localPath + '.part'
+    if (getNewOnly and os.path.isfile(localPath)
+            and not os.path.isfile(partPath)):
+        #A short file left by an older, non-atomic download: resume it
+        os.rename(localPath, partPath)
+    t0 = time.time()
+    for attempt in range(retry.maxRetries + 1):
+        try:
+            nbytes, resumedFrom = streamToFile(
+                address, localPath, pool=pool, stats=stats,
+                chunkSize=chunkSize, expectedSize=expectedSize,
+                checksum=checksum, algorithm=algorithm)
+        except Exception as e:
+            row['status'] = 'ERROR'
+            row['error'] = str(e)
+            if (isinstance(e, HTTPStatusError)
+                    and e.status not in retry.retryStatus):
+                break
+            if attempt < retry.maxRetries:
+                time.sleep(retry.delay(attempt))
+            continue
+        row['status'] = 'COMPLETE'
+        row['error'] = None
+        row['nbytes'] += nbytes
+        if attempt == 0:
+            row['resumedFrom'] = resumedFrom
+        break
+    row['seconds'] = time.time() - t0
+    return row
+
+
+def downloadFiles(uris, localFilenames, localDir="/", getNewOnly=True,
+                  maxWorkers=4, chunkSize=CHUNK_SIZE, pool=None, stats=None,
+                  sizes=None, checksums=None, algorithm='md5', onDone=None):
+    """
+    Download every uri to localDir+localFilenames[i], maxWorkers at a time.
+    localFilenames can include subdirectories, e.g. "011904151/kplr...fits".
+    Can handle both https:// and mast: uris.
+    if getNewOnly==True, files already on disk are skipped, unless sizes
+    says they are short, in which case they are resumed.
+    sizes and checksums are optional lists (e.g. the size column of the
+    product metadata) used to verify each file before it is renamed into
+    place. Missing entries (None or NaN) are not checked.
+    Interrupted downloads leave a .part file that the next call resumes.
+    Failures do not stop the other downloads, they are reported in the
+    manifest instead. onDone(row) is called with the manifest row of each
+    file as it finishes, e.g. to show progress.
+
+    Returns a dataframe with one row per uri and the columns
+    uri, localPath, status (COMPLETE, SKIPPED or ERROR), nbytes,
+    resumedFrom, seconds and error.
+    """
+    localPaths = [localDir + name for name in localFilenames]
+    #localFilenames may put files in subdirectories of localDir
+    makeParentDirs(localPaths)
+    if sizes is None:
+        sizes = [None] * len(localPaths)
+    if checksums is None:
+        checksums = [None] * len(localPaths)
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        futures = [executor.submit(downloadOne, address, localPath,
+                                   getNewOnly, pool, stats, chunkSize,
+                                   size, checksum, algorithm)
+                   for address, localPath, size, checksum
+                   in zip(uris, localPaths, sizes, checksums)]
+        if onDone is not None:
+            for future in as_completed(futures):
+                onDone(future.result())
+        rows = [future.result() for future in futures]
+
+    return p.DataFrame(rows, columns=MANIFEST_COLUMNS)
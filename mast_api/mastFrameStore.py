@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Collect many small dataframes (one per query) without copying the whole
+result on every step.
+
+FrameAccumulator keeps the chunks in a list and concatenates them once at
+the end. Given a spillDir it instead writes every spillRows rows to a
+Parquet file (or a pickle if pyarrow is not installed) and finish() hands
+back a FrameDataset that only reads the files when asked.
+
+Usage:
+    import mastFrameStore
+    acc = mastFrameStore.FrameAccumulator(spillDir='/tmp/k2obs')
+    for targetName in names:
+        acc.append(p.DataFrame.from_dict(api.targetNameConeSearch(targetName, 8)['data']))
+    dataset = acc.finish()
+    df = dataset.load(columns=['obs_collection', 'project'])
+"""
+
+import os
+import glob
+import errno
+
+import pandas as p
+
+try:
+    import pyarrow
+    PARQUET = True
+except ImportError:
+    PARQUET = False
+
+SPILL_ROWS = 200000
+
+
+def concatFrames(chunks):
+    """Concatenate chunks once; chunks may not all have the same columns."""
+    chunks = [chunk for chunk in chunks if len(chunk)]
+    if not chunks:
+        return p.DataFrame()
+    return p.concat(chunks, axis=0, ignore_index=True, sort=False)
+
+
+def writeFrame(df, name):
+    """
+    Write df to name + '.parquet' (or '.pkl' without pyarrow), atomically.
+    Returns the file name.
+    """
+    if PARQUET:
+        filename = name + '.parquet'
+        #Object columns from json can mix types, parquet wants one
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        df.to_parquet(filename + '.tmp', index=False)
+    else:
+        filename = name + '.pkl'
+        df.to_pickle(filename + '.tmp')
+    os.replace(filename + '.tmp', filename)
+    return filename
+
+
+def readFrame(filename, columns=None):
+    """Read a file written by writeFrame, optionally only some columns."""
+    if filename.endswith('.parquet'):
+        if columns is None:
+            return p.read_parquet(filename)
+        #Parts can lack columns other parts have (removenullcolumns)
+        import pyarrow.parquet as pq
+        have = set(pq.read_schema(filename).names)
+        return p.read_parquet(filename,
+                              columns=[c for c in columns if c in have])
+    df = p.read_pickle(filename)
+    if columns is not None:
+        df = df[[c for c in columns if c in df]]
+    return df
+
+
+class FrameDataset(object):
+    """
+    The result of a FrameAccumulator: either one in-memory frame or the
+    part files written to a directory, read only when asked for.
+    A dataset directory written by an earlier run can be opened with
+    FrameDataset(path=spillDir).
+    """
+
+    def __init__(self, path=None, frame=None):
+        self.path = path
+        self._frame = frame
+
+    def files(self):
+        """The part files, in the order they were written."""
+        if self.path is None:
+            return []
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')) +
+                      glob.glob(os.path.join(self.path, 'part-*.pkl')))
+
+    def clear(self):
+        """Delete the part files, e.g. before a new result is written to path."""
+        for filename in self.files():
+            os.remove(filename)
+
+    def iterChunks(self, columns=None):
+        """Yield the dataset one part at a time."""
+        if self._frame is not None:
+            yield self._frame if columns is None else \
+                self._frame[[c for c in columns if c in self._frame]]
+            return
+        for filename in self.files():
+            yield readFrame(filename, columns)
+
+    def load(self, columns=None):
+        """Read the whole dataset (or just columns) into one dataframe."""
+        if self._frame is not None and columns is None:
+            return self._frame
+        return concatFrames(self.iterChunks(columns))
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.iterChunks(columns=[]))
+
+
+class FrameAccumulator(object):
+    """
+    Append dataframes in O(rows) total time.
+    Without spillDir everything stays in memory and is concatenated once by
+    finish(). With spillDir, each time spillRows rows are buffered they are
+    written out as one part file, so memory stays bounded. Part files left
+    in spillDir by an earlier run are deleted first, so they can't get
+    mixed into this result.
+    """
+
+    def __init__(self, spillDir=None, spillRows=SPILL_ROWS):
+        self.spillDir = spillDir
+        self.spillRows = spillRows
+        self.nrows = 0
+        self._chunks = []
+        self._buffered = 0
+        self._nparts = 0
+        if spillDir is not None:
+            try:
+                os.makedirs(spillDir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            FrameDataset(path=spillDir).clear()
+
+    def append(self, df):
+        if len(df) == 0:
+            return
+        self._chunks.append(df)
+        self._buffered += len(df)
+        self.nrows += len(df)
+        if self.spillDir is not None and self._buffered >= self.spillRows:
+            self._spill()
+
+    def _spill(self):
+        df = concatFrames(self._chunks)
+        self._chunks = []
+        self._buffered = 0
+        if len(df) == 0:
+            return
+        writeFrame(df, os.path.join(self.spillDir, 'part-%05i' % self._nparts))
+        self._nparts += 1
+
+    def finish(self):
+        """Return the FrameDataset of everything appended."""
+        if self.spillDir is None:
+            frame = concatFrames(self._chunks)
+            self._chunks = []
+            return FrameDataset(frame=frame)
+        self._spill()
+        return FrameDataset(path=self.spillDir)
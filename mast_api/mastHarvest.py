@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keep a local copy of a collection's CAOM metadata current with few queries.
+
+harvest() walks a time window of a collection in slices of a time column
+(t_obs_release by default, or t_min), pages through Mast.Caom.Filtered
+for each slice and remembers how far it got, the high-water mark, in a
+small json state file. The next run starts from that mark, so only new
+observations are fetched. The last overlapDays before the mark are asked
+for again to pick up observations that were changed after release;
+consumers should keep the last row per obsid. A collection harvested for
+the first time starts from its EPOCHS entry, or from its earliest value
+of the time column, found with a few COUNT_BIG(*) queries.
+
+Usage:
+    import mastHarvest
+    for lo, hi, df in mastHarvest.harvest('K2'):
+        mirror.append(df)
+"""
+
+import os
+import json
+import time
+import errno
+
+import numpy as np
+
+import mastAPITools as api
+import mastFrameStore
+
+DEFAULT_STATE = '~/.mastcache/harvest.json'
+
+#MJD of the unix epoch
+MJD_UNIX = 40587.
+
+PAGE_SIZE = 50000
+
+#Re-read this much before the high-water mark for changed observations
+OVERLAP_DAYS = 1.
+
+#MJD to start a first harvest of a collection from, instead of searching
+#for its earliest observation, e.g. EPOCHS['K2'] = 56700.
+EPOCHS = {}
+
+
+def nowMjd():
+    return time.time() / 86400. + MJD_UNIX
+
+
+def rangeFilter(field, lo, hi):
+    """A Mast.Caom.Filtered filter for lo <= field <= hi."""
+    return {"paramName": field,
+            "values": [{"min": lo, "max": hi}]}
+
+
+def sliceRequest(collection, field, lo, hi, columns="*", filters=()):
+    """The Mast.Caom.Filtered request for one time slice of a collection."""
+    requestFilters = [{"paramName": "obs_collection",
+                       "values": [collection]},
+                      rangeFilter(field, lo, hi)] + list(filters)
+    return {"service": "Mast.Caom.Filtered",
+            "format": "json",
+            "params": {"columns": api._columnString(columns),
+                       "filters": requestFilters}}
+
+
+def earliest(collection, field, filters=(), lo=0., hi=None, resolution=1.):
+    """
+    The earliest value of field in collection to within resolution days,
+    found by bisecting [lo, hi] (hi defaults to now) with COUNT_BIG(*)
+    queries, about log2((hi - lo) / resolution) of them. The answer is at
+    or just before the first value. Returns None if there are no rows.
+    """
+    if hi is None:
+        hi = nowMjd()
+
+    def anyBefore(upTo):
+        return api.countRows(sliceRequest(collection, field, lo, upTo,
+                                          filters=filters)) > 0
+
+    if not anyBefore(hi):
+        return None
+    start = lo
+    while hi - start > resolution:
+        mid = (start + hi) / 2.
+        if anyBefore(mid):
+            hi = mid
+        else:
+            start = mid
+    return start
+
+
+def timeSlices(start, end, sliceDays):
+    """[(lo, hi), ...] covering start to end in steps of sliceDays."""
+    edges = [float(edge) for edge in np.arange(start, end, sliceDays)] + [end]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+class HarvestState(object):
+    """
+    The high-water mark of every (collection, field) harvested, saved as
+    {"K2 t_obs_release": {"highWater": mjd, "lastRun": unix time}}.
+    """
+
+    def __init__(self, filename=DEFAULT_STATE):
+        self.filename = os.path.expanduser(filename)
+        try:
+            with open(self.filename, 'r') as FLE:
+                self.marks = json.load(FLE)
+        except (IOError, OSError, ValueError):
+            self.marks = {}
+
+    def _key(self, collection, field):
+        return "%s %s" % (collection, field)
+
+    def highWater(self, collection, field):
+        return self.marks.get(self._key(collection, field), {}).get('highWater')
+
+    def setHighWater(self, collection, field, mjd):
+        self.marks[self._key(collection, field)] = {'highWater': mjd,
+                                                    'lastRun': time.time()}
+        self.save()
+
+    def forget(self, collection, field):
+        self.marks.pop(self._key(collection, field), None)
+        self.save()
+
+    def save(self):
+        """Atomically rewrite the state file."""
+        try:
+            os.makedirs(os.path.dirname(self.filename))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        tmpName = self.filename + '.tmp'
+        with open(tmpName, 'w') as FLE:
+            json.dump(self.marks, FLE)
+        os.replace(tmpName, self.filename)
+
+
+def harvest(collection, start=None, end=None, field='t_obs_release',
+            sliceDays=90., overlapDays=OVERLAP_DAYS, columns="*", filters=(),
+            state=None, pagesize=PAGE_SIZE, epoch=None):
+    """
+    Generator over the observations of collection with field between start
+    and end (MJD), one time slice at a time.
+
+    start defaults to the saved high-water mark less overlapDays. If the
+    collection was never harvested it is epoch, EPOCHS[collection] or
+    else the earliest field value in the collection (see earliest), so a
+    first run walks the whole history slice by slice like any other.
+    end defaults to now. columns and filters narrow the request as for
+    Mast.Caom.Filtered.
+    state is a HarvestState (default the one in ~/.mastcache) or False to
+    not remember anything. The high-water mark moves to the end of a
+    slice once the caller asks for the next one, so an interrupted run
+    repeats at most one slice.
+
+    Yields (lo, hi, df) with the observations of each slice as a dataframe.
+    """
+    if state is None:
+        state = HarvestState()
+    if end is None:
+        end = nowMjd()
+    if start is None:
+        mark = state.highWater(collection, field) if state else None
+        if mark is not None:
+            start = mark - overlapDays
+        elif epoch is not None:
+            start = epoch
+        elif collection in EPOCHS:
+            start = EPOCHS[collection]
+        else:
+            start = earliest(collection, field, filters, hi=end)
+            if start is None:
+                return
+    if start >= end:
+        return
+
+    for lo, hi in timeSlices(start, end, sliceDays):
+        request = sliceRequest(collection, field, lo, hi, columns, filters)
+        df = mastFrameStore.concatFrames(
+            api.iterMastQuery(request, pagesize=pagesize, asDataFrame=True))
+        yield lo, hi, df
+        if state:
+            state.setHighWater(collection, field, hi)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local index of CAOM observations for answering cone and filtered queries
+without asking MAST.
+
+The index is filled from bulk Mast.Caom.Filtered dumps of whole
+collections (Kepler, K2, TESS, HST, ...), kept as one columnar file and
+searched with a k-d tree on unit vectors (scipy), or a dec sorted scan if
+scipy is not installed. refresh() only pulls the observations released
+since the last sync (see mastHarvest).
+
+Like mastCrossmatch, the local match uses the centre of each observation
+(s_ra, s_dec) rather than its footprint.
+
+Usage:
+    import mastIndex
+    index = mastIndex.ObservationIndex()
+    index.populate(['Kepler', 'K2'])
+    index.refresh()          #later on, only the new observations
+    df = index.coneSearch(290.5, 44.2, 8)
+    kinds = index.uniqueObservations(290.5, 44.2, 8)
+"""
+
+import os
+import json
+import errno
+
+import numpy as np
+import pandas as p
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+import mastAPITools as api
+import mastFrameStore
+import mastHarvest
+import mastResolver
+
+DEFAULT_INDEX = '~/.mastcache/caomIndex'
+
+#What the local queries need; the full CAOM row is much wider
+INDEX_COLUMNS = ['obsid', 'obs_id', 'obs_collection', 'project',
+                 'instrument_name', 'filters', 'target_name',
+                 'dataproduct_type', 's_ra', 's_dec', 't_min', 't_max',
+                 't_exptime', 't_obs_release', 'dataURL']
+
+#Repeated strings are stored once per column
+CATEGORY_COLUMNS = ['obs_collection', 'project', 'instrument_name',
+                    'filters', 'dataproduct_type']
+
+PAGE_SIZE = 50000
+
+
+def unitVectors(ra, dec):
+    """Unit vectors (n, 3) of positions in degrees."""
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    cosDec = np.cos(dec)
+    return np.column_stack([cosDec * np.cos(ra), cosDec * np.sin(ra),
+                            np.sin(dec)])
+
+
+def chordLength(radius_deg):
+    """Straight line distance between unit vectors radius_deg apart."""
+    return 2. * np.sin(np.radians(radius_deg) / 2.)
+
+
+class ObservationIndex(object):
+    """
+    The observations of some collections, held in memory as one dataframe
+    with a spatial index over (s_ra, s_dec).
+    path is the directory the index and its sync state are saved in.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX):
+        self.path = os.path.expanduser(path)
+        self.sync = {}
+        self.obs = p.DataFrame(columns=INDEX_COLUMNS)
+        self._tree = None
+        self._xyz = None
+        self._order = None
+        self._arrays = {}
+        self._load()
+
+    def _dataFile(self):
+        ext = '.parquet' if mastFrameStore.PARQUET else '.pkl'
+        return os.path.join(self.path, 'observations' + ext)
+
+    def _syncFile(self):
+        return os.path.join(self.path, 'sync.json')
+
+    def _load(self):
+        try:
+            with open(self._syncFile(), 'r') as FLE:
+                self.sync = json.load(FLE)
+        except (IOError, OSError, ValueError):
+            return
+        dataFile = self._dataFile()
+        if not os.path.isfile(dataFile):
+            return
+        self.obs = mastFrameStore.readFrame(dataFile)
+        for col in CATEGORY_COLUMNS:
+            self.obs[col] = self.obs[col].astype('category')
+        self._build()
+
+    def save(self):
+        """Write the observations and sync state (atomically)."""
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        mastFrameStore.writeFrame(self.obs,
+                                  os.path.join(self.path, 'observations'))
+        tmpName = self._syncFile() + '.tmp'
+        with open(tmpName, 'w') as FLE:
+            json.dump(self.sync, FLE)
+        os.replace(tmpName, self._syncFile())
+
+    def _build(self):
+        """(Re)build the spatial index over the current observations."""
+        obs = self.obs
+        self._arrays = {}
+        good = np.isfinite(obs['s_ra'].to_numpy(dtype=float)) & \
+            np.isfinite(obs['s_dec'].to_numpy(dtype=float))
+        rows = np.nonzero(good)[0]
+        dec = obs['s_dec'].to_numpy(dtype=float)[rows]
+        if cKDTree is not None:
+            self._order = rows
+            self._xyz = unitVectors(obs['s_ra'].to_numpy(dtype=float)[rows], dec)
+            self._tree = cKDTree(self._xyz) if len(rows) else None
+        else:
+            #No scipy: sort by dec and only test the rows in the dec band
+            sort = np.argsort(dec, kind='stable')
+            self._order = rows[sort]
+            self._dec = dec[sort]
+            self._xyz = unitVectors(
+                obs['s_ra'].to_numpy(dtype=float)[self._order], self._dec)
+
+    def _merge(self, frames):
+        """Add new or changed observations, replacing rows with the same obsid."""
+        new = mastFrameStore.concatFrames(frames)
+        if len(new) == 0:
+            return 0
+        new = new.reindex(columns=INDEX_COLUMNS)
+        obs = p.concat([self.obs.astype({c: object for c in CATEGORY_COLUMNS
+                                         if c in self.obs}), new],
+                       axis=0, ignore_index=True, sort=False)
+        obs = obs.drop_duplicates('obsid', keep='last').reset_index(drop=True)
+        for col in CATEGORY_COLUMNS:
+            obs[col] = obs[col].astype('category')
+        self.obs = obs
+        self._build()
+        return len(new)
+
+    def populate(self, collections, save=True):
+        """Load every observation of the collections (list of names)."""
+        for collection in collections:
+            self.sync.pop(collection, None)
+        return self.refresh(collections, save=save)
+
+    def refresh(self, collections=None, save=True):
+        """
+        Pull the observations released since the last sync of each
+        collection (all of them the first time) with mastHarvest.
+        collections defaults to those already in the index.
+        Returns the number of rows fetched.
+        """
+        if collections is None:
+            collections = list(self.sync)
+        frames = []
+        synced = {}
+        for collection in collections:
+            since = self.sync.get(collection)
+            end = mastHarvest.nowMjd()
+            start = None if since is None else since - mastHarvest.OVERLAP_DAYS
+            for lo, hi, df in mastHarvest.harvest(collection, start=start,
+                                                  end=end, columns=INDEX_COLUMNS,
+                                                  state=False, pagesize=PAGE_SIZE):
+                frames.append(df)
+            synced[collection] = end
+        nrows = self._merge(frames)
+        #Only move the marks once the rows are safely in the index
+        self.sync.update(synced)
+        if save:
+            self.save()
+        return nrows
+
+    def _near(self, ra, dec, radius_deg):
+        """Row numbers of the observations within radius_deg of ra, dec."""
+        if self._xyz is None or len(self._xyz) == 0:
+            return np.array([], int)
+        xyz = unitVectors([ra], [dec])[0]
+        chord = chordLength(radius_deg)
+        if self._tree is not None:
+            hits = np.asarray(self._tree.query_ball_point(xyz, chord), int)
+            return np.sort(self._order[hits])
+        lo, hi = np.searchsorted(self._dec, [dec - radius_deg, dec + radius_deg])
+        close = ((self._xyz[lo:hi] - xyz) ** 2).sum(axis=1) <= chord ** 2
+        return np.sort(self._order[lo:hi][close])
+
+    def _column(self, name):
+        """
+        A column as a numpy array, kept between calls: picking a few rows
+        out of an array is far cheaper than out of the dataframe.
+        """
+        if name not in self._arrays:
+            self._arrays[name] = self.obs[name].to_numpy()
+        return self._arrays[name]
+
+    def coneSearch(self, ra, dec, radius_arcsec):
+        """The indexed observations within radius_arcsec of ra, dec, as a dataframe."""
+        return self.obs.iloc[self._near(ra, dec, radius_arcsec / 3600.)]
+
+    def targetNameConeSearch(self, targetName, radius_arcsec, store=None):
+        """
+        coneSearch around a target name. The name is resolved through
+        mastResolver (remembered in its NameStore), so only names never
+        seen before go to MAST.
+        """
+        coords = mastResolver.resolveNames([targetName], store=store)
+        if coords.failed[0]:
+            raise IOError("Could not reach the resolver for %s" % targetName)
+        if not coords.resolved[0]:
+            return self.obs.iloc[:0]
+        return self.coneSearch(coords.ra[0], coords.dec[0], radius_arcsec)
+
+    def projectConeSearch(self, ra, dec, radius_deg, project, maxData=1000000):
+        """
+        The observations of project (a name or list of names) within
+        radius_deg of ra, dec. This is the local counterpart of
+        mastAPITools.coneSearchWithProjectCounts, and takes the same radius
+        value: that function's radius_arcmin goes into the MAST position
+        string unchanged, which MAST reads as degrees.
+        Unlike it, returns numObs,df (a dataframe, not the json) with df
+        None if numObs > maxData.
+        """
+        rows = self._near(ra, dec, radius_deg)
+        if isinstance(project, str):
+            project = [project]
+        rows = rows[np.isin(self._column('project')[rows], project)]
+        if len(rows) > maxData:
+            return len(rows), None
+        return len(rows), self.obs.iloc[rows]
+
+    def uniqueObservations(self, ra, dec, radius_arcsec,
+                           columns=["obs_collection", "project"]):
+        """
+        Like k2MultiMission.getUniqueObservations: the unique "a-b"
+        combinations of two columns among the observations in the cone.
+        """
+        rows = self._near(ra, dec, radius_arcsec / 3600.)
+        if len(rows) == 0:
+            return []
+        return np.unique(["%s-%s" % (x, y) for x, y
+                          in zip(self._column(columns[0])[rows],
+                                 self._column(columns[1])[rows])])
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fetch and pick data products for many observations at once.
+
+Mast.Caom.Products takes a comma separated list of obsids, so the product
+lists of hundreds of observations come back in one paged request.
+Selectors say which products are wanted (file name suffix or pattern,
+description, product type, calibration level); their patterns are
+compiled once and each is tested against the distinct values of a column
+rather than every row, so picking files out of a million products is one
+vectorized pass.
+
+Usage:
+    import mastProducts
+    products = mastProducts.fetchProducts(obsids)
+    wanted = mastProducts.selectProducts(products,
+                                         mastProducts.CADENCE_SELECTORS['dv'])
+    api.retrieveMastData(wanted.dataURI, wanted.productFilename, localDir='/data/')
+
+    #or everything at once for a list of Kepler targets
+    manifest = mastProducts.downloadKeplerTimeseriesMany(kepids, 'lc', '/data/')
+
+See bulkTimeseries.py for the command line version.
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as p
+
+import mastAPITools as api
+import mastDownload
+import mastFrameStore
+
+#obsids per Mast.Caom.Products request, keeps the request string short
+OBSID_BATCH = 500
+
+#Target names per Mast.Caom.Filtered request
+TARGET_BATCH = 500
+
+PAGE_SIZE = 50000
+
+
+class Selector(object):
+    """
+    A description of wanted products. Every criterion given must hold:
+    suffix and filename (regular expression) test productFilename,
+    description (regular expression) tests description, productType is
+    one or a list of SCIENCE, PREVIEW, AUXILIARY, ...,
+    calibLevel one or a list of calibration levels.
+    Patterns are case sensitive unless ignoreCase is set.
+    """
+
+    def __init__(self, suffix=None, filename=None, description=None,
+                 productType=None, calibLevel=None, ignoreCase=False):
+        flags = re.IGNORECASE if ignoreCase else 0
+        self.tests = []
+        if suffix is not None:
+            self.tests.append(('productFilename',
+                               re.compile(re.escape(suffix) + '$', flags)))
+        if filename is not None:
+            self.tests.append(('productFilename', re.compile(filename, flags)))
+        if description is not None:
+            self.tests.append(('description', re.compile(description, flags)))
+        if productType is not None:
+            self.tests.append(('productType', _oneOf(productType)))
+        if calibLevel is not None:
+            self.tests.append(('calib_level', _oneOf(calibLevel)))
+
+    def mask(self, products, _cache=None):
+        """Boolean array, True for the rows of products this selector wants."""
+        keep = np.ones(len(products), dtype=bool)
+        for column, test in self.tests:
+            if column not in products:
+                return np.zeros(len(products), dtype=bool)
+            keep &= _columnMask(products, column, test, _cache)
+        return keep
+
+
+def _oneOf(values):
+    """A test that a value is one of values."""
+    if isinstance(values, (str, int, float)):
+        values = [values]
+    return frozenset(values)
+
+
+def _columnMask(products, column, test, cache=None):
+    """
+    Apply test (a compiled pattern or a set) to the distinct values of
+    products[column] and spread the answer back over the rows.
+    cache remembers the factorized columns between selectors.
+    """
+    if cache is not None and column in cache:
+        codes, uniques = cache[column]
+    else:
+        codes, uniques = p.factorize(products[column])
+        if cache is not None:
+            cache[column] = codes, uniques
+    if isinstance(test, frozenset):
+        hits = np.array([value in test for value in uniques], dtype=bool)
+    else:
+        hits = np.array([test.search(str(value)) is not None
+                         for value in uniques], dtype=bool)
+    #factorize marks missing values with -1, they never match
+    hits = np.append(hits, False)
+    return hits[codes]
+
+
+def selectProducts(products, selectors):
+    """
+    The rows of products (a dataframe from fetchProducts) wanted by any of
+    selectors (a Selector or a list of them).
+    """
+    if isinstance(selectors, Selector):
+        selectors = [selectors]
+    if len(products) == 0:
+        return products
+    cache = {}
+    keep = np.zeros(len(products), dtype=bool)
+    for selector in selectors:
+        keep |= selector.mask(products, cache)
+    return products[keep]
+
+
+#What downloadKeplerTimeseries has always fetched for each cadence
+CADENCE_SELECTORS = {'lc': [Selector(filename='llc')],
+                     'sc': [Selector(filename='slc')],
+                     'dv': [Selector(filename='_dv')]}
+
+
+def productsRequest(obsids, pagesize=PAGE_SIZE):
+    """The Mast.Caom.Products request for a list of obsids."""
+    return {'service': 'Mast.Caom.Products',
+            'params': {'obsid': ",".join(str(obsid) for obsid in obsids)},
+            'format': 'json',
+            'pagesize': pagesize,
+            'page': 1}
+
+
+def _batches(values, size):
+    values = list(values)
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def _fetchAll(request):
+    return mastFrameStore.concatFrames(
+        api.iterMastQuery(request, asDataFrame=True, prefetch=False))
+
+
+def fetchProducts(obsids, batchSize=OBSID_BATCH, maxWorkers=4):
+    """
+    The product lists of many observations as one dataframe, fetched
+    batchSize obsids per request, maxWorkers requests at a time.
+    The parent_obsid column (obsID for older responses) says which of
+    obsids each product belongs to.
+    """
+    obsids = list(dict.fromkeys(obsids))
+    requests = [productsRequest(batch) for batch in _batches(obsids, batchSize)]
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        frames = list(executor.map(_fetchAll, requests))
+    return mastFrameStore.concatFrames(frames)
+
+
+#How each mission names its timeseries targets in CAOM.
+#cadence maps the cadence asked for to the observations to look for
+#(a free text obs_id pattern, or None for any) and the products to keep.
+MISSIONS = {
+    'KIC': {'collection': 'Kepler', 'target': 'kplr%09u', 'dir': '%09u',
+            'cadence': {'lc': ('%lc%', CADENCE_SELECTORS['lc']),
+                        'sc': ('%sc%', CADENCE_SELECTORS['sc']),
+                        'dv': ('%lc%', CADENCE_SELECTORS['dv'])}},
+    'EPIC': {'collection': 'K2', 'target': 'ktwo%09u', 'dir': '%09u',
+             'cadence': {'lc': ('%lc%', [Selector(suffix='llc.fits')]),
+                         'sc': ('%sc%', [Selector(suffix='slc.fits')])}},
+    'TIC': {'collection': 'TESS', 'target': '%u', 'dir': '%016u',
+            'cadence': {'lc': (None, [Selector(suffix='_lc.fits')]),
+                        'sc': (None, [Selector(suffix='_fast-lc.fits')]),
+                        'dv': (None, [Selector(filename='_dv')])}},
+    }
+
+
+def missionObservations(mission, ids, cadence, batchSize=TARGET_BATCH,
+                        maxWorkers=4):
+    """
+    The timeseries observations of many targets of one mission ('KIC',
+    'EPIC' or 'TIC', see MISSIONS), batchSize targets per
+    Mast.Caom.Filtered request.
+    Returns a dataframe with targetid, obsid and target_name. Targets with
+    no observation are missing from it, TESS targets have one per sector.
+    """
+    info = MISSIONS[mission.upper()]
+    obsIdText = info['cadence'][cadence.lower()][0]
+    names = [info['target'] % int(targetid) for targetid in ids]
+
+    def request(batch):
+        filters = [{"paramName": "obs_collection",
+                    "values": [info['collection']]},
+                   {"paramName": "dataproduct_type",
+                    "values": ["timeseries"]},
+                   {"paramName": "target_name",
+                    "values": batch}]
+        if obsIdText is not None:
+            filters.append({"paramName": "obs_id",
+                            "values": [],
+                            "freeText": obsIdText})
+        return {"service": "Mast.Caom.Filtered",
+                "format": "json",
+                "params": {"columns": "obsid,obs_id,target_name",
+                           "filters": filters}}
+
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        frames = list(executor.map(_fetchAll, [request(batch) for batch
+                                               in _batches(names, batchSize)]))
+    obs = mastFrameStore.concatFrames(frames)
+    if len(obs) == 0:
+        return p.DataFrame(columns=['targetid', 'obsid', 'target_name'])
+    obs['targetid'] = obs['target_name'].str.extract(r'(\d+)', expand=False) \
+        .astype(np.int64)
+    return obs
+
+
+def keplerObservations(kepids, cadence, batchSize=TARGET_BATCH, maxWorkers=4):
+    """
+    missionObservations for Kepler: the observations of cadence ("lc" or
+    "sc") for many kepids, with the target in the kepid column.
+    """
+    obs = missionObservations('KIC', kepids, cadence, batchSize=batchSize,
+                              maxWorkers=maxWorkers)
+    return obs.rename(columns={'targetid': 'kepid'})
+
+
+def timeseriesProducts(mission, ids, cadence, maxWorkers=4):
+    """
+    The timeseries products of cadence ("lc", "sc" or "dv") to download
+    for many targets of mission: a product dataframe with the extra columns
+    targetid and localName (<target dir>/<productFilename>).
+    Two kinds of query are made, each once per few hundred targets.
+    """
+    info = MISSIONS[mission.upper()]
+    selectors = info['cadence'][cadence.lower()][1]
+    obs = missionObservations(mission, ids, cadence, maxWorkers=maxWorkers)
+    if len(obs) == 0:
+        return p.DataFrame(columns=['targetid', 'localName', 'dataURI'])
+    products = fetchProducts(obs['obsid'], maxWorkers=maxWorkers)
+    if len(products) == 0:
+        return p.DataFrame(columns=['targetid', 'localName', 'dataURI'])
+    wanted = selectProducts(products, selectors).copy()
+    targetOf = dict(zip(obs['obsid'].astype(str), obs['targetid']))
+    parent = 'parent_obsid' if 'parent_obsid' in wanted else 'obsID'
+    wanted['targetid'] = [targetOf.get(str(obsid)) for obsid in wanted[parent]]
+    wanted = wanted[wanted['targetid'].notna()]
+    wanted['localName'] = [(info['dir'] % targetid) + '/' + name for targetid, name
+                           in zip(wanted['targetid'], wanted['productFilename'])]
+    #The same file can hang off more than one observation
+    return wanted.drop_duplicates('localName')
+
+
+def downloadKeplerTimeseriesMany(kepids, cadence, localDir, getNewOnly=True,
+                                 maxWorkers=4):
+    """
+    downloadKeplerTimeseries for a whole list of kepids: one filtered
+    query and one products query per few hundred targets, then a single
+    download of every selected file into localDir/<kepid>/.
+    Returns the download manifest.
+    """
+    wanted = timeseriesProducts('KIC', kepids, cadence, maxWorkers=maxWorkers)
+    if len(wanted) == 0:
+        return p.DataFrame(columns=mastDownload.MANIFEST_COLUMNS)
+    sizes = wanted['size'].to_numpy() if 'size' in wanted else None
+    return api.retrieveMastData(wanted['dataURI'].to_numpy(),
+                                wanted['localName'].to_numpy(),
+                                localDir=localDir, getNewOnly=getNewOnly,
+                                sizes=sizes)
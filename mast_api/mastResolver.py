@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched name resolution through Mast.Name.Lookup.
+
+resolveNames takes a list of target names, drops repeats, looks up the
+ones it hasn't seen before a few at a time, remembers the answers in a
+small json file and returns one table of RA/Dec for the whole list.
+
+Usage:
+    import mastResolver
+    coords = mastResolver.resolveNames(["KIC %u" % k for k in kepids])
+    for name, ra, dec in zip(coords.name, coords.ra, coords.dec):
+        mastData = api.coneSearch(ra, dec, 8)
+"""
+
+import os
+import json
+import errno
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as p
+
+import mastAPITools as api
+
+DEFAULT_STORE = '~/.mastcache/names.json'
+
+
+class NameStore(object):
+    """
+    Persistent memo of resolved names, {name: [ra, dec]}.
+    Names MAST could not resolve are kept as None so they are not asked
+    about again; network failures are never stored.
+    Call save() to write new entries to disk.
+    """
+
+    def __init__(self, filename=DEFAULT_STORE):
+        self.filename = os.path.expanduser(filename)
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(self.filename, 'r') as FLE:
+                self.names = json.load(FLE)
+        except (IOError, OSError, ValueError):
+            self.names = {}
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def get(self, name):
+        return self.names.get(name)
+
+    def set(self, name, coord):
+        with self._lock:
+            self.names[name] = coord
+            self._dirty = True
+
+    def save(self):
+        """Atomically rewrite the store if anything was added."""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.filename))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            tmpName = self.filename + '.tmp'
+            with open(tmpName, 'w') as FLE:
+                json.dump(self.names, FLE)
+            os.replace(tmpName, self.filename)
+            self._dirty = False
+
+
+def resolveName(targetName):
+    """
+    Ask Mast.Name.Lookup for one name.
+    Returns [ra, dec] in degrees, or None if the name is not known.
+    """
+    headers,resolvedObjectString = api.mastQuery(api.resolverRequest(targetName))
+    resolvedObject = json.loads(resolvedObjectString)
+    try:
+        coord = resolvedObject['resolvedCoordinate'][0]
+    except (IndexError, KeyError):
+        return None
+    return [coord['ra'], coord['decl']]
+
+
+def resolveNames(targetNames, maxWorkers=8, store=None):
+    """
+    Resolve a list of target names to coordinates.
+    Repeated names are only looked up once and names already in store
+    are not looked up at all. Up to maxWorkers lookups run at once.
+    store is a NameStore; by default the one in ~/.mastcache is used,
+    pass store=False to not remember anything between runs.
+
+    Returns a dataframe in the same order as targetNames with columns
+    name, ra, dec (NaN where unresolved), resolved (bool) and failed
+    (bool), True where the lookup itself failed (e.g. a network error) so
+    the name is worth asking about again, unlike one MAST doesn't know.
+    """
+    if store is None:
+        store = NameStore()
+    names = list(targetNames)
+    unique = list(dict.fromkeys(names))
+
+    known = {}
+    todo = []
+    for name in unique:
+        if store and name in store:
+            known[name] = store.get(name)
+        else:
+            todo.append(name)
+
+    failed = []
+    if todo:
+        with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            futures = [executor.submit(resolveName, name) for name in todo]
+            for name, future in zip(todo, futures):
+                try:
+                    known[name] = future.result()
+                except Exception:
+                    known[name] = None
+                    failed.append(name)
+                    continue
+                if store:
+                    store.set(name, known[name])
+        if store:
+            store.save()
+    if failed:
+        print("Could not reach the resolver for %i names" % len(failed))
+
+    coords = np.array([known[name] if known[name] is not None
+                       else [np.nan, np.nan] for name in names],
+                      dtype=float).reshape(-1, 2)
+    failed = set(failed)
+    return p.DataFrame({'name': names,
+                        'ra': coords[:, 0],
+                        'dec': coords[:, 1],
+                        'resolved': np.isfinite(coords[:, 0]),
+                        'failed': np.array([name in failed for name in names],
+                                           dtype=bool)})
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent, pooled connections to the MAST server.
+
+Every call to mastQuery used to open a fresh https connection, which means
+a full TCP and TLS handshake per query. The ConnectionPool below keeps a
+small number of keep-alive connections open per host and hands them out
+to whichever thread asks next.
+
+Usage:
+    import mastSession
+    pool = mastSession.configurePool(maxsize=8, idleTimeout=30)
+    pool.stats = mastSession.QueryStats()
+    ... run queries through mastAPITools ...
+    print(pool.stats.summary())
+"""
+
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+try: # Python 3.x
+    import http.client as httplib
+except ImportError:  # Python 2.x
+    import httplib
+
+import pandas as p
+
+MAST_SERVER = 'mast.stsci.edu'
+
+# Errors that mean a kept-alive connection was dropped by the server while
+# it sat in the pool.  A request on a reused connection that fails this way
+# is retried once on a brand new connection.
+STALE_ERRORS = (httplib.HTTPException, socket.error)
+
+
+class QueryStats(object):
+    """
+    Thread-safe collector of per-call latency.
+    One record is kept per request: the label (MAST service name or
+    'download'), the wall time in seconds, the number of bytes received
+    and whether the connection was reused from the pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []
+
+    def record(self, label, seconds, nbytes=0, reused=False):
+        with self._lock:
+            self.records.append({'label': label,
+                                 'seconds': seconds,
+                                 'nbytes': nbytes,
+                                 'reused': reused})
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    def toDataFrame(self):
+        with self._lock:
+            return p.DataFrame(self.records,
+                               columns=['label', 'seconds', 'nbytes', 'reused'])
+
+    def summary(self):
+        """
+        Return a dataframe with one row per label giving the number of calls,
+        mean/median/max latency, total bytes and the fraction of calls that
+        reused a pooled connection.
+        """
+        df = self.toDataFrame()
+        if len(df) == 0:
+            return df
+        grouped = df.groupby('label')
+        return p.DataFrame({'calls': grouped['seconds'].count(),
+                            'mean_s': grouped['seconds'].mean(),
+                            'median_s': grouped['seconds'].median(),
+                            'max_s': grouped['seconds'].max(),
+                            'total_bytes': grouped['nbytes'].sum(),
+                            'reused_frac': grouped['reused'].mean()})
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive HTTP(S) connections to a single host.
+
+    maxsize is the number of idle connections kept open for reuse.
+    Any number of connections may be checked out at once; extras beyond
+    maxsize are simply closed when they are returned.
+    idleTimeout is the number of seconds an unused connection is kept
+    before it is thrown away instead of reused.
+    timeout is the socket timeout passed to each connection.
+    https=False talks plain http, which is only useful for a local server.
+    stats is an optional QueryStats that every request is recorded into.
+    """
+
+    def __init__(self, server=MAST_SERVER, maxsize=4, idleTimeout=60.,
+                 timeout=300., https=True, port=None, stats=None):
+        self.server = server
+        self.port = port
+        self.https = https
+        self.maxsize = maxsize
+        self.idleTimeout = idleTimeout
+        self.timeout = timeout
+        self.stats = stats
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _newConnection(self):
+        if self.https:
+            return httplib.HTTPSConnection(self.server, port=self.port,
+                                           timeout=self.timeout)
+        return httplib.HTTPConnection(self.server, port=self.port,
+                                      timeout=self.timeout)
+
+    def getConnection(self):
+        """
+        Return (conn, reused). Idle connections older than idleTimeout are
+        closed rather than handed out.
+        """
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                conn, lastUsed = self._idle.pop()
+                if now - lastUsed < self.idleTimeout:
+                    return conn, True
+                conn.close()
+        return self._newConnection(), False
+
+    def putConnection(self, conn):
+        """Give a connection back to the pool for reuse."""
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def release(self, conn, resp):
+        """
+        Return conn to the pool if resp was read to the end and the server
+        agreed to keep the connection alive, otherwise close it.
+        """
+        if resp is not None and resp.isclosed() and not resp.will_close:
+            self.putConnection(conn)
+        else:
+            conn.close()
+
+    def closeAll(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, lastUsed in idle:
+            conn.close()
+
+    def _connect(self, conn, span):
+        """Open a new connection, timing the TCP connect and TLS handshake."""
+        tcp = [0.]
+        create = conn._create_connection
+
+        def timedCreate(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return create(*args, **kwargs)
+            finally:
+                tcp[0] = time.perf_counter() - t0
+
+        conn._create_connection = timedCreate
+        t0 = time.perf_counter()
+        conn.connect()
+        span.add('connect', tcp[0])
+        if self.https:
+            span.add('tls', time.perf_counter() - t0 - tcp[0])
+
+    def _open(self, method, url, body, headers, span=None):
+        """
+        Send a request and return (conn, resp, reused), retrying once on a
+        fresh connection if a pooled one turns out to have gone stale.
+        span (a mastTrace.Span) gets the connect, tls and ttfb times.
+        """
+        while True:
+            conn, reused = self.getConnection()
+            try:
+                if span is not None and not reused:
+                    self._connect(conn, span)
+                t0 = time.perf_counter()
+                conn.request(method, url, body, headers)
+                resp = conn.getresponse()
+            except STALE_ERRORS:
+                conn.close()
+                if reused:
+                    continue
+                raise
+            if span is not None:
+                span.add('ttfb', time.perf_counter() - t0)
+                span.bytesOut += len(body or '')
+                span.reused = reused
+            return conn, resp, reused
+
+    def request(self, method, url, body=None, headers={}, label=None,
+                stats=None, span=None):
+        """
+        Perform one request and read the whole response.
+        Returns status, head, content where head is the list of response
+        headers and content is the raw bytes of the body.
+        span is an optional mastTrace.Span to time the request into.
+        """
+        stats = stats if stats is not None else self.stats
+        t0 = time.time()
+        conn, resp, reused = self._open(method, url, body, headers, span)
+        try:
+            head = resp.getheaders()
+            t1 = time.perf_counter()
+            content = resp.read()
+        except Exception:
+            conn.close()
+            raise
+        self.release(conn, resp)
+        if span is not None:
+            span.add('transfer', time.perf_counter() - t1)
+            span.bytesIn += len(content)
+        if stats is not None:
+            stats.record(label or url, time.time() - t0, len(content), reused)
+        return resp.status, head, content
+
+    @contextmanager
+    def stream(self, method, url, body=None, headers={}, label=None,
+               stats=None, span=None):
+        """
+        Context manager yielding the open response so the body can be read
+        in pieces. The connection goes back to the pool on exit if the body
+        was consumed, otherwise it is closed.
+        Bytes are only counted in stats if the caller sets resp.nbytes,
+        and the transfer time in span if it adds to resp.readSeconds
+        (mastDecode.ResponseReader does both).
+        """
+        stats = stats if stats is not None else self.stats
+        t0 = time.time()
+        conn, resp, reused = self._open(method, url, body, headers, span)
+        resp.nbytes = 0
+        resp.readSeconds = 0.
+        try:
+            yield resp
+        except Exception:
+            conn.close()
+            raise
+        else:
+            self.release(conn, resp)
+        finally:
+            if stats is not None:
+                stats.record(label or url, time.time() - t0, resp.nbytes,
+                             reused)
+            if span is not None:
+                span.add('transfer', resp.readSeconds)
+                span.bytesIn += resp.nbytes
+
+
+_pools = {}
+_poolsLock = threading.Lock()
+
+
+def getPool(server=MAST_SERVER, https=True, port=None):
+    """
+    Return the shared pool for this host, creating it on first use.
+    """
+    key = (server, https, port)
+    with _poolsLock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(server, https=https, port=port)
+        return _pools[key]
+
+
+def configurePool(server=MAST_SERVER, https=True, port=None, **kwargs):
+    """
+    Replace the shared pool for this host with one built from kwargs
+    (maxsize, idleTimeout, timeout, stats). Returns the new pool.
+    """
+    key = (server, https, port)
+    pool = ConnectionPool(server, https=https, port=port, **kwargs)
+    with _poolsLock:
+        old = _pools.get(key)
+        _pools[key] = pool
+    if old is not None:
+        old.closeAll()
+    return pool
+
+
+def setPool(pool, server=MAST_SERVER, https=True, port=None):
+    """
+    Send requests for this host through pool instead, e.g. one pointing at
+    a local mastStandIn server. pool=None goes back to a fresh default pool.
+    Returns the pool it replaced, or None.
+    """
+    key = (server, https, port)
+    with _poolsLock:
+        old = _pools.pop(key, None)
+        if pool is not None:
+            _pools[key] = pool
+    return old
@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the MAST API, for benchmarks and offline tests.
+
+StandInServer answers /api/v0/invoke for the services these tools use
+(Mast.Name.Lookup, Mast.Caom.Cone, Mast.Caom.Filtered,
+Mast.Caom.Filtered.Position, Mast.Caom.Products,
+Mast.Catalogs.Filtered.Tic, Mast.Tic.Crossmatch) and /api/v0/download/file/ for the products
+it lists (other files are 404s). Queries are answered in the json, csv or
+votable format the request asks for. Answers come from recorded responses, a mastCache directory of
+real MAST answers, when there is one for the request, and otherwise from
+a seeded synthetic sky of observations, products and TIC stars.
+Latency, bandwidth and error injection (503s and EXECUTING answers) are
+configurable, so the client's retry and throughput code can be measured.
+
+Usage:
+    import mastStandIn
+    server = mastStandIn.StandInServer(latency=0.05, bandwidth=20e6,
+                                       errorRate=0.01)
+    server.start()
+    server.install()        #mastQuery and downloads now go to the stand-in
+    ...
+    server.stop()
+
+    #or from the shell, then point a client at http://127.0.0.1:8765
+    mastStandIn.py --port 8765 --latency 0.05
+"""
+
+import io
+import re
+import sys
+import json
+import gzip
+import time
+import random
+import getopt
+import hashlib
+import threading
+
+try: # Python 3.x
+    from urllib.parse import unquote_plus, parse_qs
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+except ImportError:  # Python 2.x
+    from urllib import unquote_plus
+    from urlparse import parse_qs
+    from BaseHTTPServer import HTTPServer as ThreadingHTTPServer, \
+        BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as p
+from astropy.table import Table
+from astropy.io import votable
+
+import mastSession
+import mastCache
+import mastCrossmatch
+
+#name, obs_collection/project, instrument, filters, target name format,
+#obs_id format, dataproduct_type, t_exptime
+MISSIONS = [('Kepler', 'Kepler', 'KEPLER', 'kplr%09u', 'kplr%09u_lc_Q111111',
+             'timeseries', 1800.),
+            ('K2', 'Kepler', 'KEPLER', 'ktwo%09u', 'ktwo%09u-c05_lc',
+             'timeseries', 1800.),
+            ('TESS', 'Photometer', 'TESS', '%u', 'tess-s0001-%016u',
+             'timeseries', 120.),
+            ('HST', 'WFC3/UVIS', 'F555W', 'TARGET-%u', 'ib%07u',
+             'image', 600.),
+            ('GALEX', 'GALEX', 'NUV', 'GALEX-%u', 'galex%u', 'image', 1500.)]
+
+#file name format (of the obs_id), description, productType, calib_level
+#of the products of each collection, named as mastProducts.MISSIONS expects
+_KEPLER_PRODUCTS = [
+    ('%s_llc.fits', 'Lightcurve Long Cadence (CLC) - Q1', 'SCIENCE', 2),
+    ('%s_slc.fits', 'Lightcurve Short Cadence (CSC) - Q1', 'SCIENCE', 2),
+    ('%s_dvt.fits', 'Data Validation time series', 'SCIENCE', 3),
+    ('%s_dvr.pdf', 'Data Validation full report', 'AUXILIARY', 3),
+    ('%s_preview.png', 'Preview image', 'PREVIEW', 2)]
+PRODUCTS = {
+    'Kepler': _KEPLER_PRODUCTS,
+    'K2': _KEPLER_PRODUCTS,
+    'TESS': [('%s_lc.fits', 'Light curves', 'SCIENCE', 3),
+             ('%s_fast-lc.fits', 'Fast light curves', 'SCIENCE', 3),
+             ('%s_tp.fits', 'Target pixel files', 'SCIENCE', 2),
+             ('%s_dvt.fits', 'Data validation time series', 'SCIENCE', 3),
+             ('%s_dvr.pdf', 'full data validation report', 'AUXILIARY', 3)],
+    'HST': [('%s_drz.fits', 'DADS DRZ file', 'SCIENCE', 3),
+            ('%s_flt.fits', 'DADS FLT file', 'SCIENCE', 2),
+            ('%s_raw.fits', 'DADS RAW file', 'SCIENCE', 1),
+            ('%s_spt.fits', 'DADS SPT file', 'AUXILIARY', 1),
+            ('%s_drz.jpg', 'Preview-Full', 'PREVIEW', 3)],
+    'GALEX': [('%s-nd-int.fits.gz', 'Intensity map', 'SCIENCE', 2),
+              ('%s-nd-cnt.fits.gz', 'Count map', 'SCIENCE', 2),
+              ('%s-nd-rrhr.fits.gz', 'Relative response map', 'AUXILIARY', 2),
+              ('%s-nd-skybg.fits.gz', 'Sky background map', 'AUXILIARY', 2),
+              ('%s-nd-int.jpg', 'Preview image', 'PREVIEW', 2)]}
+
+_DOWNLOAD_URI = re.compile(r'(?:mast:)?([^/]+)/url/([^/]+)/([^/]+)$')
+
+_FIELD_TYPES = {'f': 'float', 'i': 'int', 'u': 'int', 'b': 'boolean'}
+
+
+def _likeRegex(freeText):
+    """The regular expression of an SQL LIKE pattern ('%' and '_')."""
+    parts = [re.escape(c) if c not in '%_' else ('.*' if c == '%' else '.')
+             for c in freeText]
+    return re.compile('^' + ''.join(parts) + '$', re.IGNORECASE)
+
+
+def applyFilters(df, filters):
+    """Apply Mast.*.Filtered filters (values, ranges, freeText) to df."""
+    keep = np.ones(len(df), dtype=bool)
+    for f in filters:
+        name = f['paramName']
+        if name not in df:
+            return df.iloc[:0]
+        column = df[name]
+        values = f.get('values', [])
+        if values and isinstance(values[0], dict):
+            ranged = np.zeros(len(df), dtype=bool)
+            for v in values:
+                ranged |= ((column >= v.get('min', -np.inf)) &
+                           (column <= v.get('max', np.inf))).to_numpy()
+            keep &= ranged
+        elif values:
+            keep &= column.astype(str).isin([str(v) for v in values]).to_numpy()
+        if f.get('freeText'):
+            regex = _likeRegex(f['freeText'])
+            keep &= np.array([regex.match(str(v)) is not None for v in column],
+                             dtype=bool)
+    return df[keep]
+
+
+class SyntheticFixtures(object):
+    """
+    A reproducible fake sky: nobs observations of the MISSIONS spread over
+    the sky (half of them in a Kepler-field sized patch, so cone searches
+    find something), productsPerObs products per observation, each
+    fileSize bytes, and nstars TIC stars.
+    """
+
+    def __init__(self, nobs=100000, nstars=100000, productsPerObs=5,
+                 fileSize=200000, seed=42):
+        self.fileSize = fileSize
+        self.productsPerObs = productsPerObs
+        rng = np.random.RandomState(seed)
+
+        nfield = nobs // 2
+        ra = np.concatenate([rng.uniform(280., 300., nfield),
+                             rng.uniform(0., 360., nobs - nfield)])
+        dec = np.concatenate([rng.uniform(36., 52., nfield),
+                              np.degrees(np.arcsin(rng.uniform(-1, 1, nobs - nfield)))])
+        mission = rng.randint(0, len(MISSIONS), nobs)
+        ids = rng.randint(1000000, 300000000, nobs)
+        tmin = rng.uniform(54900., 60500., nobs)
+        rows = [MISSIONS[m] for m in mission]
+        self.obs = p.DataFrame({
+            'obsid': np.arange(1, nobs + 1).astype(str),
+            'obs_collection': [r[0] for r in rows],
+            'project': [r[0] for r in rows],
+            'instrument_name': [r[1] for r in rows],
+            'filters': [r[2] for r in rows],
+            'target_name': [r[3] % i for r, i in zip(rows, ids)],
+            'obs_id': [r[4] % i for r, i in zip(rows, ids)],
+            'dataproduct_type': [r[5] for r in rows],
+            't_exptime': [r[6] for r in rows],
+            's_ra': ra,
+            's_dec': dec,
+            't_min': tmin,
+            't_max': tmin + rng.uniform(1., 90., nobs),
+            't_obs_release': tmin + rng.uniform(90., 400., nobs),
+            'calib_level': rng.randint(1, 4, nobs),
+            })
+        self._xyz = None
+        self._stars = None
+        self._seed = seed
+        self._nstars = nstars
+        self._byTarget = None
+        self._byObsId = None
+
+    def _unitVectors(self, ra, dec):
+        ra, dec = np.radians(ra), np.radians(dec)
+        return np.column_stack([np.cos(dec) * np.cos(ra),
+                                np.cos(dec) * np.sin(ra), np.sin(dec)])
+
+    def cone(self, ra, dec, radius_deg):
+        if self._xyz is None:
+            self._xyz = self._unitVectors(self.obs['s_ra'].to_numpy(),
+                                          self.obs['s_dec'].to_numpy())
+        centre = self._unitVectors(np.array([ra]), np.array([dec]))[0]
+        chord = 2. * np.sin(np.radians(radius_deg) / 2.)
+        return self.obs[((self._xyz - centre) ** 2).sum(axis=1) <= chord ** 2]
+
+    def resolve(self, name):
+        """[ra, dec] of a name, from a matching observation if there is one."""
+        if self._byTarget is None:
+            self._byTarget = dict(zip(self.obs['target_name'],
+                                      zip(self.obs['s_ra'], self.obs['s_dec'])))
+        match = re.match(r'\s*(KIC|EPIC|TIC)\s*(\d+)', name, re.IGNORECASE)
+        if match:
+            fmt = {'KIC': 'kplr%09u', 'EPIC': 'ktwo%09u', 'TIC': '%u'}
+            target = fmt[match.group(1).upper()] % int(match.group(2))
+            if target in self._byTarget:
+                return list(self._byTarget[target])
+        digest = hashlib.md5(name.encode('utf-8')).digest()
+        return [int.from_bytes(digest[:4], 'big') / 2. ** 32 * 360.,
+                np.degrees(np.arcsin(int.from_bytes(digest[4:8], 'big') /
+                                     2. ** 31 - 1.))]
+
+    def productFilenames(self, collection, obsId):
+        return [fmt % obsId for fmt, description, productType, level
+                in PRODUCTS[collection][:self.productsPerObs]]
+
+    def hasFile(self, uri):
+        """Whether uri is the dataURI of one of the products listed."""
+        match = _DOWNLOAD_URI.match(uri)
+        if match is None:
+            return False
+        if self._byObsId is None:
+            self._byObsId = dict(zip(self.obs['obs_id'], self.obs['obs_collection']))
+        collection = self._byObsId.get(match.group(2))
+        return (collection is not None and collection.upper() == match.group(1)
+                and match.group(3) in self.productFilenames(collection,
+                                                            match.group(2)))
+
+    def products(self, obsids):
+        obs = self.obs[self.obs['obsid'].isin([str(o) for o in obsids])]
+        rows = []
+        for obsid, obsId, collection in zip(obs['obsid'], obs['obs_id'],
+                                            obs['obs_collection']):
+            for fmt, description, productType, level in \
+                    PRODUCTS[collection][:self.productsPerObs]:
+                filename = fmt % obsId
+                rows.append({'obsID': obsid, 'parent_obsid': obsid,
+                             'obs_collection': collection,
+                             'productFilename': filename,
+                             'description': description,
+                             'productType': productType,
+                             'calib_level': level,
+                             'dataURI': 'mast:%s/url/%s/%s' % (collection.upper(),
+                                                               obsId, filename),
+                             'size': self.fileSize})
+        return p.DataFrame(rows, columns=['obsID', 'parent_obsid',
+                                          'obs_collection', 'productFilename',
+                                          'description', 'productType',
+                                          'calib_level', 'dataURI', 'size'])
+
+    def stars(self):
+        if self._stars is None:
+            rng = np.random.RandomState(self._seed + 1)
+            n = self._nstars
+            self._stars = p.DataFrame({
+                'ID': np.sort(rng.choice(np.arange(1, 10 * n), n, replace=False)),
+                'ra': rng.uniform(0., 360., n),
+                'dec': np.degrees(np.arcsin(rng.uniform(-1, 1, n))),
+                'Tmag': rng.uniform(4., 18., n),
+                'Teff': rng.uniform(3000., 9000., n)})
+        return self._stars
+
+    def crossmatch(self, targets, raColumn, decColumn, radius_deg):
+        """The input rows joined to every star within radius_deg."""
+        stars = self.stars().sort_values('dec')
+        starDec = stars['dec'].to_numpy()
+        rows = []
+        for target in targets.to_dict('records'):
+            ra, dec = target[raColumn], target[decColumn]
+            lo, hi = np.searchsorted(starDec, [dec - radius_deg, dec + radius_deg])
+            near = stars.iloc[lo:hi]
+            sep = mastCrossmatch.angularSeparation(ra, dec, near['ra'].to_numpy(),
+                                                   near['dec'].to_numpy())
+            for star, d in zip(near[sep <= radius_deg].itertuples(),
+                               sep[sep <= radius_deg]):
+                rows.append(dict(target, MatchID=star.ID, MatchRA=star.ra,
+                                 MatchDEC=star.dec, dstArcSec=d * 3600.))
+        return p.DataFrame(rows, columns=list(targets.columns) +
+                           ['MatchID', 'MatchRA', 'MatchDEC', 'dstArcSec'])
+
+    def fileBytes(self, uri):
+        """The (repeatable) contents of a product."""
+        seed = hashlib.md5(uri.encode('utf-8')).digest()
+        return (seed * (self.fileSize // len(seed) + 1))[:self.fileSize]
+
+    def answer(self, request):
+        """Return (rows dataframe, or a dict for Name.Lookup) for request."""
+        service = request.get('service')
+        params = request.get('params', {})
+        if service == 'Mast.Name.Lookup':
+            ra, dec = self.resolve(params.get('input', ''))
+            return {'resolvedCoordinate': [{'ra': ra, 'decl': dec,
+                                            'canonicalName': params.get('input')}],
+                    'status': ''}
+        if service == 'Mast.Caom.Cone':
+            return self.cone(float(params['ra']), float(params['dec']),
+                             float(params['radius']))
+        if service == 'Mast.Caom.Filtered':
+            return applyFilters(self.obs, params.get('filters', []))
+        if service == 'Mast.Caom.Filtered.Position':
+            ra, dec, radius = [float(x) for x in params['position'].split(',')]
+            return applyFilters(self.cone(ra, dec, radius),
+                                params.get('filters', []))
+        if service == 'Mast.Caom.Products':
+            return self.products(str(params['obsid']).split(','))
+        if service == 'Mast.Catalogs.Filtered.Tic':
+            return applyFilters(self.stars(), params.get('filters', []))
+        if service == 'Mast.Tic.Crossmatch':
+            return self.crossmatch(p.DataFrame(request['data']['data']),
+                                   params.get('raColumn', 'ra'),
+                                   params.get('decColumn', 'dec'),
+                                   float(params['radius']))
+        raise ValueError("The stand-in does not implement %s" % service)
+
+
+def _fields(df):
+    return [{'name': name, 'type': _FIELD_TYPES.get(df[name].dtype.kind, 'string')}
+            for name in df.columns]
+
+
+def _selectPage(request, result):
+    """The columns and page of result that request asks for, and the paging."""
+    params = request.get('params', {})
+    columns = params.get('columns', '*')
+    if columns.upper().startswith('COUNT_BIG'):
+        result = p.DataFrame({'Column1': [len(result)]})
+    elif columns != '*':
+        result = result[[c.strip() for c in columns.split(',') if c.strip() in result]]
+    nrows = len(result)
+    pagesize = int(request.get('pagesize', nrows) or max(nrows, 1))
+    page = int(request.get('page', 1))
+    data = result.iloc[(page - 1) * pagesize:page * pagesize]
+    return data, {'page': page, 'pageSize': pagesize,
+                  'pagesFiltered': max(1, -(-nrows // pagesize)),
+                  'rows': len(data),
+                  'rowsFiltered': nrows,
+                  'rowsTotal': nrows}
+
+
+def formatResponse(request, result):
+    """
+    The (content type, body) of the answer to request: json, or csv or
+    votable (which, like MAST's, carry no paging) if request['format']
+    asks for them.
+    """
+    fmt = (request.get('format') or 'json').lower()
+    if isinstance(result, dict) or fmt not in ('csv', 'votable'):
+        return 'application/json', jsonResponse(request, result)
+    data, paging = _selectPage(request, result)
+    if fmt == 'csv':
+        return 'text/csv', data.to_csv(index=False)
+    out = io.BytesIO()
+    votable.from_table(Table.from_pandas(data.reset_index(drop=True))).to_xml(out)
+    return 'text/xml', out.getvalue()
+
+
+def jsonResponse(request, result):
+    """The invoke json for the rows in result, with columns and paging."""
+    if isinstance(result, dict):
+        return json.dumps(result)
+    data, paging = _selectPage(request, result)
+    fields = _fields(data)
+    data = data.astype(object).where(data.notna(), None)
+    return json.dumps({'status': 'COMPLETE', 'msg': '',
+                       'fields': fields,
+                       'data': data.to_dict('records'),
+                       'paging': paging})
+
+
+class StandInServer(object):
+    """
+    fixtures is a SyntheticFixtures (a default one is made on first use).
+    recordDir is a mastCache directory whose entries are played back,
+    whatever their age, before the synthetic sky is asked.
+    latency is the seconds added to every answer, with jitter (a fraction)
+    of it added at random. bandwidth (bytes per second per connection)
+    limits how fast bodies are sent. errorRate is the fraction of requests
+    answered 503 and executingRate the fraction of queries answered with
+    status EXECUTING (the next try for the same request succeeds).
+    """
+
+    def __init__(self, fixtures=None, recordDir=None, latency=0., jitter=0.5,
+                 bandwidth=None, errorRate=0., executingRate=0.,
+                 host='127.0.0.1', port=0, seed=None):
+        self.fixtures = fixtures
+        self.recorded = None
+        if recordDir is not None:
+            self.recorded = mastCache.QueryCache(
+                recordDir, ttl=dict((s, None) for s in mastCache.SERVICE_TTL),
+                defaultTtl=None)
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.errorRate = errorRate
+        self.executingRate = executingRate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self._executing = set()
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _handlerFor(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.httpd.server_address[:2]
+
+    def start(self):
+        """Serve on a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def pool(self, maxsize=16, stats=None):
+        """A new mastSession.ConnectionPool talking to this server."""
+        host, port = self.address
+        return mastSession.ConnectionPool(host, port=port, https=False,
+                                          maxsize=maxsize, stats=stats)
+
+    def install(self, maxsize=16, stats=None):
+        """
+        Point the shared MAST connection pool at this server, so mastQuery
+        and mast: downloads use it. Returns the previous pool.
+        """
+        return mastSession.setPool(self.pool(maxsize, stats))
+
+    def _getFixtures(self):
+        with self._lock:
+            if self.fixtures is None:
+                self.fixtures = SyntheticFixtures()
+            return self.fixtures
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency * (1. + self.jitter * self.random.random()))
+
+    def _fails(self, rate):
+        return rate and self.random.random() < rate
+
+    def invoke(self, request):
+        """The (status, content type, body) of one invoke request."""
+        if self._fails(self.errorRate):
+            return 503, 'text/plain', 'Service Unavailable'
+        key = mastCache.requestKey(request)
+        if self._fails(self.executingRate):
+            with self._lock:
+                first = key not in self._executing
+                self._executing.add(key)
+            if first:
+                return 200, 'application/json', json.dumps(
+                    {'status': 'EXECUTING', 'msg': '', 'data': [], 'fields': []})
+        if self.recorded is not None:
+            cached = self.recorded.get(request)
+            if cached is not None:
+                return 200, 'application/json', cached[1]
+        try:
+            result = self._getFixtures().answer(request)
+        except (ValueError, KeyError) as e:
+            return 200, 'application/json', json.dumps(
+                {'status': 'ERROR', 'msg': str(e), 'data': [], 'fields': []})
+        contentType, body = formatResponse(request, result)
+        return 200, contentType, body
+
+
+def _handlerFor(server):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        #Headers and body go out in separate writes, without this every
+        #answer waits for a delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, headers=()):
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            if 'gzip' in self.headers.get('Accept-encoding', '') and \
+                    status == 200 and self.command == 'POST':
+                body = gzip.compress(body, 1)
+                headers = list(headers) + [('Content-Encoding', 'gzip')]
+            self.send_response(status)
+            for key, value in headers:
+                self.send_header(key, value)
+            if status == 503:
+                self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            step = 64 * 1024
+            for start in range(0, len(body), step):
+                chunk = body[start:start + step]
+                self.wfile.write(chunk)
+                if server.bandwidth:
+                    time.sleep(len(chunk) / float(server.bandwidth))
+
+        def do_POST(self):
+            with server._lock:
+                server.requests += 1
+            length = int(self.headers.get('Content-Length', 0))
+            form = parse_qs(self.rfile.read(length).decode('utf-8'))
+            server._delay()
+            if self.path.split('?')[0] != '/api/v0/invoke' or 'request' not in form:
+                return self._send(404, 'Not Found')
+            request = json.loads(form['request'][0])
+            status, contentType, body = server.invoke(request)
+            self._send(status, body, [('Content-Type', contentType)])
+
+        def do_GET(self):
+            with server._lock:
+                server.requests += 1
+            prefix = '/api/v0/download/file/'
+            if not self.path.startswith(prefix):
+                return self._send(404, 'Not Found')
+            server._delay()
+            if server._fails(server.errorRate):
+                return self._send(503, 'Service Unavailable')
+            uri = unquote_plus(self.path[len(prefix):].split('?')[0])
+            if not server._getFixtures().hasFile(uri):
+                return self._send(404, 'Not Found')
+            body = server._getFixtures().fileBytes(uri)
+            size = len(body)
+            match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                if start >= size:
+                    return self._send(416, '', [('Content-Range', 'bytes */%i' % size)])
+                return self._send(206, body[start:],
+                                  [('Content-Range', 'bytes %i-%i/%i'
+                                    % (start, size - 1, size))])
+            self._send(200, body)
+
+    return Handler
+
+
+USAGE = """
+mastStandIn.py [--port 8765] [--latency S] [--bandwidth B/s] [--errors F]
+               [--executing F] [--record CACHEDIR]
+"""
+
+
+def main():
+    port = 8765
+    kwargs = {}
+    try:
+        options, args = getopt.getopt(sys.argv[1:], 'hp:l:b:e:x:r:',
+                                      ['help', 'port=', 'latency=', 'bandwidth=',
+                                       'errors=', 'executing=', 'record='])
+    except getopt.GetoptError as e:
+        sys.exit("%s\n%s" % (e, USAGE))
+    for opt, arg in options:
+        if opt in ('-h', '--help'):
+            print(USAGE)
+            sys.exit(0)
+        if opt in ('-p', '--port'):
+            port = int(arg)
+        if opt in ('-l', '--latency'):
+            kwargs['latency'] = float(arg)
+        if opt in ('-b', '--bandwidth'):
+            kwargs['bandwidth'] = float(arg)
+        if opt in ('-e', '--errors'):
+            kwargs['errorRate'] = float(arg)
+        if opt in ('-x', '--executing'):
+            kwargs['executingRate'] = float(arg)
+        if opt in ('-r', '--record'):
+            kwargs['recordDir'] = arg
+    server = StandInServer(port=port, **kwargs)
+    print("MAST stand-in on http://%s:%i" % server.address)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared local store of downloaded MAST files.
+
+Every file is downloaded once into the store, under a name made from the
+sha256 of its dataURI, and then hard linked (or symlinked, or copied when
+neither works) into whatever directory layout the caller wants. A file
+used by several targets is stored once, and a new layout is just new
+links. index.json maps each dataURI to its object so the "have we got
+it" check is a dictionary lookup. gc() trims the store to a size budget,
+least recently used first, skipping objects that are still linked from
+somewhere, since deleting those would free nothing (hard links) or leave
+dangling links (symlinks).
+
+Usage:
+    import mastStore
+    store = mastStore.ContentStore('~/.mastcache/store')
+    manifest = store.retrieve(uris, filenames, localDir='/data/kplr011904151/')
+    store.gc(maxBytes=50 * 1024**3)
+
+    #or for every retrieveMastData call
+    mastStore.setDefaultStore(store)
+
+    #from the shell
+    mastStore.py gc --store ~/.mastcache/store --budget 50G
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import getopt
+import hashlib
+import threading
+
+import pandas as p
+
+import mastDownload
+
+DEFAULT_STORE = '~/.mastcache/store'
+
+LINK_MODES = ('hard', 'symlink', 'copy')
+
+
+def uriKey(uri):
+    """The sha256 hex digest of a dataURI."""
+    return hashlib.sha256(uri.encode('utf-8')).hexdigest()
+
+
+def parseSize(size):
+    """Bytes from 1073741824, "500M", "50G" or "2T"."""
+    size = str(size).strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+class ContentStore(object):
+    """
+    root is the store directory. link is how files are put in place:
+    'hard' (the default, falls back to symlinks across file systems),
+    'symlink' or 'copy'. maxBytes, if given, is the budget gc() enforces
+    after every retrieve.
+    """
+
+    def __init__(self, root=DEFAULT_STORE, link='hard', maxBytes=None):
+        if link not in LINK_MODES:
+            raise ValueError("link must be one of %s" % ", ".join(LINK_MODES))
+        self.root = os.path.expanduser(root)
+        self.link = link
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        mastDownload.makeDir(os.path.join(self.root, 'objects'))
+        try:
+            with open(self._indexFile(), 'r') as FLE:
+                self.index = json.load(FLE)
+        except (IOError, OSError, ValueError):
+            self.index = {}
+
+    def _indexFile(self):
+        return os.path.join(self.root, 'index.json')
+
+    def objectPath(self, uri):
+        """Where the object for uri lives (or would live) in the store."""
+        key = uriKey(uri)
+        ext = os.path.splitext(uri.rsplit('/', 1)[-1])[1]
+        return os.path.join(self.root, 'objects', key[:2], key + ext)
+
+    def has(self, uri):
+        return uri in self.index
+
+    def save(self):
+        """Atomically rewrite index.json."""
+        with self._lock:
+            tmpName = self._indexFile() + '.tmp'
+            with open(tmpName, 'w') as FLE:
+                json.dump(self.index, FLE)
+            os.replace(tmpName, self._indexFile())
+
+    def size(self):
+        """Total bytes of the objects in the index."""
+        with self._lock:
+            return sum(entry['size'] for entry in self.index.values())
+
+    def fetch(self, uris, sizes=None, checksums=None, maxWorkers=4,
+              onDone=None, getNewOnly=True, pool=None, stats=None,
+              chunkSize=mastDownload.CHUNK_SIZE):
+        """
+        Download the uris that are not in the store yet (including ones
+        whose object file has gone missing), or all of them again if
+        getNewOnly is False. pool, stats and chunkSize are passed
+        on to downloadFiles.
+        Returns the downloadFiles manifest of the ones fetched.
+        """
+        n = len(uris)
+        sizes = [None] * n if sizes is None else list(sizes)
+        checksums = [None] * n if checksums is None else list(checksums)
+        todo = {}
+        with self._lock:
+            for uri, size, checksum in zip(uris, sizes, checksums):
+                if uri in todo:
+                    continue
+                entry = self.index.get(uri)
+                if entry is not None and not os.path.isfile(
+                        os.path.join(self.root, entry['path'])):
+                    #The object was deleted from under the store
+                    del self.index[uri]
+                    entry = None
+                if not getNewOnly or entry is None:
+                    todo[uri] = (size, checksum)
+        if not todo:
+            return p.DataFrame(columns=mastDownload.MANIFEST_COLUMNS)
+
+        #A refetched object is renamed over the old one, so files hard
+        #linked to it keep the old data until place() relinks them
+        todoUris = list(todo)
+        manifest = mastDownload.downloadFiles(
+            todoUris, [self.objectPath(uri) for uri in todoUris], localDir='',
+            getNewOnly=getNewOnly, maxWorkers=maxWorkers, chunkSize=chunkSize,
+            pool=pool, stats=stats,
+            sizes=[todo[uri][0] for uri in todoUris],
+            checksums=[todo[uri][1] for uri in todoUris], onDone=onDone)
+        now = time.time()
+        with self._lock:
+            for row in manifest.itertuples():
+                if row.status != 'ERROR':
+                    entry = self.index.setdefault(row.uri, {})
+                    entry.update({
+                        'path': os.path.relpath(row.localPath, self.root),
+                        'size': os.path.getsize(row.localPath),
+                        'lastUsed': now})
+        self.save()
+        return manifest
+
+    def place(self, uri, localPath):
+        """
+        Link the stored object for uri to localPath.
+        Returns the way it was put there: 'hard', 'symlink' or 'copy'.
+        """
+        with self._lock:
+            source = os.path.join(self.root, self.index[uri]['path'])
+        if os.path.lexists(localPath):
+            if os.path.exists(localPath) and os.path.samefile(source, localPath):
+                return 'symlink' if os.path.islink(localPath) else 'hard'
+            os.remove(localPath)
+        mastDownload.makeDir(os.path.dirname(localPath) or '.')
+        mode = self.link
+        if mode == 'hard':
+            try:
+                os.link(source, localPath)
+                return 'hard'
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                mode = 'symlink'
+        if mode == 'symlink':
+            try:
+                os.symlink(os.path.abspath(source), localPath)
+                return 'symlink'
+            except OSError:
+                pass
+        shutil.copyfile(source, localPath)
+        return 'copy'
+
+    def _inUse(self, entry):
+        """
+        Whether deleting the object of entry would not free its space or
+        would leave a dangling link: some hard link to it is left outside
+        the store, or a symlink place() made still points at it.
+        """
+        path = os.path.join(self.root, entry['path'])
+        try:
+            if os.stat(path).st_nlink > 1:
+                return True
+        except OSError:
+            return False
+        target = os.path.realpath(path)
+        links = [link for link in entry.get('symlinks', [])
+                 if os.path.islink(link) and os.path.realpath(link) == target]
+        entry['symlinks'] = links
+        return len(links) > 0
+
+    def retrieve(self, uris, localFilenames, localDir="/", sizes=None,
+                 checksums=None, maxWorkers=4, onDone=None, getNewOnly=True,
+                 pool=None, stats=None, chunkSize=mastDownload.CHUNK_SIZE):
+        """
+        The retrieveMastData of the store: make sure every uri is stored
+        (downloading them all again if getNewOnly is False), then link it
+        to localDir+localFilenames[i].
+        Returns a manifest like downloadFiles, with localPath the linked
+        file and status SKIPPED for files that were already in the store.
+        """
+        fetched = self.fetch(uris, sizes=sizes, checksums=checksums,
+                             maxWorkers=maxWorkers, onDone=onDone,
+                             getNewOnly=getNewOnly, pool=pool, stats=stats,
+                             chunkSize=chunkSize)
+        fetchedRows = dict((row['uri'], row) for row
+                           in fetched.to_dict('records'))
+        rows = []
+        now = time.time()
+        for uri, name in zip(uris, localFilenames):
+            localPath = localDir + name
+            row = dict(fetchedRows.get(uri) or
+                       {'uri': uri, 'status': 'SKIPPED', 'nbytes': 0,
+                        'resumedFrom': 0, 'seconds': 0., 'error': None})
+            row['localPath'] = localPath
+            with self._lock:
+                stored = uri in self.index
+            if stored:
+                try:
+                    mode = self.place(uri, localPath)
+                except OSError as e:
+                    row['status'] = 'ERROR'
+                    row['error'] = str(e)
+                    rows.append(row)
+                    continue
+                with self._lock:
+                    entry = self.index[uri]
+                    entry['lastUsed'] = now
+                    if mode == 'symlink':
+                        link = os.path.abspath(localPath)
+                        if link not in entry.setdefault('symlinks', []):
+                            entry['symlinks'].append(link)
+            rows.append(row)
+        self.save()
+        if self.maxBytes is not None:
+            self.gc()
+        return p.DataFrame(rows, columns=mastDownload.MANIFEST_COLUMNS)
+
+    def gc(self, maxBytes=None):
+        """
+        Forget objects whose files are gone, then delete least recently
+        used objects until the store is within maxBytes (default
+        self.maxBytes). Objects still hard linked or symlinked from outside
+        the store are kept: deleting them frees nothing or breaks the links.
+        Returns the number of bytes freed and the uris kept because they
+        are in use, which may leave the store over budget.
+        """
+        if maxBytes is None:
+            maxBytes = self.maxBytes
+        freed = 0
+        kept = []
+        with self._lock:
+            for uri in [uri for uri, entry in self.index.items()
+                        if not os.path.isfile(os.path.join(self.root,
+                                                           entry['path']))]:
+                del self.index[uri]
+            total = sum(entry['size'] for entry in self.index.values())
+            if maxBytes is not None and total > maxBytes:
+                for uri, entry in sorted(self.index.items(),
+                                         key=lambda kv: kv[1]['lastUsed']):
+                    if total <= maxBytes:
+                        break
+                    if self._inUse(entry):
+                        kept.append(uri)
+                        continue
+                    try:
+                        os.remove(os.path.join(self.root, entry['path']))
+                    except OSError:
+                        pass
+                    del self.index[uri]
+                    total -= entry['size']
+                    freed += entry['size']
+        self.save()
+        return freed, kept
+
+
+_defaultStore = None
+
+
+def setDefaultStore(store):
+    """Send every retrieveMastData call that isn't given a store through store."""
+    global _defaultStore
+    _defaultStore = store
+
+
+def getDefaultStore():
+    return _defaultStore
+
+
+USAGE = """
+mastStore.py gc --budget SIZE [--store DIR]
+  -s, --store    store directory (default %s)
+  -b, --budget   size to trim the store to, e.g. 500M, 50G
+mastStore.py du [--store DIR]
+""" % DEFAULT_STORE
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('gc', 'du'):
+        sys.exit(USAGE)
+    command = sys.argv[1]
+    root = DEFAULT_STORE
+    budget = None
+    try:
+        options, args = getopt.getopt(sys.argv[2:], 'hs:b:',
+                                      ['help', 'store=', 'budget='])
+    except getopt.GetoptError as e:
+        sys.exit("%s\n%s" % (e, USAGE))
+    for opt, arg in options:
+        if opt in ('-h', '--help'):
+            print(USAGE)
+            sys.exit(0)
+        if opt in ('-s', '--store'):
+            root = arg
+        if opt in ('-b', '--budget'):
+            budget = parseSize(arg)
+
+    store = ContentStore(root)
+    if command == 'gc':
+        if budget is None:
+            sys.exit("gc needs --budget\n%s" % USAGE)
+        freed, kept = store.gc(maxBytes=budget)
+        print("freed %.1f MB" % (freed / 1e6))
+        if kept:
+            print("%i files kept, still linked from outside the store"
+                  % len(kept))
+    print("%i files, %.1f MB" % (len(store.index), store.size() / 1e6))
+
+
+if __name__ == "__main__":
+    main()
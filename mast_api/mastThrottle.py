@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Client side rate limiting for MAST requests.
+
+A TokenBucket allows rate requests per second on average with bursts of up
+to burst requests. reserve() takes a token and says how long the caller has
+to wait for it, so the same bucket works for threads (time.sleep) and for
+asyncio (await asyncio.sleep). ServiceLimiter keeps one bucket per MAST
+service name.
+
+On top of that, RetryPolicy decides how long to back off after a failure,
+AdaptiveLimiter moves the number of requests in flight up and down with the
+latency and error rate MAST shows, and Throttle bundles the three for
+mastQuery.
+"""
+
+import time
+import random
+import threading
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket.
+    rate is the number of tokens added per second, burst the most that
+    can be saved up. rate=None means no limit.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return the number of seconds to wait before using it.
+        """
+        if self.rate is None:
+            return 0.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1.
+            if self._tokens >= 0:
+                return 0.
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Block until a token is available."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ServiceLimiter(object):
+    """
+    One TokenBucket per MAST service.
+    rates is a dictionary of service name to requests per second;
+    services not listed get defaultRate (None for unlimited).
+    """
+
+    def __init__(self, rates=None, defaultRate=None, burst=1):
+        self.rates = dict(rates or {})
+        self.defaultRate = defaultRate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, service):
+        with self._lock:
+            if service not in self._buckets:
+                self._buckets[service] = TokenBucket(
+                    self.rates.get(service, self.defaultRate), self.burst)
+            return self._buckets[service]
+
+    def reserve(self, service):
+        return self.bucket(service).reserve()
+
+    def acquire(self, service):
+        self.bucket(service).acquire()
+
+
+class RetryPolicy(object):
+    """
+    When and how long to wait before trying a MAST request again.
+    Waits grow exponentially from baseDelay up to maxDelay with full
+    jitter, so many clients that failed together don't retry together.
+    maxRetries is the number of retries after the first attempt.
+    retryStatus is the set of HTTP codes worth retrying.
+    A query MAST reports as EXECUTING is re-sent every pollInterval
+    seconds for up to maxPollTime seconds; polls are not retries.
+    """
+
+    def __init__(self, maxRetries=5, baseDelay=0.5, maxDelay=30.,
+                 retryStatus=(429, 500, 502, 503, 504), pollInterval=2.,
+                 maxPollTime=600.):
+        self.maxRetries = maxRetries
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.retryStatus = tuple(retryStatus)
+        self.pollInterval = pollInterval
+        self.maxPollTime = maxPollTime
+
+    def delay(self, attempt, retryAfter=None):
+        """
+        Seconds to wait before retry number attempt (0 based). A server
+        Retry-After value, if given, is used as the lower bound.
+        """
+        cap = min(self.maxDelay, self.baseDelay * 2 ** attempt)
+        wait = random.uniform(0, cap)
+        if retryAfter is not None:
+            try:
+                wait = max(wait, float(retryAfter))
+            except ValueError:
+                pass
+        return wait
+
+
+class AdaptiveLimiter(object):
+    """
+    Concurrency limit that adapts to how MAST is coping (AIMD).
+
+    acquire() blocks while limit requests are already in flight and
+    release() reports how the request went. Each label keeps a fast moving
+    average of its latency and a slow one (baselineWeight per request) as
+    the baseline. Every success whose fast average is within tolerance
+    times the baseline raises the limit by about one per limit successes.
+    A throttled or failed request, or latency jumping above that band,
+    cuts the limit in half (at most once per cooldown seconds), never below
+    minLimit or above maxLimit. Because the baseline follows the recent
+    latency, queries that slowly get bigger (cone searches of growing
+    radius) don't keep the limit pinned down, only sudden slowdowns do.
+    """
+
+    def __init__(self, initial=8, minLimit=1, maxLimit=64, tolerance=2.,
+                 cooldown=1., baselineWeight=0.02):
+        self.limit = float(initial)
+        self.minLimit = minLimit
+        self.maxLimit = maxLimit
+        self.tolerance = tolerance
+        self.cooldown = cooldown
+        self.baselineWeight = baselineWeight
+        self.inFlight = 0
+        self.successes = 0
+        self.failures = 0
+        self._lastCut = 0.
+        self._latency = {}
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.inFlight >= int(self.limit):
+                self._cond.wait()
+            self.inFlight += 1
+
+    def release(self, latency, ok=True, label=None):
+        """
+        Report one finished request. Latency is judged against earlier
+        requests with the same label (e.g. service name), since a name
+        lookup and a big cone search take very different times.
+        """
+        with self._cond:
+            self.inFlight -= 1
+            if ok:
+                self.successes += 1
+                ewma, baseline = self._latency.get(label, (latency, latency))
+                ewma = 0.8 * ewma + 0.2 * latency
+                baseline += self.baselineWeight * (latency - baseline)
+                self._latency[label] = (ewma, baseline)
+                if ewma <= self.tolerance * baseline:
+                    self.limit = min(self.maxLimit, self.limit + 1. / self.limit)
+                else:
+                    self._cut()
+            else:
+                self.failures += 1
+                self._cut()
+            self._cond.notify_all()
+
+    def _cut(self):
+        now = time.monotonic()
+        if now - self._lastCut >= self.cooldown:
+            self.limit = max(self.minLimit, self.limit / 2.)
+            self._lastCut = now
+
+
+class Throttle(object):
+    """
+    Everything mastQuery needs to be a good citizen when run in parallel:
+    a ServiceLimiter for fixed per-service rates (rates, defaultRate),
+    an AdaptiveLimiter for the number of requests in flight and a
+    RetryPolicy. Pass one to mastQuery(throttle=...) or make it the
+    default with setDefaultThrottle.
+    """
+
+    def __init__(self, rates=None, defaultRate=None, limiter=None, retry=None):
+        self.rates = ServiceLimiter(rates, defaultRate)
+        self.limiter = limiter if limiter is not None else AdaptiveLimiter()
+        self.retry = retry if retry is not None else RetryPolicy()
+
+    def before(self, service):
+        """Wait for a rate token and a concurrency slot."""
+        self.rates.acquire(service)
+        self.limiter.acquire()
+
+    def after(self, service, latency, ok=True):
+        """Give the slot back and report how the request went."""
+        self.limiter.release(latency, ok, label=service)
+
+
+_defaultThrottle = Throttle()
+
+
+def setDefaultThrottle(throttle):
+    """Use throttle for every mastQuery that isn't given one."""
+    global _defaultThrottle
+    _defaultThrottle = throttle
+
+
+def getDefaultThrottle():
+    return _defaultThrottle
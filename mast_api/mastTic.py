@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk lookups in the TESS Input Catalog.
+
+lookupTic takes an array of TIC IDs, drops repeats, and asks
+Mast.Catalogs.Filtered.Tic for a few thousand IDs per request (one
+'values' list each), several requests at a time. crossmatchTic does the
+same for positions through Mast.Tic.Crossmatch. Either way the answer is
+one dataframe, typed from the response fields, holding only the columns
+asked for, one row per input in input order.
+
+Usage:
+    import mastTic
+    stars = mastTic.lookupTic(ticids, columns=['Tmag', 'ra', 'dec', 'Teff'])
+    nearest = mastTic.crossmatchTic(coords.ra, coords.dec, radius_arcsec=2,
+                                    columns=['Tmag'])
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as p
+
+import mastAPITools as api
+import mastFrameStore
+
+#IDs in one Mast.Catalogs.Filtered.Tic values list
+TIC_BATCH = 3000
+
+#Positions in one Mast.Tic.Crossmatch request
+COORD_BATCH = 1000
+
+DEFAULT_COLUMNS = ['ra', 'dec', 'Tmag']
+
+
+def _batches(values, size):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def _columnString(columns):
+    if isinstance(columns, str):
+        columns = [c.strip() for c in columns.split(',')]
+    return ",".join(['ID'] + [c for c in columns if c != 'ID'])
+
+
+def ticRequest(ids, columns=DEFAULT_COLUMNS):
+    """The Mast.Catalogs.Filtered.Tic request for a list of TIC IDs."""
+    return {"service": "Mast.Catalogs.Filtered.Tic",
+            "format": "json",
+            "params": {"columns": _columnString(columns),
+                       "filters": [{"paramName": "ID",
+                                    "values": [str(ticid) for ticid in ids]}]},
+            "pagesize": len(ids),
+            "page": 1}
+
+
+def _fetchAll(request):
+    return mastFrameStore.concatFrames(
+        api.iterMastPages(request, prefetch=False, decode='dataframe'))
+
+
+def lookupTic(ids, columns=DEFAULT_COLUMNS, batchSize=TIC_BATCH, maxWorkers=4):
+    """
+    TIC entries of many IDs: batchSize IDs per request, maxWorkers
+    requests at a time. columns are the TIC columns wanted (ID is always
+    included).
+    Returns a dataframe with one row per entry of ids, in the same order,
+    with NaN columns for IDs the catalog doesn't have.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    unique = p.unique(ids)
+    requests = [ticRequest(batch, columns) for batch in _batches(unique, batchSize)]
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        found = mastFrameStore.concatFrames(list(executor.map(_fetchAll, requests)))
+
+    wanted = _columnString(columns).split(',')
+    if len(found) == 0:
+        found = p.DataFrame(columns=wanted)
+    found = found.reindex(columns=wanted)
+    found['ID'] = p.to_numeric(found['ID']).astype(np.int64)
+    found = found.drop_duplicates('ID').set_index('ID')
+    return found.reindex(ids).reset_index()
+
+
+def crossmatchRequest(ra, dec, radius_arcsec, targets=None):
+    """
+    The Mast.Tic.Crossmatch request for a list of positions (degrees).
+    Each position carries its number in targets (default 0, 1, ...) in a
+    'target' column, which comes back with its matches.
+    """
+    if targets is None:
+        targets = range(len(ra))
+    rows = [{'target': int(t), 'ra': float(r), 'dec': float(d)}
+            for t, r, d in zip(targets, ra, dec)]
+    return {"service": "Mast.Tic.Crossmatch",
+            "data": {"fields": [{"name": "target", "type": "int"},
+                                {"name": "ra", "type": "float"},
+                                {"name": "dec", "type": "float"}],
+                     "data": rows},
+            "params": {"raColumn": "ra",
+                       "decColumn": "dec",
+                       "radius": radius_arcsec / 3600.},
+            "format": "json",
+            "pagesize": 50000,
+            "page": 1}
+
+
+def crossmatchTic(ra, dec, radius_arcsec=2., columns=DEFAULT_COLUMNS,
+                  batchSize=COORD_BATCH, maxWorkers=4, nearest=True):
+    """
+    The TIC stars within radius_arcsec of many positions (degrees):
+    batchSize positions per Mast.Tic.Crossmatch request, maxWorkers at a
+    time, then one lookupTic of the matched IDs for columns.
+    With nearest (the default) returns one row per position, in input
+    order, with the closest star's ID, dstArcSec and columns (NaN where
+    nothing matched). Otherwise one row per (position, star) pair with
+    target the index of the position.
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    good = np.nonzero(np.isfinite(ra) & np.isfinite(dec))[0]
+    requests = [crossmatchRequest(ra[batch], dec[batch], radius_arcsec,
+                                  targets=batch)
+                for batch in _batches(good, batchSize)]
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        matches = mastFrameStore.concatFrames(list(executor.map(_fetchAll, requests)))
+
+    if len(matches) == 0:
+        matches = p.DataFrame({'target': np.array([], dtype=np.int64),
+                               'ID': np.array([], dtype=np.int64),
+                               'dstArcSec': np.array([])})
+    else:
+        matches = p.DataFrame({
+            'target': p.to_numeric(matches['target']).astype(np.int64),
+            'ID': p.to_numeric(matches['MatchID']).astype(np.int64),
+            'dstArcSec': p.to_numeric(matches['dstArcSec'])})
+    if nearest:
+        matches = matches.sort_values('dstArcSec', kind='mergesort') \
+            .drop_duplicates('target').set_index('target') \
+            .reindex(np.arange(len(ra)))
+        matches.index.name = 'target'
+        matches = matches.reset_index()
+    else:
+        matches = matches.sort_values(['target', 'dstArcSec']) \
+            .reset_index(drop=True)
+
+    ids = matches['ID'].dropna().astype(np.int64)
+    info = lookupTic(p.unique(ids), columns=columns, batchSize=TIC_BATCH,
+                     maxWorkers=maxWorkers)
+    return matches.merge(info, on='ID', how='left')
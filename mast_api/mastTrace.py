@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tracing of mastQuery calls: where does the time of a query go?
+
+A tracer is told when each mastQuery starts and finishes. In between the
+query fills in a Span with the time spent in each phase:
+    connect   TCP connect (new connections only)
+    tls       TLS handshake (new https connections only)
+    ttfb      sending the request until the response headers arrive,
+              i.e. the time MAST spends on the query
+    transfer  reading the response body
+    decode    gunzip and parsing (json.loads is the caller's, decode=...
+              parsing is counted here)
+    wait      rate limiting, retry backoff and EXECUTING polls
+plus the bytes sent and received, the service, HTTP status, row count,
+number of attempts and whether the cache answered.
+
+TraceCollector keeps the spans, summarizes them per service (including
+which of network, server or parse dominates) and can write every span as
+a line of json as it finishes.
+
+Usage:
+    import mastTrace
+    trace = mastTrace.TraceCollector(ndjson='survey-trace.ndjson')
+    mastTrace.setDefaultTracer(trace)
+    ... run queries through mastAPITools ...
+    print(trace.summary().to_string())
+
+    #or for one call
+    head, content = api.mastQuery(request, tracer=trace)
+
+To do something else with the spans subclass Tracer and override
+onStart and onFinish.
+"""
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import pandas as p
+
+PHASES = ('connect', 'tls', 'ttfb', 'transfer', 'decode', 'wait')
+
+#Which phases count towards each answer to "what is this query bound by"
+BOUND_BY = {'network': ('connect', 'tls', 'transfer'),
+            'server': ('ttfb', 'wait'),
+            'parse': ('decode',)}
+
+
+class Span(object):
+    """The timing and size of one mastQuery call."""
+
+    def __init__(self, service):
+        self.service = service
+        self.start = time.time()
+        self.seconds = None
+        self.phases = dict((phase, 0.) for phase in PHASES)
+        self.bytesOut = 0
+        self.bytesIn = 0
+        self.rows = None
+        self.status = None
+        self.attempts = 0
+        self.reused = None
+        self.cached = False
+        self.error = None
+        self._t0 = time.perf_counter()
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    @contextmanager
+    def phase(self, name):
+        """with span.phase('decode'): ... adds the time of the block to name."""
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.phases[name] += time.perf_counter() - t0
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._t0
+
+    def toDict(self):
+        out = {'service': self.service, 'start': self.start,
+               'seconds': self.seconds}
+        out.update(self.phases)
+        out.update({'bytesOut': self.bytesOut, 'bytesIn': self.bytesIn,
+                    'rows': self.rows, 'status': self.status,
+                    'attempts': self.attempts, 'reused': self.reused,
+                    'cached': self.cached, 'error': self.error})
+        return out
+
+
+class Tracer(object):
+    """
+    Base class of the mastQuery hooks. onStart(span) is called before the
+    query is sent, onFinish(span) once it has returned or raised
+    (span.error is then set). Both may be called from many threads.
+    """
+
+    def start(self, service):
+        span = Span(service)
+        self.onStart(span)
+        return span
+
+    def finish(self, span):
+        span.finish()
+        self.onFinish(span)
+
+    def onStart(self, span):
+        pass
+
+    def onFinish(self, span):
+        pass
+
+
+class TraceCollector(Tracer):
+    """
+    Keeps every finished span. ndjson, a file name or an open file, gets
+    one json line per span as it finishes, so a long survey can be
+    followed (or analysed afterwards) with pandas.read_json(lines=True).
+    """
+
+    def __init__(self, ndjson=None):
+        self._lock = threading.Lock()
+        self.spans = []
+        self._ownFile = isinstance(ndjson, str)
+        self._out = open(ndjson, 'a') if self._ownFile else ndjson
+
+    def onFinish(self, span):
+        record = span.toDict()
+        with self._lock:
+            self.spans.append(record)
+            if self._out is not None:
+                self._out.write(json.dumps(record) + '\n')
+                self._out.flush()
+
+    def close(self):
+        """Close the ndjson file, if this collector opened it."""
+        with self._lock:
+            if self._ownFile and self._out is not None:
+                self._out.close()
+            self._out = None
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+
+    def toDataFrame(self):
+        with self._lock:
+            return p.DataFrame(self.spans, columns=list(Span('').toDict()))
+
+    def summary(self):
+        """
+        One row per service: calls, errors, cache hits, mean seconds, mean
+        seconds in each phase, total bytes and rows, and boundBy, the
+        group of phases (network, server or parse) that took the most time.
+        """
+        df = self.toDataFrame()
+        if len(df) == 0:
+            return df
+        df['failed'] = df['error'].notna()
+        grouped = df.groupby('service')
+        out = p.DataFrame({'calls': grouped['seconds'].count(),
+                           'errors': grouped['failed'].sum(),
+                           'cached': grouped['cached'].sum(),
+                           'mean_s': grouped['seconds'].mean()})
+        for phase in PHASES:
+            out[phase + '_s'] = grouped[phase].mean()
+        out['bytesOut'] = grouped['bytesOut'].sum()
+        out['bytesIn'] = grouped['bytesIn'].sum()
+        out['rows'] = grouped['rows'].sum()
+        bound = p.DataFrame(dict((name, out[[phase + '_s' for phase in phases]].sum(axis=1))
+                                 for name, phases in BOUND_BY.items()))
+        out['boundBy'] = bound.idxmax(axis=1)
+        return out
+
+
+_defaultTracer = None
+
+
+def setDefaultTracer(tracer):
+    """Trace every mastQuery call that isn't given a tracer with tracer."""
+    global _defaultTracer
+    _defaultTracer = tracer
+
+
+def getDefaultTracer():
+    return _defaultTracer
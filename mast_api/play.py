@@ -12,6 +12,7 @@ import time
 import re
 import json
 import mastAPITools as api
+import mastProducts
 
 try: # Python 3.x
     from urllib.parse import quote as urlencode
@@ -99,7 +100,7 @@ lcwant=(dfData['t_exptime'] == 1800)
 scwant=(dfData['t_exptime'] == 60)
 
 getdata=dfData[wantdata & lcwant]
-obsid = np.int(dfData[wantdata & lcwant]['obsid'])
+obsid = int(dfData[wantdata & lcwant]['obsid'].iloc[0])
 
 #Request The Products for this observation
 
@@ -118,13 +119,15 @@ print("Product information column names:")
 pp.pprint(obsProducts['fields'])
 
 dfProd = p.DataFrame.from_dict(obsProducts["data"])
-wantprod=(dfProd['description'].str.contains('CLC')) & (dfProd['description'].str.contains('Q'))
-wantdv=(dfProd['description'].str.contains('Data Validation'))
-want=wantprod | wantdv
+#Quarterly light curves and the DV products, in one pass over the list
+#(mastProducts.fetchProducts gets the products of many obsids at once)
+selectors=[mastProducts.Selector(description='CLC.*Q|Q.*CLC'),
+           mastProducts.Selector(description='Data Validation')]
+want=mastProducts.selectProducts(dfProd,selectors)
 
 #Get the URLS
-uris=np.array(dfProd[want]['dataURI'])
-filenames=np.array(dfProd[want]['productFilename'])
+uris=np.array(want['dataURI'])
+filenames=np.array(want['productFilename'])
 
 #%%
 #Direct Download of Data, now done through mastAPITools.py
@@ -262,3 +265,8 @@ outData=json.loads(outString)
 mydata=p.DataFrame.from_dict(outData['data'])
 print(mydata.ID)
 print(mydata.Tmag)
+
+#Many TIC IDs at once: a few thousand IDs per request instead of one each
+import mastTic
+ticData=mastTic.lookupTic([1234567,25155310,261105201],columns=['Tmag','ra','dec'])
+print(ticData)
@@ -16,6 +16,12 @@ import re
 
 import json
 import mastAPITools as api
+import mastCache
+import mastResolver
+import mastFrameStore
+import mastHarvest
+import missionSurvey
+import targetLists
 
 from astropy.table import Table
 import numpy as np
@@ -37,6 +43,7 @@ def getEpicListByStart(startTime_iso,proj="K2"):
     Filtered Query of Mast for a specific project
     with observations within .25 days of a known start time
     Intended for finding observations of one K2 campaign.
+    To keep a whole collection current use mastHarvest.harvest instead.
     Returns a list of epic ids
     """
 
@@ -49,9 +56,7 @@ def getEpicListByStart(startTime_iso,proj="K2"):
                               "values":[proj],
                               "separator":";"
                              },
-                             {"paramName":"t_min",
-                              "values":[{"min":tmjd-.5 , "max":tmjd+.5}]
-                              },
+                             mastHarvest.rangeFilter("t_min",tmjd-.5,tmjd+.5),
                          ]
     
     mashupRequest = {"service":"Mast.Caom.Filtered",
@@ -70,31 +75,45 @@ def getEpicListByStart(startTime_iso,proj="K2"):
     
     return epicids
 
-def getObservationDataframe(epicids,radius_arcsec=8):
+def getObservationDataframe(epicids,radius_arcsec=8,spillDir=None):
     """
     Fill up a pandas dataframe with the list of interesting fields.
+    The per target results are concatenated once at the end.
+    For a whole campaign give spillDir: the rows are written there in
+    parquet parts as they arrive and a lazily loaded
+    mastFrameStore.FrameDataset is returned instead of a dataframe.
+    Parts left in spillDir by an earlier run are replaced.
     """
-    dataAvail=p.DataFrame()
+    acc=mastFrameStore.FrameAccumulator(spillDir=spillDir)
     for k2id in epicids:
         #Cone Search each epicid
-        targetName="EPIC %u" % np.int(k2id)
+        targetName="EPIC %u" % int(k2id)
         mastData=api.targetNameConeSearch(targetName, radius_arcsec)
-        data=p.DataFrame.from_dict(mastData['data'])
-        newdata=p.concat([dataAvail,data],axis=0)
-        dataAvail=newdata
-        
+        acc.append(p.DataFrame.from_dict(mastData['data']))
+    
+    dataAvail=acc.finish()
+    if spillDir is None:
+        return dataAvail.load()
     return dataAvail
 
-def getUniqueObservations(targetName,radius_arcsec=8,columns=["obs_collection","project"]):
+def getUniqueObservations(targetName,radius_arcsec=8,columns=["obs_collection","project"],
+                          ra=None,dec=None):
     """
     Get a list of unique information for one epicid.
     Ask for what observations exist. combine the requested columns of information
     then do a unique on that list.
     columns needs to have two elements, but they can be the same.
+    If ra and dec are given (e.g. from mastResolver.resolveNames) the name
+    lookup is skipped.
     """
 
     #Cone Search each epicid
-    mastData=api.targetNameConeSearch(targetName, radius_arcsec)
+    if ra is None or dec is None:
+        mastData=api.targetNameConeSearch(targetName, radius_arcsec)
+    elif np.isfinite(ra) and np.isfinite(dec):
+        mastData=api.coneSearch(ra, dec, radius_arcsec)
+    else:
+        mastData={'data':[]}
     data=p.DataFrame.from_dict(mastData['data'])
     if len(data)>0:
         datatypelist=list(map( lambda x,y: "%s-%s" % (x,y), data[columns[0]],data[columns[1]] ) )
@@ -120,32 +139,28 @@ def plotUniqueCounts(names,counts):
 def getK2NamesList(filename):
     """
     Read in NExScI csv file to get EPIC IDs.
+    Returns an int64 array, cached next to the file (see targetLists).
     """
-    data=np.loadtxt(filename,dtype=str,comments='#',delimiter=',',usecols=[1],skiprows=16)
-    
-    epicids=list(map ( lambda x: np.int(re.split(' ',x[2:-1])[1]), data ))
+    epicids=targetLists.loadIds(filename,column=1,skiprows=16)
     
     return epicids
     
 def getKeplerPlanets(filename):
     """
     filename is a nexsci csv list.
-    returns list of kepids.
+    returns int64 array of kepids.
     """
-    data=np.loadtxt(filename,dtype=str,comments='#',delimiter=',',usecols=[1],skiprows=1)
-    
-    epicids=list(map ( lambda x: np.int(x[2:-1]), data[1:] ))
+    epicids=targetLists.loadIds(filename,column=1,skiprows=1)
     
     return epicids
 
 def getHeartbeat(filename):
     """
     Use CSV file from villanova for heartbeatstar list
+    returns int64 array of kepids.
     """
     
-    data=np.loadtxt(filename,dtype=int,comments='#',delimiter=',',usecols=[0])
-    
-    kepids=list(data)
+    kepids=targetLists.loadIds(filename,column=0)
     
     return kepids
 
@@ -162,33 +177,47 @@ def main():
     #epicids=getK2NamesList('/Users/smullally/K2/missioncount/k2names.csv')
     #epicids=getKeplerPlanets('/Users/smullally/Kepler/missioncount/kepler_confirmed.csv')
     epicids=getHeartbeat('/Users/smullally/Kepler/missioncount/heartbeatstars.csv')
+    #Reruns answer the resolver and cone searches from the local cache
+    mastCache.setDefaultCache(mastCache.QueryCache())
     #print(len(epicids))
     #print(epicids[0:5])
     #print(epicids[-4:])
     
-    i=0
     coneradius_arcsec=8  #arcseconds
-    obspertarget=[]
     missing=[]
-    for kid in tqdm(epicids):
-        i=i+1
-        #targetName="EPIC %u" % np.int(kid)
-        targetName="KIC %u" % np.int(kid)
-        uniqueObs=getUniqueObservations(targetName,radius_arcsec=coneradius_arcsec,columns=["obs_collection","project"])
-        obspertarget.extend(uniqueObs)
-        #print(k2id, uniqueObs)
+    #targetNames=["EPIC %u" % int(kid) for kid in epicids]
+    targetNames=["KIC %u" % int(kid) for kid in epicids]
+    #Resolve every name up front, concurrently and remembered between runs
+    coords=mastResolver.resolveNames(targetNames)
+    coordsByName=dict(zip(coords.name,zip(coords.ra,coords.dec)))
+    #A lookup that failed (not an unknown name) is retried by the cone
+    #search, which raises if it fails again so the checkpoint records an error
+    for name in coords.name[coords.failed]:
+        coordsByName[name]=(None,None)
+    
+    def surveyTarget(targetName):
+        ra,dec=coordsByName[targetName]
+        return getUniqueObservations(targetName,radius_arcsec=coneradius_arcsec,columns=["obs_collection","project"],
+                                     ra=ra,dec=dec)
+    
+    def checkMissing(targetName,uniqueObs):
         if ('HST-HST' or 'HLA-HLA') in uniqueObs:
-            missing.extend([kid])
+            missing.append(targetName)
             print(uniqueObs)
+    
+    #Targets run on a worker pool; an interrupted run resumes from the checkpoint
+    counter=missionSurvey.runSurvey(targetNames,surveyTarget,
+                                    checkpoint='heartbeat_survey.jsonl',
+                                    maxWorkers=8,onResult=checkMissing)
 
     print(missing)
-    names,counts=np.unique(obspertarget,return_counts=True)
+    names,counts=counter.namesCounts()
     
     plt.figure(figsize=(14,7))
     plotUniqueCounts(names,counts)
     plt.title('Heartbeat stars with data from another mission, within 8 arcsec')
 
-    return obspertarget,names,counts
+    return counter,names,counts
     #datatypes=[]
 
     #    #Cone Search that epicid
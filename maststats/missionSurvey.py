@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run a per-target MAST survey across a pool of workers.
+
+Each target is handed to a function (e.g. k2MultiMission.getUniqueObservations)
+on a thread pool. Every answer is appended to a json-lines checkpoint file
+as soon as it arrives, so an interrupted survey picks up where it stopped,
+and the unique observation types of each target are added to a running
+counter instead of being kept in one long list.
+
+Usage:
+    import missionSurvey
+    counter = missionSurvey.runSurvey(targetNames, surveyTarget,
+                                      checkpoint='heartbeat.jsonl')
+    names, counts = counter.namesCounts()
+"""
+
+import os
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from tqdm import tqdm
+
+
+class SurveyCheckpoint(object):
+    """
+    Append-only json-lines record of finished targets,
+    one {"target": ..., "result": [...], "error": ...} per line.
+    Targets that failed are written with their error and tried again on
+    the next run.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Return {key: result} for the targets finished in earlier runs,
+        where key is the target as a json string.
+        """
+        done = {}
+        try:
+            with open(self.filename, 'r') as FLE:
+                for line in FLE:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        #A line cut short when the last run was killed
+                        continue
+                    key = json.dumps(record['target'])
+                    if record.get('error') is None:
+                        done[key] = record['result']
+                    else:
+                        done.pop(key, None)
+        except (IOError, OSError):
+            pass
+        return done
+
+    def append(self, target, result, error=None):
+        line = json.dumps({'target': target, 'result': result,
+                           'error': error})
+        with self._lock:
+            with open(self.filename, 'a') as FLE:
+                FLE.write(line + '\n')
+                FLE.flush()
+
+
+class SurveyCounter(object):
+    """
+    Running histogram of how many targets have each observation type.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.ntargets = 0
+        self.nfailed = 0
+
+    def update(self, uniqueObs):
+        """Add the unique observation types of one target."""
+        self.counts.update(set(uniqueObs))
+        self.ntargets += 1
+
+    def namesCounts(self):
+        """The names, counts arrays np.unique(..., return_counts=True) would give."""
+        names = sorted(self.counts)
+        return names, [self.counts[name] for name in names]
+
+
+def runSurvey(targets, surveyFunc, checkpoint=None, maxWorkers=8,
+              counter=None, onResult=None, progress=True):
+    """
+    Call surveyFunc(target) for every target, maxWorkers at a time, and
+    count the observation types it returns.
+
+    targets must be json-able (names, ids or tuples of them); surveyFunc
+    returns the unique observation types of one target.
+    checkpoint is a SurveyCheckpoint or a file name. Targets already in it
+    are not asked about again, their saved results are counted instead.
+    onResult(target, result) is called for every finished target, e.g. to
+    collect the interesting ones.
+    Only about 4*maxWorkers targets are in flight at once, so the target
+    list can be long.
+
+    Returns the SurveyCounter.
+    """
+    if counter is None:
+        counter = SurveyCounter()
+    if checkpoint is not None and not isinstance(checkpoint, SurveyCheckpoint):
+        checkpoint = SurveyCheckpoint(checkpoint)
+
+    targets = list(targets)
+    done = checkpoint.load() if checkpoint is not None else {}
+    todo = []
+    for target in targets:
+        key = json.dumps(target)
+        if key in done:
+            counter.update(done[key])
+            if onResult is not None:
+                onResult(target, done[key])
+        else:
+            todo.append(target)
+
+    bar = tqdm(total=len(targets), initial=len(targets) - len(todo),
+               disable=not progress)
+    window = 4 * maxWorkers
+    pending = {}
+    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        queue = iter(todo)
+        for target in queue:
+            pending[executor.submit(surveyFunc, target)] = target
+            if len(pending) >= window:
+                break
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                target = pending.pop(future)
+                _record(target, future, counter, checkpoint, onResult)
+                bar.update(1)
+            for target in queue:
+                pending[executor.submit(surveyFunc, target)] = target
+                if len(pending) >= window:
+                    break
+    bar.close()
+
+    if counter.nfailed:
+        print("%i targets failed, rerun to try them again" % counter.nfailed)
+    return counter
+
+
+def _record(target, future, counter, checkpoint, onResult):
+    try:
+        result = [str(obs) for obs in future.result()]
+    except Exception as e:
+        counter.nfailed += 1
+        if checkpoint is not None:
+            checkpoint.append(target, None, error=str(e))
+        return
+    counter.update(result)
+    if checkpoint is not None:
+        checkpoint.append(target, result)
+    if onResult is not None:
+        onResult(target, result)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read lists of target ids (EPIC, KIC, TIC) out of csv files.
+
+The column is read with pandas and the ids pulled out with one vectorized
+regular expression, so a NExScI export of any size loads in a moment.
+The parsed ids are kept next to the csv file in a small .npz and reused
+until the csv file changes.
+
+Usage:
+    import targetLists
+    epicids = targetLists.loadIds('k2names.csv', column=1, skiprows=16)
+"""
+
+import os
+import hashlib
+
+import numpy as np
+import pandas as p
+
+#The first run of digits, e.g. 201367065 out of "EPIC 201367065"
+ID_PATTERN = r'(\d+)'
+
+
+def _cacheName(filename, column, pattern, skiprows):
+    key = hashlib.sha1(repr((column, pattern, skiprows)).encode('utf-8'))
+    return "%s.ids-%s.npz" % (filename, key.hexdigest()[:10])
+
+
+def parseIds(filename, column=0, pattern=ID_PATTERN, skiprows=0,
+             comment='#', delimiter=','):
+    """
+    Return the ids in one column (number, or name if the file has a header
+    row) of a csv file as an int64 array. Rows where pattern doesn't match,
+    such as a header, are dropped.
+    """
+    header = None if isinstance(column, int) else 'infer'
+    values = p.read_csv(filename, usecols=[column], skiprows=skiprows,
+                        comment=comment, sep=delimiter, header=header,
+                        dtype=str, skipinitialspace=True).iloc[:, 0]
+    ids = values.str.extract(pattern, expand=False).dropna()
+    return ids.astype(np.int64).to_numpy()
+
+
+def loadIds(filename, column=0, pattern=ID_PATTERN, skiprows=0,
+            comment='#', delimiter=',', cache=True):
+    """
+    parseIds, remembered in filename.ids-<key>.npz. The cache is used while
+    the mtime and size of filename are unchanged; cache=False skips it.
+    """
+    st = os.stat(filename)
+    stamp = np.array([st.st_mtime_ns, st.st_size], dtype=np.int64)
+    cacheName = _cacheName(filename, column, pattern, skiprows)
+    if cache:
+        try:
+            with np.load(cacheName) as npz:
+                if np.array_equal(npz['stamp'], stamp):
+                    return npz['ids']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    ids = parseIds(filename, column=column, pattern=pattern,
+                   skiprows=skiprows, comment=comment, delimiter=delimiter)
+    if cache:
+        try:
+            tmpName = cacheName + '.tmp.npz'
+            np.savez(tmpName, ids=ids, stamp=stamp)
+            os.replace(tmpName, cacheName)
+        except (IOError, OSError):
+            #Read-only directory, just don't cache
+            pass
+    return ids
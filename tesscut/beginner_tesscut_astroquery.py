@@ -205,31 +205,24 @@ plt.scatter(nearbyloc[1:, 0], nearbyloc[1:, 1],
 <a id="lightcurve"></a>
 ## Create a Light Curve from the Cutout
 
-We create two functions.  One to appply a phtometric aperture to one image and the other to then apply that to all the images in the FLUX array.
+We use the tessPhot module next to this notebook. It treats the whole FLUX array as one matrix and sums the pixels of the aperture for every image at once, rather than one image at a time, and it also propagates the FLUX_ERR column into an error on each point. The aperture can be a boolean array, an array of pixel weights, or a stack of apertures to get several light curves at once.
 """
 #%% code
-def aperture_phot(image, aperture):
-    """
-    Sum-up the pixels that are in the aperture for one image.
-    image and aperture are 2D arrays that need to be the same size.
-    
-    aperture is a boolean array where True means to include the light of those pixels.
-    """
-    flux = np.sum(image[aperture])
+import tessPhot
 
-    return flux
-
-def make_lc(flux_data, aperture):
+def make_lc(flux_data, aperture, flux_err=None):
     """
-    Apply the 2d aperture array to the and time series of 2D images. 
+    Apply the 2d aperture array to the time series of 2D images.
     Return the photometric series by summing over the pixels that are in the aperture.
     
-    Aperture is a boolean array where True means it is in the desired aperture.
+    Aperture is a boolean array where True means it is in the desired aperture
+    (or an array of pixel weights). If flux_err is given (the FLUX_ERR column)
+    the errors are returned as well.
     """
-    
-    flux = np.array(list (map (lambda x: aperture_phot(x, aperture), flux_data) ) )
-
-    return flux
+    flux, err = tessPhot.aperturePhotometry(flux_data, aperture, flux_err)
+    if flux_err is None:
+        return flux
+    return flux, err
 #%% markdown
 """
 ### Create a photometric time series using all the pixels in the image.
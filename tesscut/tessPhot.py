@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Aperture photometry on whole TESScut (or target pixel file) flux cubes.
+
+Instead of summing image[aperture] one cadence at a time, the cube is
+viewed as a (cadences, pixels) matrix and every aperture as a column of
+pixel weights, so the light curves of all the apertures come out of one
+matrix product. Apertures can be boolean masks or weights (e.g. a PRF
+model), one or a stack of many. Errors come from FLUX_ERR, summed in
+quadrature with the squared weights.
+
+Only the pixels some aperture uses are read, and the cube is reduced
+chunkSize cadences at a time, so memory mapped cubes from many cutouts
+can be run through without loading them.
+
+Usage:
+    import tessPhot
+    hdu = fits.open('tess-s0001-4-1_cutout.fits')
+    aperture = hdu[2].data == 1
+    flux, fluxErr = tessPhot.aperturePhotometry(hdu[1].data['FLUX'], aperture,
+                                                hdu[1].data['FLUX_ERR'])
+
+    #Many cutouts, one default aperture each, a file open at a time
+    for filename, time, flux, fluxErr in tessPhot.cutoutLightcurves(files):
+        ...
+"""
+
+import numpy as np
+from astropy.io import fits
+
+#Cadences reduced at once, bounds the float64 copy of the cube
+CHUNK_SIZE = 4096
+
+
+def apertureWeights(apertures, imageShape):
+    """
+    The (napertures, pixels) float weight matrix of apertures: a 2D mask
+    or weight image, a 3D stack of them or a list. Also returns whether a
+    single aperture was given.
+    """
+    single = not isinstance(apertures, (list, tuple)) and np.ndim(apertures) == 2
+    weights = np.asarray(apertures if not single else [apertures], dtype=np.float64)
+    if weights.shape[1:] != tuple(imageShape):
+        raise ValueError("apertures are %s, the images %s"
+                         % (weights.shape[1:], tuple(imageShape)))
+    return weights.reshape(len(weights), -1), single
+
+
+def aperturePhotometry(flux, apertures, fluxErr=None, chunkSize=CHUNK_SIZE):
+    """
+    Sum the light in apertures for every image of flux (cadences, rows,
+    columns). apertures is a boolean mask, a weight image or a stack or
+    list of either. fluxErr, if given, is the matching FLUX_ERR cube.
+
+    Returns flux, fluxErr (None without fluxErr), each of shape
+    (cadences,) for one aperture or (cadences, napertures) for many.
+    As with np.sum, a NaN pixel inside an aperture makes that point NaN.
+    """
+    ncad = len(flux)
+    weights, single = apertureWeights(apertures, flux.shape[1:])
+    used = np.nonzero(weights.any(axis=0))[0]
+    if len(used) == weights.shape[1]:
+        used = slice(None)
+    weights = weights[:, used].T
+    sqWeights = weights ** 2
+    inAperture = (weights != 0).astype(np.float64)
+
+    outFlux = np.empty((ncad, weights.shape[1]))
+    outErr = np.empty((ncad, weights.shape[1])) if fluxErr is not None else None
+    for start in range(0, ncad, chunkSize):
+        stop = min(start + chunkSize, ncad)
+        pixels = np.asarray(flux[start:stop]).reshape(stop - start, -1)[:, used]
+        _nanDot(pixels.astype(np.float64), weights, inAperture,
+                outFlux[start:stop])
+        if fluxErr is not None:
+            err = np.asarray(fluxErr[start:stop]).reshape(stop - start, -1)[:, used]
+            _nanDot(err.astype(np.float64) ** 2, sqWeights, inAperture,
+                    outErr[start:stop])
+    if outErr is not None:
+        np.sqrt(outErr, out=outErr)
+
+    if single:
+        return outFlux[:, 0], (outErr[:, 0] if outErr is not None else None)
+    return outFlux, outErr
+
+
+def _nanDot(pixels, weights, inAperture, out):
+    """
+    out = pixels . weights, except that a non-finite pixel only spoils the
+    apertures it is in (0 * NaN would spoil them all). Those points are NaN,
+    as np.sum over the aperture would give.
+    """
+    bad = ~np.isfinite(pixels)
+    if not bad.any():
+        np.dot(pixels, weights, out=out)
+        return
+    pixels[bad] = 0.
+    np.dot(pixels, weights, out=out)
+    out[np.dot(bad.astype(np.float64), inAperture) > 0] = np.nan
+
+
+def cutoutLightcurves(cutouts, apertures=None, chunkSize=CHUNK_SIZE):
+    """
+    Light curves of many cutouts. cutouts are file names or open HDULists
+    (e.g. from Tesscut.get_cutouts); files are opened memory mapped one at
+    a time. apertures is one aperture (a 2D or stacked 3D array) for every
+    cutout, a list with one per cutout, or None for the pixels with data
+    (APERTURE extension == 1).
+    Yields (cutout, time, flux, fluxErr) for each cutout in turn.
+    """
+    for k, cutout in enumerate(cutouts):
+        opened = isinstance(cutout, str)
+        hdu = fits.open(cutout, memmap=True) if opened else cutout
+        try:
+            if apertures is None:
+                aperture = hdu[2].data == 1
+            elif isinstance(apertures, list):
+                aperture = apertures[k]
+            else:
+                aperture = apertures
+            data = hdu[1].data
+            flux, fluxErr = aperturePhotometry(data['FLUX'], aperture,
+                                               data['FLUX_ERR'], chunkSize)
+            yield cutout, np.array(data['TIME']), flux, fluxErr
+        finally:
+            if opened:
+                hdu.close()